@@ -0,0 +1,334 @@
+""" Compressed session archives with a chunk index.
+
+An archive holds the same records as a recording (see recording.record_dtype) in chunks of a few
+seconds, each compressed on its own: every column is delta-encoded (on its bit pattern, so it is
+lossless), byte-shuffled so each byte of each channel forms its own stream, and zlib-compressed.
+Slowly varying pressures and evenly spaced timestamps then shrink to a fraction of their raw size.
+
+    header (4 KiB, JSON)  chunk  chunk  ...  index  trailer
+
+Each chunk starts with its compressed size and record count. The index, written when the archive
+is closed, gives every chunk's offset, time range, per-channel min/max and the OR of its valve
+bits, so a time range decompresses only the chunks that overlap it, and an overview (the min/max
+envelope of a whole session) needs no decompression at all. An archive that was never closed
+(e.g. after a crash) is still readable: its chunks are scanned and the index rebuilt.
+
+Run standalone to compress a recording:
+
+    python archive.py recording.przl [archive.przz]
+"""
+import json
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+
+import export
+from data_series import DataSeries, SampleBlock
+from protocol import N_CHANNELS
+from recording import RECORDING_EXTENSION, Recorder, RecordingReader, default_channels, open_records, record_dtype
+
+ARCHIVE_MAGIC = b'PRZLARC1'
+ARCHIVE_END_MAGIC = b'PRZLEND1'
+ARCHIVE_EXTENSION = '.przz'
+HEADER_SIZE = 4096
+CHUNK_SEC = 5.0
+MAX_CHUNK_RECORDS = 1 << 16
+COMPRESSION_LEVEL = 6
+
+CHUNK_PREFIX = np.dtype([('size', '<u4'), ('n_records', '<u4')])
+TRAILER = np.dtype([('index_offset', '<u8'), ('n_chunks', '<u8'), ('magic', 'S8')])
+
+
+def index_dtype(n_channels=N_CHANNELS):
+    return np.dtype([
+        ('offset', '<u8'),  # Of the chunk's prefix
+        ('n_records', '<u4'),
+        ('t_start', '<f8'),
+        ('t_end', '<f8'),  # Last timestamp in the chunk (inclusive)
+        ('min', '<f4', (n_channels,)),
+        ('max', '<f4', (n_channels,)),
+        ('valves', 'u1'),  # Bits of every valve that was open at some point in the chunk
+    ])
+
+
+def _unsigned(dtype):
+    return np.dtype(f'<u{dtype.itemsize}')
+
+
+def encode_records(records):
+    """ Delta + byte-shuffle every field, then compress. """
+    streams = []
+    for name in records.dtype.names:
+        column = np.ascontiguousarray(records[name])
+        bits = column.view(_unsigned(column.dtype.base)).reshape(len(records), -1)
+        deltas = np.diff(bits, axis=0, prepend=np.zeros((1, bits.shape[1]), bits.dtype))
+        streams.append(deltas.view(np.uint8).reshape(len(records), bits.shape[1], -1).transpose(1, 2, 0).tobytes())
+    return zlib.compress(b''.join(streams), COMPRESSION_LEVEL)
+
+
+def decode_records(data, n_records, dtype):
+    raw = zlib.decompress(data)
+    records = np.empty(n_records, dtype=dtype)
+    position = 0
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        width = int(np.prod(field.shape, dtype=np.int64))
+        size = field.base.itemsize
+        n_bytes = n_records * width * size
+        shuffled = np.frombuffer(raw, np.uint8, n_bytes, position).reshape(width, size, n_records)
+        deltas = np.ascontiguousarray(shuffled.transpose(2, 0, 1)).view(_unsigned(field.base)).reshape(n_records, width)
+        bits = np.cumsum(deltas, axis=0, dtype=deltas.dtype)
+        records[name] = bits.view(field.base).reshape((n_records,) + field.shape)
+        position += n_bytes
+    return records
+
+
+def chunk_summary(records, offset):
+    entry = np.zeros(1, dtype=index_dtype(records.dtype['pressures'].shape[0]))[0]
+    entry['offset'] = offset
+    entry['n_records'] = len(records)
+    entry['t_start'] = records['timestamp'][0]
+    entry['t_end'] = records['timestamp'][-1]
+    entry['min'] = records['pressures'].min(axis=0)
+    entry['max'] = records['pressures'].max(axis=0)
+    entry['valves'] = np.bitwise_or.reduce(records['valves'])
+    return entry
+
+
+def make_header(metadata=None, channels=None, chunk_sec=CHUNK_SEC):
+    channels = channels or default_channels()
+    header = {
+        'version': 1,
+        'created': time.time(),
+        'record_dtype': record_dtype(len(channels)).descr,
+        'n_channels': len(channels),
+        'channels': channels,
+        'codec': 'delta-shuffle-zlib',
+        'chunk_sec': chunk_sec,
+    }
+    header.update(metadata or {})
+    encoded = json.dumps(header).encode()
+    if len(ARCHIVE_MAGIC) + 4 + len(encoded) > HEADER_SIZE:
+        raise ValueError('archive metadata too large for header')
+    return (ARCHIVE_MAGIC + len(encoded).to_bytes(4, 'little') + encoded).ljust(HEADER_SIZE, b'\0')
+
+
+def read_header(f):
+    raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE or not raw.startswith(ARCHIVE_MAGIC):
+        raise ValueError('not a pressure archive')
+    length = int.from_bytes(raw[len(ARCHIVE_MAGIC):len(ARCHIVE_MAGIC) + 4], 'little')
+    start = len(ARCHIVE_MAGIC) + 4
+    return json.loads(raw[start:start + length])
+
+
+class ArchiveWriter(Recorder):
+    """ A Recorder that writes an archive: same write()/close(), on the same background thread.
+
+    A chunk is compressed and written once it spans chunk_sec (or holds max_chunk_records), so a
+    crash loses at most the chunk being filled; the index is written by close().
+    """
+
+    def __init__(self, filename, metadata=None, channels=None, chunk_sec=CHUNK_SEC,
+                 max_chunk_records=MAX_CHUNK_RECORDS, **kwargs):
+        self.chunk_sec = chunk_sec
+        self.index = []
+        self.bytes_written = 0
+        super().__init__(filename, metadata, channels, chunk_records=max_chunk_records, **kwargs)
+
+    def _write_header(self, metadata, channels):
+        self.file.write(make_header(metadata, channels, self.chunk_sec))
+
+    def _append(self, records):
+        while len(records):
+            # Records up to the end of the current chunk's time span
+            t_start = self.chunk['timestamp'][0] if self.chunk_fill else records['timestamp'][0]
+            fits = int(np.searchsorted(records['timestamp'], t_start + self.chunk_sec))
+            n = min(fits, len(records), len(self.chunk) - self.chunk_fill)
+            self.chunk[self.chunk_fill:self.chunk_fill + n] = records[:n]
+            self.chunk_fill += n
+            records = records[n:]
+            if len(records) or self.chunk_fill == len(self.chunk):
+                self._write_chunk()
+
+    def _write_chunk(self):
+        if not self.chunk_fill:
+            return
+        records = self.chunk[:self.chunk_fill]
+        data = encode_records(records)
+        prefix = np.array([(len(data), len(records))], dtype=CHUNK_PREFIX)
+        self.index.append(chunk_summary(records, self.file.tell()))
+        self.file.write(prefix.tobytes() + data)
+        self.records_written += self.chunk_fill
+        self.bytes_written += prefix.itemsize + len(data)
+        self.chunk_fill = 0
+
+    def _sync(self):
+        # Only whole chunks are written; a partial one waits until it fills or the archive closes
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _finish(self):
+        self._write_chunk()
+        n_channels = self.chunk.dtype['pressures'].shape[0]
+        index = np.array(self.index, dtype=index_dtype(n_channels))
+        trailer = np.array([(self.file.tell(), len(index), ARCHIVE_END_MAGIC)], dtype=TRAILER)
+        self.file.write(index.tobytes() + trailer.tobytes())
+        super()._finish()
+
+    def close(self):
+        super().close()
+        if self.bytes_written:
+            print(f'  {self.bytes_written:,} bytes, {self.compression_ratio():.1f}x smaller than raw records')
+
+    def compression_ratio(self):
+        return self.records_written * self.chunk.dtype.itemsize / self.bytes_written if self.bytes_written else None
+
+
+class ArchiveReader:
+    """ Read access to an archive by time range, decompressing only the chunks it needs.
+
+    Offers the same accessors as RecordingReader where they make sense (window(), time_slice(),
+    to_data_series()); index holds one index_dtype entry per chunk.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        self.header = read_header(self.file)
+        self.n_channels = self.header['n_channels']
+        self.dtype = record_dtype(self.n_channels)
+        self.index = self._read_index()
+        self.chunks_decoded = 0
+
+    def _read_index(self):
+        size = os.path.getsize(self.filename)
+        if size >= HEADER_SIZE + TRAILER.itemsize:
+            self.file.seek(size - TRAILER.itemsize)
+            trailer = np.frombuffer(self.file.read(TRAILER.itemsize), TRAILER)[0]
+            if trailer['magic'] == ARCHIVE_END_MAGIC:
+                dtype = index_dtype(self.n_channels)
+                self.file.seek(int(trailer['index_offset']))
+                return np.frombuffer(self.file.read(int(trailer['n_chunks']) * dtype.itemsize), dtype)
+        return self._scan_chunks(size)
+
+    def _scan_chunks(self, size):
+        """ Rebuild the index of an archive that was never closed, ignoring a truncated last chunk. """
+        print(f'{self.filename} has no index (not closed cleanly?); scanning chunks')
+        entries = []
+        offset = HEADER_SIZE
+        while offset + CHUNK_PREFIX.itemsize <= size:
+            self.file.seek(offset)
+            prefix = np.frombuffer(self.file.read(CHUNK_PREFIX.itemsize), CHUNK_PREFIX)[0]
+            data = self.file.read(int(prefix['size']))
+            if len(data) < prefix['size']:
+                break
+            try:
+                records = decode_records(data, int(prefix['n_records']), self.dtype)
+            except (zlib.error, ValueError):
+                break
+            entries.append(chunk_summary(records, offset))
+            offset += CHUNK_PREFIX.itemsize + int(prefix['size'])
+        return np.array(entries, dtype=index_dtype(self.n_channels))
+
+    def close(self):
+        self.file.close()
+
+    def __len__(self):
+        return int(self.index['n_records'].sum())
+
+    def time_range(self):
+        if not len(self.index):
+            return None, None
+        return float(self.index['t_start'][0]), float(self.index['t_end'][-1])
+
+    def chunks(self, t_start=None, t_end=None):
+        """ Index positions of the chunks with samples in t_start <= t < t_end. """
+        overlap = np.ones(len(self.index), dtype=bool)
+        if t_start is not None:
+            overlap &= self.index['t_end'] >= t_start
+        if t_end is not None:
+            overlap &= self.index['t_start'] < t_end
+        return np.flatnonzero(overlap)
+
+    def read_chunk(self, i):
+        entry = self.index[i]
+        self.file.seek(int(entry['offset']))
+        prefix = np.frombuffer(self.file.read(CHUNK_PREFIX.itemsize), CHUNK_PREFIX)[0]
+        self.chunks_decoded += 1
+        return decode_records(self.file.read(int(prefix['size'])), int(prefix['n_records']), self.dtype)
+
+    def read(self, t_start=None, t_end=None):
+        """ Records with t_start <= t < t_end (everything by default). """
+        parts = [self.read_chunk(i) for i in self.chunks(t_start, t_end)]
+        if not parts:
+            return np.empty(0, dtype=self.dtype)
+        records = np.concatenate(parts)
+        timestamps = records['timestamp']
+        i0 = 0 if t_start is None else int(np.searchsorted(timestamps, t_start, side='left'))
+        i1 = len(records) if t_end is None else int(np.searchsorted(timestamps, t_end, side='left'))
+        return records[i0:i1]
+
+    def overview(self, t_start=None, t_end=None):
+        """ (t_starts, t_ends, mins, maxes) per chunk overlapping the range, straight from the index. """
+        entries = self.index[self.chunks(t_start, t_end)]
+        return entries['t_start'], entries['t_end'], entries['min'], entries['max']
+
+    def window(self, t_start, t_end=None):
+        records = self.read(t_start, t_end)
+        return records['timestamp'], records['pressures']
+
+    def time_slice(self, t_start, t_end=None):
+        """ DataSeries of the samples with t_start <= t < t_end. """
+        return DataSeries.from_arrays(*self.window(t_start, t_end))
+
+    def to_data_series(self):
+        records = self.read()
+        return DataSeries.from_arrays(records['timestamp'], records['pressures'])
+
+
+def open_reader(filename):
+    """ ArchiveReader or RecordingReader, by extension. """
+    return ArchiveReader(filename) if filename.endswith(ARCHIVE_EXTENSION) else RecordingReader(filename)
+
+
+def record_chunks(reader):
+    """ The archive's records, a chunk at a time; closes the reader when done. """
+    try:
+        for i in range(len(reader.index)):
+            yield reader.read_chunk(i)
+    finally:
+        reader.close()
+
+
+def export_csv(filename, csv_filename):
+    """ Convert an archive to CSV in the same layout as recording.export_csv, a chunk at a time. """
+    reader = ArchiveReader(filename)
+    export.write_csv(csv_filename, record_chunks(reader))
+    print(f'Exported {len(reader)} samples to {csv_filename}')
+
+
+def compress_recording(filename, archive_filename, chunk_sec=CHUNK_SEC):
+    """ Write an archive of a recording, a chunk at a time. """
+    header, records = open_records(filename)
+    metadata = {key: value for key, value in header.items()
+                if key not in ('version', 'created', 'record_dtype', 'n_channels', 'channels')}
+    writer = ArchiveWriter(archive_filename, metadata, header['channels'], chunk_sec=chunk_sec)
+    for i in range(0, len(records), MAX_CHUNK_RECORDS):
+        chunk = records[i:i + MAX_CHUNK_RECORDS]
+        valves = np.unpackbits(chunk['valves'][:, None], axis=1, bitorder='little').view(bool)
+        # Blocking put: offline there is no reason to drop anything
+        writer.queue.put(SampleBlock(np.array(chunk['timestamp']), np.array(chunk['pressures']), valves))
+    writer.close()
+    return writer
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(f'usage: python {sys.argv[0]} <recording{RECORDING_EXTENSION}> [archive{ARCHIVE_EXTENSION}]')
+        sys.exit(1)
+    source = sys.argv[1]
+    compress_recording(source, sys.argv[2] if len(sys.argv) == 3 else os.path.splitext(source)[0] + ARCHIVE_EXTENSION)
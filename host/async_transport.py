@@ -0,0 +1,214 @@
+""" asyncio ownership of serial ports.
+
+All ports share one asyncio event loop running on a background thread. Each AsyncSerialTransport
+reads its port event-driven (loop.add_reader on the port's file descriptor where there is one,
+otherwise by polling in_waiting without blocking), and writes from a queue so callers on the GUI
+thread never wait on the device. Stopping cancels the tasks immediately instead of waiting out a
+read timeout.
+
+The bridge into Qt is plain callbacks: pass a pyqtSignal's emit as on_error (or have the consumer
+emit signals) and Qt queues the call over to the receiving object's thread.
+"""
+import asyncio
+import os
+import threading
+
+POLL_INTERVAL_SEC = 0.001
+READ_CHUNK = 1 << 16
+CLOSE_TIMEOUT_SEC = 1.0
+
+_loop_thread = None
+_loop_thread_lock = threading.Lock()
+
+
+class AsyncioThread:
+    """ An asyncio event loop running forever on a daemon thread. """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='asyncio', daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        """ Schedule a coroutine from any thread; returns a concurrent.futures.Future. """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call_soon(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def call(self, fn, *args, timeout=None):
+        """ Run fn(*args) on the loop thread and wait for its result. """
+        async def run():
+            return fn(*args)
+        return self.submit(run()).result(timeout)
+
+    def stop(self):
+        """ Stop the loop and its thread. Only for loops created for a single owner. """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def get_asyncio_thread():
+    global _loop_thread
+    with _loop_thread_lock:
+        if _loop_thread is None:
+            _loop_thread = AsyncioThread()
+        return _loop_thread
+
+
+class AsyncSerialTransport:
+    """ Owns an open port (serial.Serial or anything with the same read/in_waiting/write API).
+
+    Received bytes go to consumer.feed(data). If the consumer has time_to_flush()/flush() (like
+    FrameReceiver) the read loop also wakes up to honour its delivery deadline when the line goes
+    quiet. write() is thread-safe and never blocks; close() returns once the port is closed.
+    """
+
+    def __init__(self, port, consumer=None, on_error=None, loop_thread=None):
+        self.ser = port
+        self.consumer = consumer
+        self.on_error = on_error
+        self.loop_thread = loop_thread or get_asyncio_thread()
+        self.loop = self.loop_thread.loop
+
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.writes_pending = 0
+
+        self._fd = None
+        try:
+            self._fd = port.fileno()
+        except (AttributeError, OSError, ValueError):
+            pass
+
+        self._tasks = []
+        self._readable = None
+        self._write_queue = None
+        self.loop_thread.submit(self._start()).result()
+
+    @property
+    def port(self):
+        return getattr(self.ser, 'port', None)
+
+    async def _start(self):
+        self._readable = asyncio.Event()
+        self._write_queue = asyncio.Queue()
+        if self._fd is not None:
+            # Non-blocking reads; readiness comes from the event loop
+            self.ser.timeout = 0
+            self.loop.add_reader(self._fd, self._readable.set)
+        self._tasks = [self.loop.create_task(self._read_loop()), self.loop.create_task(self._write_loop())]
+
+    def set_consumer(self, consumer, wait=True):
+        """ Swap where received bytes go (None discards them). The old consumer is flushed first, and
+        with wait set it is guaranteed not to be called again once this returns. """
+        future = self.loop_thread.submit(self._swap_consumer(consumer))
+        if wait:
+            future.result(CLOSE_TIMEOUT_SEC)
+
+    async def _swap_consumer(self, consumer):
+        if self.consumer is not None and hasattr(self.consumer, 'flush'):
+            self.consumer.flush()
+        self.consumer = consumer
+
+    def write(self, data):
+        self.loop_thread.call_soon(self._enqueue, bytes(data))
+
+    def _enqueue(self, data):
+        # On the loop thread, like the decrement in _write_loop, so the count needs no lock
+        self.writes_pending += 1
+        self._write_queue.put_nowait(data)
+
+    def close(self):
+        if self._tasks:
+            self.loop_thread.submit(self._shutdown()).result(CLOSE_TIMEOUT_SEC)
+
+    async def _shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._fd is not None:
+            self.loop.remove_reader(self._fd)
+        if self.consumer is not None and hasattr(self.consumer, 'flush'):
+            self.consumer.flush()
+        self.ser.close()
+
+    async def _wait_readable(self, timeout):
+        if self._fd is not None:
+            # A timer setting the same event rather than wait_for(), which can swallow a cancellation
+            # that races with the wait completing
+            deadline = self.loop.call_later(timeout, self._readable.set) if timeout is not None else None
+            try:
+                await self._readable.wait()
+            finally:
+                if deadline is not None:
+                    deadline.cancel()
+            self._readable.clear()
+            return self.ser.read(self.ser.in_waiting)
+
+        # No file descriptor (emulated/replayed ports, some platforms): poll without blocking
+        waited = 0.0
+        while True:
+            n = self.ser.in_waiting
+            if n:
+                return self.ser.read(min(n, READ_CHUNK))
+            if timeout is not None and waited >= timeout:
+                return b''
+            await asyncio.sleep(POLL_INTERVAL_SEC)
+            waited += POLL_INTERVAL_SEC
+
+    async def _read_loop(self):
+        try:
+            while True:
+                consumer = self.consumer
+                timeout = consumer.time_to_flush() if hasattr(consumer, 'time_to_flush') else None
+                data = await self._wait_readable(timeout)
+                consumer = self.consumer
+                if data:
+                    self.bytes_read += len(data)
+                    if consumer is not None:
+                        consumer.feed(data)
+                    # Waits that are already satisfied don't suspend; let writes and cancellation in
+                    await asyncio.sleep(0)
+                elif hasattr(consumer, 'time_to_flush') and consumer.time_to_flush() == 0:
+                    # Line went quiet: deliver what is pending on time
+                    consumer.flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._report(e)
+
+    async def _write_loop(self):
+        try:
+            while True:
+                data = await self._write_queue.get()
+                if self._fd is not None:
+                    await self._write_fd(data)
+                else:
+                    self.ser.write(data)
+                self.bytes_written += len(data)
+                self.writes_pending -= 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._report(e)
+
+    async def _write_fd(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self._fd, view):]
+            except BlockingIOError:
+                writable = self.loop.create_future()
+                self.loop.add_writer(self._fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    self.loop.remove_writer(self._fd)
+
+    def _report(self, error):
+        print(f'Serial transport error: {error}')
+        if self.on_error is not None:
+            self.on_error(str(error))
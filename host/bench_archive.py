@@ -0,0 +1,94 @@
+""" Archive size and access cost against raw recordings and CSV.
+
+Generates a session with the device emulator (valves switching every few seconds), saves it as
+CSV (DataSeries.save_to_file), as a raw recording and as an archive, then times reading the whole
+archive, a one-second window and the min/max overview. The emulator's Gaussian noise fills the
+low mantissa bits, which no lossless codec can shrink; the quantized run rounds pressures to
+QUANTUM_KPA steps, like a real sensor's ADC.
+
+Run from the host directory: python bench_archive.py [seconds] [rate_hz]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from archive import ArchiveReader, compress_recording
+from data_series import DataSeries, SampleBlock
+from device_emulator import DeviceEmulator
+from receiver import FrameReceiver
+from recording import Recorder
+
+QUANTUM_KPA = 0.01
+VALVE_PERIOD_SEC = 3.0
+
+
+def make_session(seconds, rate_hz):
+    emulator = DeviceEmulator(rate_hz=rate_hz)
+    blocks = []
+    receiver = FrameReceiver(blocks.append)
+    step = int(rate_hz * VALVE_PERIOD_SEC)
+    for k in range(int(seconds / VALVE_PERIOD_SEC)):
+        emulator.valves[:] = False
+        emulator.valves[k % len(emulator.valves)] = True
+        receiver.feed(emulator.make_frames(step))
+        receiver.flush()
+    block = SampleBlock.concatenate(blocks)
+    # Ideal timing (the receiver stamped these on arrival, all at once)
+    block.timestamps = time.time() + np.arange(len(block)) / rate_hz
+    return block
+
+
+def timed(fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1e3, result
+
+
+def run(label, block, dirname):
+    csv = os.path.join(dirname, f'{label}.csv')
+    raw = os.path.join(dirname, f'{label}.przl')
+    archived = os.path.join(dirname, f'{label}.przz')
+    DataSeries.from_arrays(block.timestamps, block.pressures).save_to_file(csv)
+    recorder = Recorder(raw)
+    recorder.write(block)
+    recorder.close()
+    ms_write, _ = timed(lambda: compress_recording(raw, archived))
+
+    sizes = {name: os.path.getsize(name) for name in (csv, raw, archived)}
+    print(f'\n{label}: {len(block):,} samples')
+    print(f'  CSV {sizes[csv] / 1e6:8.2f} MB   raw {sizes[raw] / 1e6:8.2f} MB   archive {sizes[archived] / 1e6:8.2f} MB  '
+          f'({sizes[raw] / sizes[archived]:.1f}x smaller than raw, {sizes[csv] / sizes[archived]:.1f}x than CSV)')
+    print(f'  compress      {ms_write:9.1f} ms  ({sizes[raw] / ms_write / 1e3:.0f} MB/s of records)')
+
+    reader = ArchiveReader(archived)
+    ms_full, records = timed(reader.read)
+    print(f'  read all      {ms_full:9.1f} ms  ({len(reader.index)} chunks)')
+    ms_csv, _ = timed(lambda: np.loadtxt(csv, delimiter=','))
+    print(f'  parse CSV     {ms_csv:9.1f} ms')
+    t0, t1 = reader.time_range()
+    middle = (t0 + t1) / 2
+    reader.chunks_decoded = 0
+    ms_window, _ = timed(lambda: reader.window(middle, middle + 1.0), repeat=10)
+    print(f'  1 s window    {ms_window:9.2f} ms  ({reader.chunks_decoded // 10} chunks decoded)')
+    reader.chunks_decoded = 0
+    ms_overview, _ = timed(reader.overview, repeat=100)
+    print(f'  overview      {ms_overview:9.3f} ms  ({reader.chunks_decoded} chunks decoded)')
+    reader.close()
+
+
+def main(seconds=300.0, rate_hz=1000.0):
+    block = make_session(seconds, rate_hz)
+    with tempfile.TemporaryDirectory() as dirname:
+        run('emulator', block, dirname)
+        quantized = SampleBlock(block.timestamps, (np.round(block.pressures / QUANTUM_KPA) * QUANTUM_KPA).astype(np.float32),
+                                block.valves)
+        run('quantized', quantized, dirname)
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 300.0,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 1000.0)
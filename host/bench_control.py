@@ -0,0 +1,77 @@
+""" Closed-loop control latency against the emulator.
+
+A controller on channel 0's frame numbers flips valve 0, waits until the board reports the new
+state, holds it for a few samples and flips it again. Two latencies are reported:
+
+  host      the ControlLoop's own figure: triggering sample's arrival -> VCMD handed to the transport
+  reaction  triggering frame -> first frame reporting the new valve state, on the device's clock
+            (frame numbers / rate), i.e. what the plant sees: decode, decide, send, apply, report
+
+Run from the host directory: python bench_control.py [seconds]
+"""
+import contextlib
+import io
+import sys
+import time
+
+import numpy as np
+
+from control_loop import Controller
+from device_emulator import DeviceEmulator, EmulatedPort
+from device_manager import DeviceManager
+from protocol import CHANNEL_RESET, CHANNEL_SET
+
+SEQUENCE_CHANNEL = 1
+HOLD_SAMPLES = 5
+
+
+class FlipOnFeedback(Controller):
+    def __init__(self):
+        self.reaction_frames = []
+        self.reset()
+
+    def reset(self):
+        self.wanted = None
+        self.trigger = None
+        self.hold_until = 0
+
+    def on_sample(self, t, pressures, valves):
+        seq = pressures[SEQUENCE_CHANNEL]
+        if self.wanted is not None:
+            if valves[0] == self.wanted:
+                self.reaction_frames.append(seq - self.trigger)
+                self.wanted = None
+                self.hold_until = seq + HOLD_SAMPLES
+            return None
+        if seq >= self.hold_until:
+            self.wanted, self.trigger = not valves[0], seq
+            return {0: CHANNEL_SET if self.wanted else CHANNEL_RESET}
+        return None
+
+
+def run(rate_hz, seconds):
+    manager = DeviceManager(lod=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        board = manager.add_port(EmulatedPort(DeviceEmulator(rate_hz=rate_hz, noise_kpa=0,
+                                                             sequence_channel=SEQUENCE_CHANNEL), timeout=0.1))
+        controller = FlipOnFeedback()
+        board.add_controller(controller)
+        time.sleep(seconds)
+        stats = board.stats()
+        manager.close()
+
+    reaction = np.array(controller.reaction_frames) / rate_hz * 1e3
+    p50, p99 = np.percentile(reaction, (50, 99)) if len(reaction) else (np.nan, np.nan)
+    print(f"{rate_hz:>9,.0f} Hz  {stats['control_commands']:>5} commands  "
+          f"host ms p50 {stats['control_latency_ms_p50']:6.3f} p99 {stats['control_latency_ms_p99']:6.3f}  "
+          f"reaction ms p50 {p50:6.3f} p99 {p99:6.3f}  "
+          f"callback {stats['control_us_per_sample']:.2f} us/sample")
+
+
+def main(seconds=3.0):
+    for rate_hz in (1000.0, 10000.0, 100000.0):
+        run(rate_hz, seconds)
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 3.0)
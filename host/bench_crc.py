@@ -0,0 +1,60 @@
+""" Packets/sec of the old per-packet crcmod CRC vs. the table-driven stm32_crc engine.
+
+Run from the host directory: python bench_crc.py [n_packets]
+"""
+import struct
+import sys
+import time
+
+import numpy as np
+
+from stm32_crc import crc32_stm, crc32_stm_batch
+
+try:
+    import crcmod
+except ImportError:
+    crcmod = None
+
+RX_CRC_BYTES = 40  # PRZL frame without the trailing CRC word
+
+
+def crcmod_per_packet(data):
+    pcrc = crcmod.Crc(0x104c11db7, initCrc=0xffffffff, rev=False)
+    pcrc.update(data)
+    return pcrc.crcValue
+
+
+def make_packets(n):
+    packets = []
+    for i in range(n):
+        packets.append(b'PRZL' + struct.pack('<8fB3x', *np.random.randn(8), i & 0xFF))
+    return packets
+
+
+def bench(name, fn, n):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f'{name:<28} {n / elapsed:>14,.0f} packets/sec')
+    return n / elapsed
+
+
+def main(n=20000):
+    packets = make_packets(n)
+    frames = np.frombuffer(b''.join(packets), dtype=np.uint8).reshape(n, RX_CRC_BYTES)
+    reference = [crc32_stm(p) for p in packets]
+
+    if crcmod is not None:
+        assert [crcmod_per_packet(p) for p in packets[:100]] == reference[:100]
+        bench('crcmod.Crc per packet', lambda: [crcmod_per_packet(p) for p in packets], n)
+    else:
+        print('crcmod not installed, skipping baseline')
+
+    bench('crc32_stm', lambda: [crc32_stm(p) for p in packets], n)
+
+    assert list(crc32_stm_batch(frames)) == reference
+    bench('crc32_stm_batch', lambda: crc32_stm_batch(frames), n)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,43 @@
+""" Multi-board throughput: total samples/sec as emulated boards are added to a DeviceManager.
+
+Each board runs at the same frame rate on its own event loop thread; if reading scales, the total
+grows with the number of boards until the CPU (which also runs the emulators) is saturated.
+
+Run from the host directory: python bench_devices.py [seconds] [rate_hz]
+"""
+import contextlib
+import io
+import sys
+import time
+
+from device_emulator import DeviceEmulator, EmulatedPort
+from device_manager import DeviceManager
+
+
+def run(n_boards, rate_hz, seconds):
+    manager = DeviceManager(max_samples=int(rate_hz * seconds * 2))
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(n_boards):
+            manager.add_port(EmulatedPort(DeviceEmulator(rate_hz=rate_hz, noise_kpa=0), timeout=0.1))
+        manager.start()
+        manager.stats()
+        time.sleep(seconds)
+        stats = manager.stats()
+        manager.stop()
+        manager.close()
+
+    rates = [s['samples_per_sec'] for s in stats.values()]
+    print(f'{n_boards:>2} boards  total {sum(rates):>12,.0f} samples/s  per board '
+          f'{min(rates):>10,.0f} .. {max(rates):>10,.0f}  CRC errors {sum(s["crc_dropped"] for s in stats.values())}')
+    return sum(rates)
+
+
+def main(seconds=2.0, rate_hz=100000.0):
+    print(f'{rate_hz:,.0f} Hz per board, {seconds:g} s per run')
+    for n_boards in (1, 2, 4, 8):
+        run(n_boards, rate_hz, seconds)
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 2.0,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 100000.0)
@@ -0,0 +1,121 @@
+""" Throughput and resync cost of FrameParser vs. the old byte-at-a-time SerialWorker loop.
+
+A byte stream of PRZL frames with interleaved ACK!s and random garbage bursts is replayed
+through an in-memory port that hands out at most one USB-sized chunk per read.
+
+Run from the host directory: python bench_frame_parser.py [n_frames] [garbage_fraction]
+"""
+import io
+import random
+import struct
+import sys
+import time
+
+from frame_parser import FrameParser
+from stm32_crc import crc32_stm
+
+MAGIC = b'PRZL'
+MAGIC_ACK = b'ACK!'
+RX_PACKET_SIZE = 44
+
+
+class ReplayPort:
+    """ Minimal stand-in for serial.Serial that replays a recorded byte stream. """
+
+    def __init__(self, data, chunk_size=4096):
+        self.stream = io.BytesIO(data)
+        self.remaining = len(data)
+        self.chunk_size = chunk_size
+        self.reads = 0
+
+    @property
+    def in_waiting(self):
+        return min(self.remaining, self.chunk_size)
+
+    def read(self, n):
+        self.reads += 1
+        data = self.stream.read(n)
+        self.remaining -= len(data)
+        return data
+
+
+def make_frame(i):
+    body = MAGIC + struct.pack('<8fB3x', *[float(i + c) for c in range(8)], i & 0xFF)
+    return body + struct.pack('<I', crc32_stm(body))
+
+
+def make_stream(n_frames, garbage_fraction, seed=0):
+    rng = random.Random(seed)
+    parts = []
+    n_garbage = 0
+    for i in range(n_frames):
+        parts.append(make_frame(i))
+        if i % 50 == 0:
+            parts.append(MAGIC_ACK)
+        if rng.random() < garbage_fraction:
+            garbage = bytes(rng.getrandbits(8) for _ in range(rng.randint(1, 64)))
+            parts.append(garbage)
+            n_garbage += len(garbage)
+    return b''.join(parts), n_garbage
+
+
+def legacy_parse(ser):
+    """ The receive loop from the original SerialWorker.start_work, minus Qt and printing. """
+    frames = acks = discarded = 0
+    raw_data = bytearray(ser.read(4))
+    while ser.remaining > 0 or len(raw_data) >= 4:
+        header = bytes(raw_data[0:4])
+        if header == MAGIC:
+            if len(raw_data) >= RX_PACKET_SIZE:
+                frames += 1
+                raw_data.clear()
+                raw_data.extend(ser.read(4))
+                continue
+        elif header == MAGIC_ACK:
+            acks += 1
+            raw_data.clear()
+            raw_data.extend(ser.read(4))
+            continue
+        elif len(raw_data) >= 4:
+            raw_data.pop(0)
+            raw_data.extend(ser.read(1))
+            discarded += 1
+            continue
+        if ser.remaining == 0:
+            break
+        raw_data.extend(ser.read(1))
+    return frames, acks, discarded
+
+
+def new_parse(ser):
+    parser = FrameParser({MAGIC: RX_PACKET_SIZE, MAGIC_ACK: len(MAGIC_ACK)})
+    frames = acks = 0
+    while ser.remaining > 0:
+        parser.read_from(ser)
+        for magic, frame in parser.frames():
+            if magic == MAGIC:
+                frames += 1
+            else:
+                acks += 1
+    return frames, acks, parser.bytes_discarded
+
+
+def run(name, parse, stream):
+    ser = ReplayPort(stream)
+    start = time.perf_counter()
+    frames, acks, discarded = parse(ser)
+    elapsed = time.perf_counter() - start
+    print(f'{name:<10} {len(stream) / elapsed / 1e6:8.2f} MB/s  {frames / elapsed:>12,.0f} frames/s  '
+          f'frames={frames} acks={acks} discarded={discarded} reads={ser.reads}')
+
+
+def main(n_frames=20000, garbage_fraction=0.05):
+    stream, n_garbage = make_stream(n_frames, garbage_fraction)
+    print(f'{len(stream)} bytes, {n_frames} frames, {n_garbage} garbage bytes injected')
+    run('legacy', legacy_parse, stream)
+    run('parser', new_parse, stream)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 0.05)
@@ -0,0 +1,82 @@
+""" Full-history zoom cost with and without the MinMaxPyramid level-of-detail index.
+
+Writes a synthetic 8-channel recording to disk as memory-mapped .npy files, builds and saves the
+index, reopens it, and times a full-history query at a typical plot width. The baseline is
+peak-downsampling every sample for every frame, which is what pyqtgraph has to do without the index.
+
+Run from the host directory: python bench_lod.py [n_samples] [width_px]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from data_series import DataSeries
+from minmax_pyramid import MinMaxPyramid
+
+N_CHANNELS = 8
+
+
+def write_recording(dirname, n, chunk=1 << 20):
+    timestamps = np.lib.format.open_memmap(os.path.join(dirname, 'timestamps.npy'), mode='w+',
+                                           dtype=np.float64, shape=(n,))
+    values = np.lib.format.open_memmap(os.path.join(dirname, 'values.npy'), mode='w+',
+                                       dtype=np.float32, shape=(n, N_CHANNELS))
+    rng = np.random.default_rng(0)
+    for i in range(0, n, chunk):
+        m = min(chunk, n - i)
+        timestamps[i:i + m] = np.arange(i, i + m) * 1e-3
+        values[i:i + m] = rng.standard_normal((m, N_CHANNELS), dtype=np.float32)
+    timestamps.flush()
+    values.flush()
+
+
+def peak_downsample(values, width):
+    """ Full-resolution min/max over every sample, one bucket per pixel. """
+    n = len(values) // width * width
+    buckets = values[:n].reshape(width, -1, values.shape[1])
+    return buckets.min(axis=1), buckets.max(axis=1)
+
+
+def timed(fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1e3, result
+
+
+def main(n=5_000_000, width=1920):
+    with tempfile.TemporaryDirectory() as dirname:
+        write_recording(dirname, n)
+        source = DataSeries.from_arrays(np.load(os.path.join(dirname, 'timestamps.npy'), mmap_mode='r'),
+                                        np.load(os.path.join(dirname, 'values.npy'), mmap_mode='r'))
+        t0, t1 = source.timestamps[0], source.timestamps[-1]
+        print(f'{n:,} samples x {N_CHANNELS} channels on disk, width {width}px')
+
+        ms, _ = timed(lambda: peak_downsample(source.values, width), repeat=3)
+        print(f'peak downsample of full history   {ms:10.2f} ms/frame')
+
+        def build():
+            pyramid = MinMaxPyramid(source)
+            pyramid.update()
+            return pyramid
+
+        ms, pyramid = timed(build)
+        print(f'build index (one-off)             {ms:10.2f} ms')
+        index_dir = os.path.join(dirname, 'lod')
+        pyramid.save(index_dir)
+        ms, pyramid = timed(lambda: MinMaxPyramid.load(index_dir, source))
+        print(f'load saved index                  {ms:10.2f} ms')
+
+        ms, (x, _) = timed(lambda: [pyramid.query(c, t0, t1, width) for c in range(N_CHANNELS)][0], repeat=20)
+        print(f'full-history query, all channels  {ms:10.2f} ms/frame  ({len(x)} points/channel)')
+        mid = (t0 + t1) / 2
+        ms, (x, _) = timed(lambda: [pyramid.query(c, mid, mid + 60, width) for c in range(N_CHANNELS)][0], repeat=20)
+        print(f'60 s zoom query, all channels     {ms:10.2f} ms/frame  ({len(x)} points/channel)')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 1920)
@@ -0,0 +1,111 @@
+""" End-to-end receive pipeline benchmark against the device emulator (no hardware needed).
+
+Runs the real SerialWorker reading an EmulatedPort, driven either by an AsyncSerialTransport (as in
+the GUI) or by its blocking loop on a QThread, and receives its sample blocks on the main thread.
+The emulator puts the frame number in the last channel, so for each run we report sustained
+packets/sec, dropped frames (CRC failures plus frames lost to buffer overflow) and frame-due ->
+GUI-thread latency percentiles.
+
+Run from the host directory: python bench_pipeline.py [seconds] [rate_hz ...]
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5 import QtCore
+
+from async_transport import AsyncSerialTransport
+from data_series import SampleBlock
+from device_emulator import DeviceEmulator, EmulatedPort
+from protocol import N_CHANNELS
+from serial_comms import SerialWorker
+
+SEQUENCE_CHANNEL = N_CHANNELS - 1
+
+
+class Receiver(QtCore.QObject):
+    start_sig = QtCore.pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.sequences = []
+        self.latencies = []
+
+    @QtCore.pyqtSlot(SampleBlock)
+    def on_block(self, block):
+        now = time.monotonic()
+        seq = block.pressures[:, SEQUENCE_CHANNEL].astype(np.int64)
+        self.sequences.append(seq)
+        self.latencies.append(now - (self.emulator.start_time + seq / self.emulator.rate_hz))
+
+    def on_valves(self, states):
+        pass
+
+
+def run(rate_hz, seconds, corrupt_rate=0.0, garbage_rate=0.0, transport='asyncio'):
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication(sys.argv)
+    emulator = DeviceEmulator(rate_hz=rate_hz, noise_kpa=0, corrupt_rate=corrupt_rate,
+                              garbage_rate=garbage_rate, sequence_channel=SEQUENCE_CHANNEL, seed=0)
+    port = EmulatedPort(emulator, timeout=0.1)
+
+    receiver = Receiver()
+    receiver.emulator = emulator
+    worker = SerialWorker(port, data_rx_slot=receiver.on_block, valve_rx_slot=receiver.on_valves)
+    if transport == 'asyncio':
+        async_transport = AsyncSerialTransport(port)
+    else:
+        thread = QtCore.QThread()
+        worker.moveToThread(thread)
+        thread.start()
+        receiver.start_sig.connect(worker.start_work)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        emulator.start_time = time.monotonic()
+        if transport == 'asyncio':
+            async_transport.set_consumer(worker.receiver)
+        else:
+            receiver.start_sig.emit()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+        stop_start = time.monotonic()
+        if transport == 'asyncio':
+            async_transport.close()
+        else:
+            worker.stop_work()
+            thread.quit()
+            thread.wait()
+        stop_time = time.monotonic() - stop_start
+        app.processEvents()
+    elapsed = time.monotonic() - emulator.start_time
+
+    sequences = np.concatenate(receiver.sequences) if receiver.sequences else np.empty(0, np.int64)
+    latencies = np.concatenate(receiver.latencies) if receiver.latencies else np.zeros(1)
+    received = len(sequences)
+    dropped = emulator.frames_sent - received
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1e3
+    print(f'{transport:>8} {rate_hz:>10,.0f} Hz  {received / elapsed:>12,.0f} pkt/s  dropped {dropped:>7} '
+          f'({dropped / max(emulator.frames_sent, 1):6.2%})  latency ms p50 {p50:7.2f}  p90 {p90:7.2f}  '
+          f'p99 {p99:7.2f}  max {latencies.max() * 1e3:7.2f}  stop {stop_time * 1e3:7.2f}')
+    return {'transport': transport, 'rate_hz': rate_hz, 'packets_per_sec': received / elapsed, 'dropped': int(dropped),
+            'latency_ms': {'p50': p50, 'p90': p90, 'p99': p99}, 'stop_ms': stop_time * 1e3}
+
+
+def main(seconds=2.0, rates=(100, 1000, 10000, 100000, 1000000)):
+    print(f'{seconds:g} s per run')
+    for transport in ('asyncio', 'thread'):
+        for rate in rates:
+            run(rate, seconds, transport=transport)
+    print('with 0.1% corrupted frames and 1% garbage bursts:')
+    run(1000, seconds, corrupt_rate=0.001, garbage_rate=0.01)
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 2.0,
+         [float(r) for r in sys.argv[2:]] or (100, 1000, 10000, 100000, 1000000))
@@ -0,0 +1,85 @@
+""" GUI cold-start time: from launching the process to the window's first paint and to fully ready.
+
+Each run starts a fresh interpreter (so imports are cold, as for a user double-clicking the GUI)
+which reports, in seconds since launch:
+    import       monitor_GUI and its dependencies imported
+    construct    Application built
+    first_frame  first paint of the window
+    ready        deferred plots and device controls built, serial ports listed
+
+Run from the host directory: python bench_startup.py [runs]
+Set QT_QPA_PLATFORM=offscreen to run without a display.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+STAGES = ('import', 'construct', 'first_frame', 'ready')
+TIMEOUT_SEC = 60
+
+
+def run_once():
+    """ Launch a child GUI process and return its stage times. """
+    launched = time.time()
+    result = subprocess.run([sys.executable, os.path.realpath(__file__), '--child', repr(launched)],
+                            capture_output=True, text=True, timeout=TIMEOUT_SEC,
+                            cwd=os.path.dirname(os.path.realpath(__file__)))
+    for line in result.stdout.splitlines():
+        if line.startswith('{'):
+            return json.loads(line)
+    raise RuntimeError(f'Startup child failed:\n{result.stdout}{result.stderr}')
+
+
+def child(launched):
+    marks = {}
+
+    def mark(stage):
+        marks.setdefault(stage, time.time() - launched)
+
+    from PyQt5 import QtCore, QtWidgets
+    import monitor_GUI
+    mark('import')
+
+    class PaintWatcher(QtCore.QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QtCore.QEvent.Paint:
+                mark('first_frame')
+            return False
+
+    app = QtWidgets.QApplication(sys.argv)
+    window = monitor_GUI.Application()
+    mark('construct')
+    watcher = PaintWatcher()
+    window.installEventFilter(watcher)
+
+    def check_ready():
+        if window.startup_finished and 'first_frame' in marks and any(window.graphs) \
+                and window.serial_conn_ctl.refresh_button.isEnabled():
+            mark('ready')
+            print(json.dumps(marks), flush=True)
+            os._exit(0)  # Skip teardown, it isn't part of startup
+
+    poll = QtCore.QTimer()
+    poll.timeout.connect(check_ready)
+    poll.start(1)
+    window.show()
+    app.exec_()
+
+
+def main(runs=5):
+    results = [run_once() for _ in range(runs)]
+    print(f"{'stage':<12}{'best':>10}{'median':>10}  (seconds since launch, {runs} runs)")
+    for stage in STAGES:
+        times = [r[stage] for r in results]
+        print(f'{stage:<12}{min(times):10.3f}{np.median(times):10.3f}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--child':
+        child(float(sys.argv[2]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,341 @@
+""" Benchmark suite for the host pipeline, with JSON results and regression checks.
+
+Runs offline (emulated data, offscreen Qt) and times each benchmark as seconds per operation
+(a packet, a frame, a sample, a plot frame or a GUI start), taking the best of several rounds.
+Results are saved as JSON named after the current commit, so runs on different commits can be
+compared:
+
+    python bench_suite.py                                   # run all, save bench_results/<commit>.json
+    python bench_suite.py --compare bench_results/abc123.json --threshold 0.2
+    python bench_suite.py --filter plot --quick
+
+With --compare, any benchmark more than --threshold slower than the baseline is reported and the
+exit status is 1. The focused bench_*.py scripts cover individual subsystems in more depth.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import export
+from data_series import DataPoint, DataSeries
+from device_emulator import DeviceEmulator
+from frame_parser import FrameParser
+from minmax_pyramid import MinMaxPyramid
+from protocol import (CHANNEL_SET, CHANNEL_TOGGLE, MAGIC, MAGIC_ACK, RX_PACKET_SIZE, create_tx_autoctl_packet,
+                      create_tx_set_packet)
+from receiver import FrameReceiver
+from running_stats import RunningStats
+from stm32_crc import crc32_stm, crc32_stm_batch
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'bench_results')
+DEFAULT_THRESHOLD = 0.2  # Fractional slowdown that counts as a regression
+MIN_ROUND_SEC = 0.05
+ROUNDS = 5
+PLOT_SIZES = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7)
+QUICK_PLOT_SIZES = PLOT_SIZES[:4]
+PLOT_WIDTH_PX = 1200
+READ_CHUNK = 4096  # Bytes per simulated port read
+
+BENCHMARKS = []
+
+
+def benchmark(name, unit):
+    """ Register fn(), which returns (run, ops): run() does ops operations and is timed. A run
+    with run.self_timed set returns its own duration instead (e.g. measured in another process). """
+    def register(fn):
+        BENCHMARKS.append((name, unit, fn))
+        return fn
+    return register
+
+
+def measure(run, ops, rounds=ROUNDS, min_round_sec=MIN_ROUND_SEC):
+    """ (best, median) seconds per operation; run() is repeated within a round until it takes
+    at least min_round_sec, so fast operations aren't dominated by timer resolution. """
+    if getattr(run, 'self_timed', False):
+        times = [run() / ops for _ in range(rounds)]
+        return min(times), float(np.median(times))
+    start = time.perf_counter()
+    run()
+    once = time.perf_counter() - start
+    loops = max(int(min_round_sec / max(once, 1e-9)), 1)
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        times.append((time.perf_counter() - start) / (loops * ops))
+    return min(times), float(np.median(times))
+
+
+@benchmark('packet.set', 'packet')
+def bench_set_packet():
+    actions = {1: CHANNEL_SET, 3: CHANNEL_TOGGLE}
+    return lambda: [create_tx_set_packet(actions) for _ in range(1000)], 1000
+
+
+@benchmark('packet.autoctl', 'packet')
+def bench_autoctl_packet():
+    return lambda: [create_tx_autoctl_packet(2, True, False, 5, 50.0, 0.5) for _ in range(1000)], 1000
+
+
+def _frames(n, **emulator_options):
+    return DeviceEmulator(rate_hz=1000, seed=0, **emulator_options).make_frames(n)
+
+
+@benchmark('crc.single', 'packet')
+def bench_crc_single():
+    body = _frames(1)[:RX_PACKET_SIZE - 4]
+    return lambda: [crc32_stm(body) for _ in range(1000)], 1000
+
+
+@benchmark('crc.batch', 'packet')
+def bench_crc_batch():
+    raw = np.frombuffer(_frames(10000), np.uint8).reshape(-1, RX_PACKET_SIZE)[:, :-4]
+    return lambda: crc32_stm_batch(raw), len(raw)
+
+
+def _parse(stream):
+    parser = FrameParser({MAGIC: RX_PACKET_SIZE, MAGIC_ACK: len(MAGIC_ACK)})
+    for i in range(0, len(stream), READ_CHUNK):
+        parser.feed(stream[i:i + READ_CHUNK])
+        for _ in parser.runs():
+            pass
+
+
+@benchmark('parse.clean', 'frame')
+def bench_parse_clean():
+    stream = _frames(20000)
+    return lambda: _parse(stream), 20000
+
+
+@benchmark('parse.corrupt', 'frame')
+def bench_parse_corrupt():
+    # 0.1% of frames with a bad byte, a garbage burst after 1% of them
+    stream = _frames(20000, corrupt_rate=0.001, garbage_rate=0.01)
+    return lambda: _parse(stream), 20000
+
+
+def _receive(stream, chunk):
+    with contextlib.redirect_stdout(io.StringIO()):
+        receiver = FrameReceiver(lambda block: None)
+        for i in range(0, len(stream), chunk):
+            receiver.feed(stream[i:i + chunk])
+        receiver.flush()
+
+
+@benchmark('receive.bulk', 'frame')
+def bench_receive_bulk():
+    """ Parse, CRC, timestamps and delivery, with reads as large as a busy USB port gives. """
+    stream = _frames(20000, corrupt_rate=0.001, garbage_rate=0.01)
+    return lambda: _receive(stream, READ_CHUNK), 20000
+
+
+@benchmark('receive.per_frame', 'frame')
+def bench_receive_per_frame():
+    """ The same with one frame per read, as at low sample rates. """
+    stream = _frames(1000)
+    return lambda: _receive(stream, RX_PACKET_SIZE), 1000
+
+
+def _series(n, n_channels=8):
+    rng = np.random.default_rng(0)
+    return np.arange(n) * 1e-3, rng.standard_normal((n, n_channels)).astype(np.float32)
+
+
+@benchmark('data_series.add_point', 'sample')
+def bench_add_point():
+    timestamps, values = _series(10000)
+    points = [DataPoint(t, list(v)) for t, v in zip(timestamps.tolist(), values)]
+
+    def run():
+        series = DataSeries(n_channels=8)
+        for point in points:
+            series.add_point(point)
+    return run, len(points)
+
+
+@benchmark('data_series.append_from', 'sample')
+def bench_append_from():
+    blocks = [DataSeries.from_arrays(*_series(100)) for _ in range(100)]
+
+    def run():
+        series = DataSeries(n_channels=8)
+        for block in blocks:
+            series.append_from(block)
+    return run, 100 * 100
+
+
+@benchmark('data_series.ring_append', 'sample')
+def bench_ring_append():
+    timestamps, values = _series(1000)
+
+    def run():
+        series = DataSeries(n_channels=8, max_samples=50000)
+        for _ in range(100):
+            series.append(timestamps, values)
+    return run, 100 * 1000
+
+
+@benchmark('data_series.save_to_file', 'sample')
+def bench_save_to_file():
+    series = DataSeries.from_arrays(*_series(20000))
+    filename = os.path.join(tempfile.gettempdir(), 'bench_suite.csv')
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            series.save_to_file(filename)
+    return run, len(series)
+
+
+@benchmark('stats.update', 'sample')
+def bench_stats_update():
+    """ Session and 10 s window statistics, fed 10-sample blocks as at low sample rates. """
+    timestamps, values = _series(10000)
+
+    def run():
+        stats = RunningStats(8)
+        for i in range(0, len(timestamps), 10):
+            stats.update(timestamps[i:i + 10], values[i:i + 10])
+    return run, len(timestamps)
+
+
+@benchmark('export.npy', 'sample')
+def bench_export_npy():
+    timestamps, values = _series(100000)
+    filename = os.path.join(tempfile.gettempdir(), 'bench_suite.npy')
+    return lambda: export.write_npy(filename, export.array_chunks(timestamps, values), len(timestamps)), len(timestamps)
+
+
+def _plot_benchmark(n):
+    def setup():
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        import pyqtgraph as pg
+        from PyQt5 import QtWidgets
+
+        app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+        widget = pg.PlotWidget()
+        widget.resize(PLOT_WIDTH_PX, 400)
+        widget.show()
+        curve = widget.plot()
+        t = np.arange(n) * 1e-3
+        values = (np.sin(t)[:, None] + np.random.default_rng(0).normal(0, 0.1, (n, 1))).astype(np.float32)
+        series = DataSeries.from_arrays(t, values)
+        pyramid = MinMaxPyramid(series)
+        pyramid.update()
+
+        def run():
+            # One GUI frame at full zoom-out: level-of-detail query, hand over and paint
+            x, y = pyramid.query(0, -np.inf, np.inf, PLOT_WIDTH_PX)
+            curve.setData(x=np.array(x), y=np.array(y))
+            widget.repaint()
+            app.processEvents()
+        run.widget = widget  # Keep the window alive while timing
+        return run, 1
+    return setup
+
+
+def _register_plot_benchmarks(sizes):
+    for n in sizes:
+        benchmark(f'plot.frame.{n:.0e}'.replace('+0', ''), 'frame')(_plot_benchmark(n))
+
+
+def _startup_benchmark(stage):
+    def setup():
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')  # Inherited by the GUI process
+        import bench_startup
+
+        def run():
+            return bench_startup.run_once()[stage]
+        run.self_timed = True
+        return run, 1
+    return setup
+
+
+for _stage in ('first_frame', 'ready'):
+    benchmark(f'startup.{_stage}', 'start')(_startup_benchmark(_stage))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.realpath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(name_filter=None):
+    results = {}
+    for name, unit, setup in BENCHMARKS:
+        if name_filter and name_filter not in name:
+            continue
+        run, ops = setup()
+        best, median = measure(run, ops)
+        results[name] = {'unit': unit, 'seconds': best, 'median_seconds': median}
+        print(f'{name:<28} {best * 1e6:12.3f} us/{unit:<7} ({1 / best:>14,.0f} {unit}s/s)')
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Print the change of every benchmark in both runs; returns the names that regressed. """
+    regressions = []
+    print(f"\nvs {baseline.get('commit') or 'baseline'} (threshold +{threshold:.0%}):")
+    for name, result in results.items():
+        if name not in baseline['results']:
+            continue
+        ratio = result['seconds'] / baseline['results'][name]['seconds']
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        elif ratio < 1 / (1 + threshold):
+            flag = '  faster'
+        print(f'{name:<28} {ratio:8.2f}x{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', help='Only run benchmarks whose name contains this')
+    parser.add_argument('--quick', action='store_true', help=f'Plot at most {QUICK_PLOT_SIZES[-1]:,} samples')
+    parser.add_argument('--out', help=f'Results file (default {RESULTS_DIR}/<commit>.json)')
+    parser.add_argument('--compare', metavar='BASELINE', help='Results file to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Slowdown (fraction) that counts as a regression')
+    args = parser.parse_args()
+
+    _register_plot_benchmarks(QUICK_PLOT_SIZES if args.quick else PLOT_SIZES)
+    commit = git_commit()
+    results = run_suite(args.filter)
+    report = {
+        'commit': commit,
+        'time': time.time(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'results': results,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"{commit or time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f'Saved {out}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
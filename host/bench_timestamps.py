@@ -0,0 +1,58 @@
+""" Timestamp accuracy: arrival-time stamps vs SampleClock's reconstructed ones.
+
+The emulator's channel 0 carries the frame number, and frame n is due at a known time, so every
+sample's true time is known. The reader wakes at random 1-8 ms intervals to mimic USB CDC bursts.
+Errors are reported after removing the constant part (the fixed transport latency), since what
+matters for derivatives is the spread and the spacing between consecutive samples.
+
+Run from the host directory: python bench_timestamps.py [seconds] [rate_hz]
+"""
+import sys
+import time
+
+import numpy as np
+
+from data_series import SampleBlock
+from device_emulator import DeviceEmulator, EmulatedPort
+from receiver import FrameReceiver
+from timestamping import now
+
+BURST_INTERVAL_SEC = (0.001, 0.008)
+
+
+def summarize(label, error, period):
+    error = (error - np.median(error)) * 1e3
+    spacing = np.diff(error)
+    print(f'{label:>9}: error std {error.std():7.3f} ms  p99 {np.percentile(np.abs(error), 99):7.3f} ms  '
+          f'spacing std {spacing.std():7.3f} ms (nominal spacing {period * 1e3:.3f} ms)')
+
+
+def main(seconds=5.0, rate_hz=1000.0):
+    emulator = DeviceEmulator(rate_hz=rate_hz, noise_kpa=0, sequence_channel=0)
+    port = EmulatedPort(emulator, timeout=0)
+    blocks = []
+    receiver = FrameReceiver(blocks.append)
+    rng = np.random.default_rng(0)
+
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        time.sleep(rng.uniform(*BURST_INTERVAL_SEC))
+        receiver.read_from(port)
+    receiver.flush()
+    port.close()
+
+    block = SampleBlock.concatenate(blocks)
+    truth = emulator.frame_time(block.pressures[:, 0].astype(np.float64)) + (now() - time.monotonic())
+    # Skip the first second, while the clock model is still converging
+    settled = block.timestamps >= block.timestamps[0] + 1.0
+    print(f'{len(block)} samples at {rate_hz:,.0f} Hz over {seconds:g} s')
+    summarize('arrival', block.arrival_times[settled] - truth[settled], 1 / rate_hz)
+    summarize('smoothed', block.timestamps[settled] - truth[settled], 1 / rate_hz)
+    stats = receiver.clock.stats()
+    print(f"clock: {stats['rate_hz']:,.3f} Hz fitted  latency {stats['latency_ms']:.2f} ms  "
+          f"jitter {stats['jitter_ms']:.2f} ms  {stats['burst_mean']:.1f} samples/burst (max {stats['burst_max']})")
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 5.0,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 1000.0)
@@ -0,0 +1,233 @@
+""" Sends commands to a board and matches them to its ACK!s.
+
+The firmware answers every command with a bare ACK! (no sequence number) in the order they were
+received, and silently drops commands that fail their CRC. So ACKs are matched to in-flight commands
+first in, first out. When one is lost, a later command's ACK is taken for it and there is no telling
+which one went missing; commands are therefore only confirmed once every command sent has been
+acknowledged (nothing left in flight). If the oldest in-flight command times out, everything sent
+since the last confirmation is resent, which is safe because SET/RESET, AUTO and CALB are idempotent
+(a TOGGLE could end up applied twice). Resends go out one at a time, so each ACK confirms exactly one
+command, before the full window is used again.
+
+Commands are keyed by what they control. While a command for a key is waiting to be sent or is in
+flight, newer commands for the same key replace the waiting one instead of queueing behind it: only
+the latest AUTO setpoint for a channel is sent, and manual valve changes for any channels are merged
+into a single 8-channel VCMD frame.
+"""
+import asyncio
+import collections
+import threading
+import time
+
+import numpy as np
+
+from protocol import (CHANNEL_NOP, CHANNEL_RESET, CHANNEL_SET, CHANNEL_TOGGLE, create_tx_autoctl_packet,
+                      create_tx_calib_packet, create_tx_set_packet)
+
+MAX_IN_FLIGHT = 4
+ACK_TIMEOUT_SEC = 0.25
+MAX_RETRIES = 3
+RTT_HISTORY = 1000
+
+VALVES_KEY = 'valves'
+CALIBRATION_KEY = 'calibration'
+
+
+def merge_valve_actions(earlier, later):
+    """ The single set of per-channel actions equivalent to applying earlier, then later. """
+    merged = dict(earlier)
+    for channel, action in later.items():
+        previous = merged.get(channel, CHANNEL_NOP)
+        if action == CHANNEL_TOGGLE and previous in (CHANNEL_SET, CHANNEL_RESET):
+            action = CHANNEL_RESET if previous == CHANNEL_SET else CHANNEL_SET
+        elif action == CHANNEL_TOGGLE and previous == CHANNEL_TOGGLE:
+            action = CHANNEL_NOP
+        elif action == CHANNEL_NOP:
+            action = previous
+
+        if action == CHANNEL_NOP:
+            merged.pop(channel, None)
+        else:
+            merged[channel] = action
+    return merged
+
+
+class Command:
+    def __init__(self, key, payload):
+        self.key = key
+        # Packet bytes, or the {channel: action} dict for VALVES_KEY (built into a frame when sent)
+        self.payload = payload
+        self.sent_time = None
+        self.on_sent = []  # Called once the first time the command (or one it was merged into) is written
+
+    def packet(self):
+        return create_tx_set_packet(self.payload) if self.key == VALVES_KEY else self.payload
+
+
+class CommandScheduler:
+    """ Command queue for one board. All methods are thread-safe; write(packet) must not block
+    (AsyncSerialTransport.write). Call poll() regularly, or run run() on an event loop, so timed-out
+    commands are retried. """
+
+    def __init__(self, write, max_in_flight=MAX_IN_FLIGHT, ack_timeout=ACK_TIMEOUT_SEC, max_retries=MAX_RETRIES):
+        self.write = write
+        self.max_in_flight = max_in_flight
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+
+        self.pending = collections.OrderedDict()  # key -> Command, in submission order
+        self.in_flight = collections.deque()
+        self.unconfirmed = collections.OrderedDict()  # key -> payload sent since in_flight was last empty
+        self.retry_round = 0
+        self.recovering = 0  # Resent commands still to be confirmed one at a time
+        self.lock = threading.Lock()
+
+        self.rtts = collections.deque(maxlen=RTT_HISTORY)
+        self.commands_sent = 0
+        self.commands_acked = 0
+        self.commands_coalesced = 0
+        self.commands_failed = 0
+        self.retries = 0
+        self.unexpected_acks = 0
+
+    def set_valves(self, actions, on_sent=None):
+        """ Queue {channel: CHANNEL_*} valve actions, merged with any not yet sent. on_sent, if given,
+        is called (under the scheduler's lock) when the frame carrying them is written. """
+        with self.lock:
+            waiting = self.pending.get(VALVES_KEY)
+            if waiting is not None:
+                waiting.payload = merge_valve_actions(waiting.payload, actions)
+                self.commands_coalesced += 1
+            else:
+                waiting = self.pending[VALVES_KEY] = Command(VALVES_KEY, dict(actions))
+            if on_sent is not None:
+                waiting.on_sent.append(on_sent)
+            self._send()
+
+    def set_auto(self, channel, enabled, open_above, source_channel, pressure, pressure_hyst):
+        self._submit(('auto', channel), create_tx_autoctl_packet(channel, enabled, open_above, source_channel,
+                                                                 pressure, pressure_hyst))
+
+    def calibrate(self):
+        self._submit(CALIBRATION_KEY, create_tx_calib_packet())
+
+    def _submit(self, key, packet):
+        with self.lock:
+            waiting = self.pending.get(key)
+            if waiting is not None:
+                waiting.payload = packet
+                self.commands_coalesced += 1
+            else:
+                self.pending[key] = Command(key, packet)
+            self._send()
+
+    def _send(self):
+        """ Send waiting commands while the window has room. Must hold the lock. """
+        busy = {command.key for command in self.in_flight}
+        window = 1 if self.recovering else self.max_in_flight
+        for key in list(self.pending):
+            if len(self.in_flight) >= window:
+                break
+            if key in busy:
+                continue  # Keep coalescing until the previous command for this key is answered
+            command = self.pending.pop(key)
+            if command.key == VALVES_KEY and not command.payload:
+                continue  # Changes cancelled each other out
+            command.sent_time = time.monotonic()
+            self.in_flight.append(command)
+            if key == VALVES_KEY and key in self.unconfirmed:
+                self.unconfirmed[key] = merge_valve_actions(self.unconfirmed[key], command.payload)
+            else:
+                self.unconfirmed[key] = command.payload
+            busy.add(key)
+            self.commands_sent += 1
+            self.write(command.packet())
+            for callback in command.on_sent:
+                callback()
+            command.on_sent = []
+
+    def ack(self):
+        """ Call for every ACK! received from the board. """
+        now = time.monotonic()
+        with self.lock:
+            if not self.in_flight:
+                self.unexpected_acks += 1
+                return
+            command = self.in_flight.popleft()
+            self.rtts.append(now - command.sent_time)
+            self.commands_acked += 1
+            if not self.in_flight:
+                # As many ACKs as commands: everything sent so far arrived
+                self.unconfirmed.clear()
+                self.retry_round = 0
+                self.recovering = max(self.recovering - 1, 0)
+            self._send()
+
+    def poll(self):
+        """ Retry timed-out commands. Returns seconds until the next check is due. """
+        now = time.monotonic()
+        with self.lock:
+            if self.in_flight and now - self.in_flight[0].sent_time >= self.ack_timeout:
+                self._timed_out()
+            self._send()
+            if self.in_flight:
+                return max(self.in_flight[0].sent_time + self.ack_timeout - now, 0)
+        return self.ack_timeout
+
+    def _timed_out(self):
+        self.in_flight.clear()
+        unconfirmed, self.unconfirmed = self.unconfirmed, collections.OrderedDict()
+        self.retry_round += 1
+        if self.retry_round > self.max_retries:
+            self.commands_failed += len(unconfirmed)
+            self.retry_round = 0
+            self.recovering = 0
+            print(f'Commands {list(unconfirmed)} not acknowledged after {self.max_retries} retries')
+            return
+
+        self.retries += 1
+        # Resend ahead of anything queued since, keeping the original order
+        for key, payload in reversed(unconfirmed.items()):
+            newer = self.pending.get(key)
+            if newer is None:
+                self.pending[key] = Command(key, payload)
+            elif key == VALVES_KEY:
+                newer.payload = merge_valve_actions(payload, newer.payload)
+            else:
+                continue  # Superseded by the queued command
+            self.pending.move_to_end(key, last=False)
+        self.recovering = len(unconfirmed)
+
+    def clear(self):
+        with self.lock:
+            self.pending.clear()
+            self.in_flight.clear()
+            self.unconfirmed.clear()
+            self.retry_round = 0
+            self.recovering = 0
+
+    async def run(self):
+        """ Drive poll() from an asyncio event loop until cancelled. """
+        while True:
+            await asyncio.sleep(self.poll())
+
+    def rtt_percentiles(self, percentiles=(50, 99)):
+        """ Command round-trip times in ms over the recent history, or None if nothing was acked yet. """
+        with self.lock:
+            if not self.rtts:
+                return None
+            return np.percentile(np.array(self.rtts), percentiles) * 1e3
+
+    def stats(self):
+        rtt = self.rtt_percentiles()
+        return {
+            'sent': self.commands_sent,
+            'acked': self.commands_acked,
+            'coalesced': self.commands_coalesced,
+            'retries': self.retries,
+            'failed': self.commands_failed,
+            'unexpected_acks': self.unexpected_acks,
+            'in_flight': len(self.in_flight),
+            'rtt_ms_p50': None if rtt is None else float(rtt[0]),
+            'rtt_ms_p99': None if rtt is None else float(rtt[1]),
+        }
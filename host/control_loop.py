@@ -0,0 +1,225 @@
+""" Host-side closed-loop valve control.
+
+A Controller gets a deterministic per-sample callback: on_sample(t, pressures, valves) is called for
+every sample a board sends, in order, with its reconstructed timestamp, its 8 pressures and the
+valve states the board reported with it, and returns {valve: CHANNEL_*} actions (or None). The
+same stream of samples always produces the same calls and the same decisions, however the port
+happened to split it into reads, so controllers can be tested offline against recordings.
+
+ControlLoop runs controllers on the board's own event loop thread, straight from the decoder:
+each burst of samples is handed over as soon as it is decoded, before the receiver's batching for
+the GUI and recorder, and without ever going through the Qt event loop. Actions from one burst are
+merged into a single VCMD frame sent through the board's CommandScheduler (which owns ACK matching;
+while a valve frame is unacknowledged, newer actions are merged into the next one).
+
+Each command's latency is measured from the arrival of the sample that triggered it to the moment
+its frame is handed to the transport; stats() gives p50/p99 over recent commands.
+"""
+import collections
+import time
+
+import numpy as np
+
+from command_scheduler import merge_valve_actions
+from protocol import CHANNEL_RESET, CHANNEL_SET
+from timestamping import now
+
+LATENCY_HISTORY = 1000
+
+
+class Controller:
+    """ Base class for control laws. Override on_sample(); keep all state in the instance. """
+
+    def on_sample(self, t, pressures, valves):
+        """ t: sample time (s), pressures: list of floats (kPa), valves: list of bools as reported
+        by the board. Return {valve: CHANNEL_*} or None. """
+        return None
+
+    def reset(self):
+        """ Called when the loop (re)starts. """
+
+
+class ValveDriver:
+    """ Tracks which state a controller last asked a valve for, so it only sends changes. """
+
+    def __init__(self, valve):
+        self.valve = valve
+        self.requested = None
+
+    def drive(self, is_open):
+        if is_open == self.requested:
+            return None
+        self.requested = is_open
+        return {self.valve: CHANNEL_SET if is_open else CHANNEL_RESET}
+
+    def reset(self):
+        self.requested = None
+
+
+class BangBangController(Controller):
+    """ On/off control with hysteresis around a setpoint, like the firmware's AUTO mode but on the host. """
+
+    def __init__(self, sensor, valve, setpoint, hysteresis=0.5, open_above=False):
+        self.sensor = sensor
+        self.setpoint = setpoint
+        self.hysteresis = hysteresis
+        self.open_above = open_above
+        self.driver = ValveDriver(valve)
+
+    def on_sample(self, t, pressures, valves):
+        p = pressures[self.sensor]
+        if p > self.setpoint + self.hysteresis:
+            return self.driver.drive(self.open_above)
+        if p < self.setpoint - self.hysteresis:
+            return self.driver.drive(not self.open_above)
+        return None
+
+    def reset(self):
+        self.driver.reset()
+
+
+class PIDController(Controller):
+    """ PID on one sensor driving one on/off valve by time-proportioning: every period_sec the
+    valve is held open for the first (output * period_sec), with output clamped to [0, 1]. """
+
+    def __init__(self, sensor, valve, setpoint, kp, ki=0.0, kd=0.0, period_sec=0.1):
+        self.sensor = sensor
+        self.setpoint = setpoint
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.period_sec = period_sec
+        self.driver = ValveDriver(valve)
+        self.reset()
+
+    def on_sample(self, t, pressures, valves):
+        error = self.setpoint - pressures[self.sensor]
+        if self.last_t is None:
+            self.last_t, self.last_error, self.period_start = t, error, t
+        dt = t - self.last_t
+        if dt > 0:
+            derivative = (error - self.last_error) / dt
+            # Integrate only while the output isn't saturated (anti-windup)
+            integral = self.integral + error * dt
+            output = self.kp * error + self.ki * integral + self.kd * derivative
+            if 0 <= output <= 1:
+                self.integral = integral
+            self.output = min(max(output, 0.0), 1.0)
+            self.last_t, self.last_error = t, error
+
+        if t - self.period_start >= self.period_sec:
+            self.period_start += self.period_sec * ((t - self.period_start) // self.period_sec)
+        return self.driver.drive(t - self.period_start < self.output * self.period_sec)
+
+    def reset(self):
+        self.integral = 0.0
+        self.output = 0.0
+        self.last_t = None
+        self.last_error = 0.0
+        self.period_start = 0.0
+        self.driver.reset()
+
+
+class SequenceController(Controller):
+    """ Timed valve sequence: steps is a list of (duration_sec, {valve: CHANNEL_*}); each step's
+    actions are sent when it starts, timed from the first sample after the loop starts. """
+
+    def __init__(self, steps, repeat=False):
+        self.steps = list(steps)
+        if repeat and sum(duration for duration, _ in self.steps) <= 0:
+            raise ValueError('A repeating sequence needs a positive total duration')
+        self.repeat = repeat
+        self.reset()
+
+    def on_sample(self, t, pressures, valves):
+        if self.start is None:
+            self.start = t
+        actions = None
+        while self.step < len(self.steps) and t >= self.start + self.step_start:
+            duration, step_actions = self.steps[self.step]
+            actions = merge_valve_actions(actions or {}, step_actions)
+            self.step_start += duration
+            self.step += 1
+            if self.step == len(self.steps) and self.repeat:
+                self.step = 0
+        return actions
+
+    def reset(self):
+        self.start = None
+        self.step = 0
+        self.step_start = 0.0
+
+
+class ControlLoop:
+    """ Runs a board's controllers on its samples (see Board.add_controller). Controllers are
+    called in the order they were added; their actions for one burst go out as one frame. """
+
+    def __init__(self, board):
+        if board.commands is None:
+            raise ValueError(f'{board.name} is read-only; control needs the process that owns the port')
+        self.board = board
+        self.controllers = []
+
+        self.latencies = collections.deque(maxlen=LATENCY_HISTORY)  # Sample arrival -> frame written, s
+        self.samples = 0
+        self.commands = 0
+        self.failures = 0  # Controllers that raised and were disabled
+        self.callback_time = 0.0
+        self.burst_time = board.metrics.histogram('control')  # Controllers' time per burst
+
+    def add(self, controller):
+        def add_synchronized():
+            controller.reset()
+            self.controllers = self.controllers + [controller]
+        self.board._synchronized(add_synchronized)
+
+    def remove(self, controller):
+        def remove_synchronized():
+            self.controllers = [c for c in self.controllers if c is not controller]
+        self.board._synchronized(remove_synchronized)
+
+    def on_samples(self, block):
+        """ FrameReceiver sample listener; runs on the board's event loop thread. """
+        controllers = self.controllers
+        if not controllers:
+            return
+        start = time.perf_counter()
+        actions = {}
+        trigger = None
+        for i, (t, pressures, valves) in enumerate(zip(block.timestamps.tolist(), block.pressures.tolist(),
+                                                       block.valves.tolist())):
+            for controller in controllers:
+                try:
+                    result = controller.on_sample(t, pressures, valves)
+                    if result:
+                        actions = merge_valve_actions(actions, result)
+                except Exception as e:
+                    self._disable(controller, e)
+                    controllers = self.controllers
+                    continue
+                if result and trigger is None:
+                    trigger = block.arrival_times[i] if block.arrival_times is not None else now()
+        elapsed = time.perf_counter() - start
+        self.samples += len(block)
+        self.callback_time += elapsed
+        self.burst_time.record(elapsed)
+
+        if actions:
+            self.commands += 1
+            self.board.commands.set_valves(actions, on_sent=lambda: self.latencies.append(now() - trigger))
+
+    def _disable(self, controller, error):
+        """ A control law that raises is taken out of the loop; the board's stream carries on. """
+        self.controllers = [c for c in self.controllers if c is not controller]
+        self.failures += 1
+        self.board._report_error(f'Controller {type(controller).__name__} failed and was disabled: '
+                                 f'{type(error).__name__}: {error}', fatal=False)
+
+    def stats(self):
+        latencies = np.array(self.latencies)
+        p50, p99 = np.percentile(latencies, (50, 99)) * 1e3 if len(latencies) else (None, None)
+        return {
+            'control_commands': self.commands,
+            'control_failures': self.failures,
+            'control_latency_ms_p50': None if p50 is None else float(p50),
+            'control_latency_ms_p99': None if p99 is None else float(p99),
+            'control_us_per_sample': self.callback_time / self.samples * 1e6 if self.samples else None,
+        }
@@ -1,3 +1,7 @@
+import numpy as np
+
+import export
+
 
 class DataPoint:
     def __init__(self, timestamp, data):
@@ -5,37 +9,169 @@ class DataPoint:
         self.data = data
 
 
+class SampleBlock:
+    """ A batch of decoded samples handed from the serial worker to the GUI thread in one go. """
+
+    def __init__(self, timestamps, pressures, valves, arrival_times=None):
+        self.timestamps = timestamps  # (n,) float64
+        self.pressures = pressures  # (n, n_channels) float32
+        self.valves = valves  # (n, n_channels) bool
+        self.arrival_times = arrival_times  # (n,) float64 host receive times, if timestamps were reconstructed
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def concatenate(cls, blocks):
+        if len(blocks) == 1:
+            return blocks[0]
+        arrival_times = None
+        if all(b.arrival_times is not None for b in blocks):
+            arrival_times = np.concatenate([b.arrival_times for b in blocks])
+        return cls(np.concatenate([b.timestamps for b in blocks]),
+                   np.concatenate([b.pressures for b in blocks]),
+                   np.concatenate([b.valves for b in blocks]),
+                   arrival_times)
+
+
 class DataSeries:
-    def __init__(self, data=None, timestamps=None, n_channels=1):
-        if timestamps is None:
-            timestamps = []
-        if data is None:
-            data = [[] for _ in range(n_channels)]
+    """ Columnar sample store: a (capacity, n_channels) float32 block plus a float64 timestamp column.
 
-        self.data = data
-        self.timestamps = timestamps
+    By default the store grows (doubling its capacity when full). If max_samples is given it acts as
+    a fixed-size ring that keeps only the most recent max_samples samples; it is backed by twice that
+    many rows so the live samples are always contiguous and every accessor returns a view.
+    """
+
+    def __init__(self, data=None, timestamps=None, n_channels=1, capacity=4096, max_samples=None):
         self.n_channels = n_channels
+        self.max_samples = max_samples
+        self.initial_capacity = 2 * max_samples if max_samples else capacity
+
+        self._values = np.empty((self.initial_capacity, n_channels), dtype=np.float32)
+        self._timestamps = np.empty(self.initial_capacity, dtype=np.float64)
+        self._start = 0
+        self._end = 0
+        self.n_appended = 0  # Total samples ever appended; n_appended - len(self) have been dropped (ring mode)
+
+        if data is not None:
+            # Legacy layout: one sequence per channel
+            self.append(timestamps, np.asarray(data, dtype=np.float32).T)
+
+    @classmethod
+    def from_arrays(cls, timestamps, values):
+        """ Wrap existing (n,) timestamp and (n, n_channels) value arrays, e.g. np.memmap'd recordings,
+        without copying them. They are only copied if more samples are appended later. """
+        series = cls(n_channels=values.shape[1], capacity=0)
+        series._timestamps = timestamps
+        series._values = values
+        series._end = series.n_appended = len(timestamps)
+        return series
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def timestamps(self):
+        return self._timestamps[self._start:self._end]
+
+    @property
+    def values(self):
+        """ (n_samples, n_channels) view of the stored samples. """
+        return self._values[self._start:self._end]
+
+    @property
+    def data(self):
+        """ (n_channels, n_samples) view, so data[i] is channel i like the old list-of-lists layout. """
+        return self.values.T
+
+    def channel(self, i):
+        return self._values[self._start:self._end, i]
+
+    def window(self, t_start, t_end=None):
+        """ Views of (timestamps, values) for samples with t_start <= t < t_end, found by bisection. """
+        timestamps = self.timestamps
+        i0 = np.searchsorted(timestamps, t_start, side='left')
+        i1 = len(timestamps) if t_end is None else np.searchsorted(timestamps, t_end, side='left')
+        return timestamps[i0:i1], self.values[i0:i1]
+
+    def last(self, seconds):
+        """ Views of the samples from the last `seconds` seconds. """
+        if len(self) == 0:
+            return self.window(0)
+        return self.window(self._timestamps[self._end - 1] - seconds)
+
+    def _reserve(self, n):
+        if self._end + n <= len(self._timestamps):
+            return
+
+        count = len(self)
+        if self.max_samples:
+            # Ring mode: slide the live samples back to the front. Happens at most once every
+            # max_samples appends, so appends stay amortized O(1).
+            keep = max(0, min(count, self.max_samples - n))
+            self._values[:keep] = self._values[self._end - keep:self._end]
+            self._timestamps[:keep] = self._timestamps[self._end - keep:self._end]
+            self._start, self._end = 0, keep
+            return
+
+        new_capacity = max(2 * len(self._timestamps), count + n)
+        values = np.empty((new_capacity, self.n_channels), dtype=np.float32)
+        timestamps = np.empty(new_capacity, dtype=np.float64)
+        values[:count] = self.values
+        timestamps[:count] = self.timestamps
+        self._values, self._timestamps = values, timestamps
+        self._start, self._end = 0, count
+
+    def append(self, timestamps, values):
+        """ Append a block of samples: timestamps is (n,), values is (n, n_channels). """
+        values = np.asarray(values, dtype=np.float32).reshape(-1, self.n_channels)
+        timestamps = np.broadcast_to(np.asarray(timestamps, dtype=np.float64), (len(values),))
+        self.n_appended += len(values)
+        if self.max_samples and len(values) > self.max_samples:
+            values = values[-self.max_samples:]
+            timestamps = timestamps[-self.max_samples:]
+
+        n = len(values)
+        self._reserve(n)
+        self._values[self._end:self._end + n] = values
+        self._timestamps[self._end:self._end + n] = timestamps
+        self._end += n
+        if self.max_samples and len(self) > self.max_samples:
+            self._start = self._end - self.max_samples
 
     def append_from(self, d2):
         if d2.n_channels != self.n_channels:
             raise ValueError('wrong number of data channels!!1!one')
 
-        for i in range(self.n_channels):
-            self.data[i].extend(d2.data[i])
-        self.timestamps.extend(d2.timestamps)
+        self.append(d2.timestamps, d2.values)
         d2.clear()
 
     def add_point(self, data_point: DataPoint):
-        for i in range(self.n_channels):
-            self.data[i].append(data_point.data[i])
-        self.timestamps.append(data_point.timestamp)
+        self._reserve(1)
+        self._values[self._end] = data_point.data[:self.n_channels]
+        self._timestamps[self._end] = data_point.timestamp
+        self._end += 1
+        self.n_appended += 1
+        if self.max_samples and len(self) > self.max_samples:
+            self._start += 1
 
     def clear(self):
-        self.data = [[] for _ in range(self.n_channels)]
-        self.timestamps = []
+        if len(self._timestamps) != self.initial_capacity:
+            self._values = np.empty((self.initial_capacity, self.n_channels), dtype=np.float32)
+            self._timestamps = np.empty(self.initial_capacity, dtype=np.float64)
+        self._start = 0
+        self._end = 0
+        self.n_appended = 0
+
+    def snapshot(self):
+        """ (timestamps, values) arrays that later appends won't change, for reading without holding
+        the lock that guards this series (e.g. to export it). Views where appends can only write
+        past them or reallocate; copies in ring mode and while the initial storage, which clear()
+        reuses, is in use. """
+        if self.max_samples or len(self._timestamps) == self.initial_capacity:
+            return self.timestamps.copy(), self.values.copy()
+        return self.timestamps, self.values
 
     def save_to_file(self, filename):
-        with open(filename, 'w') as f:
-            for i, line in enumerate(zip(*self.data)):
-                f.write(f"{self.timestamps[i]}," + ",".join(map(str, line)) + "\n")
+        export.write_csv(filename, export.array_chunks(self.timestamps, self.values))
         print(f'Saved data to {filename}')
@@ -0,0 +1,29 @@
+import serial
+import serial.tools.list_ports
+
+from device_emulator import DeviceEmulator, EmulatedPort, ReplayPort
+from protocol import BAUDRATE, RX_PACKET_SIZE
+from shm_bus import list_buses
+
+EMULATOR_SOURCE = 'Emulator'
+EMULATOR_RATE_HZ = 100.0
+REPLAY_PREFIX = 'replay:'  # 'replay:<file>' replays a byte stream captured with CapturingPort
+SHM_SOURCE_PREFIX = 'shm:'  # 'shm:<bus>' tails a board published by another process (see shm_bus)
+
+
+def list_data_sources():
+    """ Serial ports, the built-in emulator and boards other processes publish on the shared-memory bus. """
+    return [port.device for port in serial.tools.list_ports.comports()] + [EMULATOR_SOURCE] + \
+        [SHM_SOURCE_PREFIX + name for name in list_buses()]
+
+
+def open_data_source(name, timeout=1, write_timeout=1):
+    """ Open a data source by name. Everything returned behaves like serial.Serial as far as
+    SerialWorker and the command senders are concerned (read, in_waiting, write, close). Shared-memory
+    sources aren't ports; DeviceManager.add_board opens those. """
+    if name == EMULATOR_SOURCE:
+        return EmulatedPort(DeviceEmulator(rate_hz=EMULATOR_RATE_HZ), timeout=timeout)
+    if name.startswith(REPLAY_PREFIX):
+        return ReplayPort.from_file(name[len(REPLAY_PREFIX):], timeout=timeout,
+                                    bytes_per_sec=EMULATOR_RATE_HZ * RX_PACKET_SIZE)
+    return serial.Serial(name, baudrate=BAUDRATE, timeout=timeout, write_timeout=write_timeout)
@@ -0,0 +1,345 @@
+""" Software stand-in for the pressure board.
+
+DeviceEmulator produces genuine PRZL frames (valid CRCs) at a configurable rate and answers
+VCMD/AUTO/CALB commands with ACK!, like the firmware. It can be attached to the receive code as
+an in-process EmulatedPort, or exposed on a pseudo-terminal so the GUI can connect to it like a
+real board:
+
+    python device_emulator.py [rate_hz]
+"""
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from frame_parser import FrameParser
+from protocol import (CHANNEL_RESET, CHANNEL_SET, CHANNEL_TOGGLE, MAGIC, MAGIC_ACK, N_CHANNELS,
+                      RX_PACKET_DTYPE, RX_PACKET_SIZE, calculate_crc, rx_auto_valve_cmd_format,
+                      rx_auto_valve_cmd_magic, rx_calibration_magic, rx_valve_cmd_format, rx_valve_cmd_magic)
+from stm32_crc import crc32_stm_batch
+
+TX_COMMAND_SIZES = {
+    rx_valve_cmd_magic: struct.calcsize(rx_valve_cmd_format),
+    rx_auto_valve_cmd_magic: struct.calcsize(rx_auto_valve_cmd_format),
+    rx_calibration_magic: len(rx_calibration_magic),
+}
+
+SUPPLY_KPA = 100.0
+FILL_TIME_CONSTANT_SEC = 0.2
+LEAK_TIME_CONSTANT_SEC = 2.0
+
+
+class DeviceEmulator:
+    """ Frame generator and command handler for one emulated board.
+
+    Each channel is a first-order plant: with its valve open the pressure rises towards SUPPLY_KPA,
+    with it closed it leaks towards 0. Frame n is due at start_time + n / rate_hz (time.monotonic()),
+    which lets benchmarks work out per-frame latency. If sequence_channel is set, that channel
+    carries the frame number instead of a pressure so gaps (dropped frames) can be counted.
+    """
+
+    def __init__(self, rate_hz=1000.0, noise_kpa=0.05, corrupt_rate=0.0, garbage_rate=0.0,
+                 sequence_channel=None, seed=None):
+        self.rate_hz = rate_hz
+        self.noise_kpa = noise_kpa
+        self.corrupt_rate = corrupt_rate
+        self.garbage_rate = garbage_rate
+        self.sequence_channel = sequence_channel
+        self.rng = np.random.default_rng(seed)
+
+        self.pressures = np.zeros(N_CHANNELS)
+        self.valves = np.zeros(N_CHANNELS, dtype=bool)
+        # Firmware-style threshold control per valve: (source channel, open_above, pressure, hysteresis)
+        self.auto = [None] * N_CHANNELS
+
+        self.command_parser = FrameParser(TX_COMMAND_SIZES)
+        self.commands_received = 0
+        self.commands_rejected = 0
+
+        self.start_time = time.monotonic()
+        self.frames_sent = 0
+
+    def frame_time(self, seq):
+        return self.start_time + seq / self.rate_hz
+
+    def frames_due(self, now=None):
+        now = time.monotonic() if now is None else now
+        return max(int((now - self.start_time) * self.rate_hz) + 1 - self.frames_sent, 0)
+
+    def _run_auto_control(self):
+        for valve, config in enumerate(self.auto):
+            if config is None:
+                continue
+            source, open_above, pressure, hyst = config
+            p = self.pressures[source]
+            if p > pressure + hyst:
+                self.valves[valve] = open_above
+            elif p < pressure - hyst:
+                self.valves[valve] = not open_above
+
+    def make_frames(self, n):
+        """ The next n frames as one bytes object. Valve and auto-control state is applied per call. """
+        if n <= 0:
+            return b''
+        self._run_auto_control()
+
+        # Closed-form first-order response, so a whole batch is computed without a Python loop
+        steps = np.arange(1, n + 1)[:, None]
+        tau = np.where(self.valves, FILL_TIME_CONSTANT_SEC, LEAK_TIME_CONSTANT_SEC)
+        target = np.where(self.valves, SUPPLY_KPA, 0.0)
+        decay = np.exp(-steps / (self.rate_hz * tau))
+        pressures = target + (self.pressures - target) * decay
+        self.pressures = pressures[-1]
+
+        packets = np.zeros(n, dtype=RX_PACKET_DTYPE)
+        packets['magic'] = MAGIC
+        packets['pressures'] = pressures + self.rng.normal(0, self.noise_kpa, pressures.shape) if self.noise_kpa \
+            else pressures
+        if self.sequence_channel is not None:
+            packets['pressures'][:, self.sequence_channel] = np.arange(self.frames_sent, self.frames_sent + n)
+        packets['valves'] = np.packbits(self.valves, bitorder='little')[0]
+
+        raw = packets.view(np.uint8).reshape(n, RX_PACKET_SIZE)
+        packets['crc'] = crc32_stm_batch(raw[:, :-4])
+        self.frames_sent += n
+
+        if self.corrupt_rate:
+            bad = np.flatnonzero(self.rng.random(n) < self.corrupt_rate)
+            raw[bad, self.rng.integers(4, RX_PACKET_SIZE, len(bad))] ^= 0xFF
+        if not self.garbage_rate:
+            return raw.tobytes()
+
+        parts = []
+        for frame in raw:
+            parts.append(frame.tobytes())
+            if self.rng.random() < self.garbage_rate:
+                parts.append(self.rng.integers(0, 256, self.rng.integers(1, 64), dtype=np.uint8).tobytes())
+        return b''.join(parts)
+
+    def generate(self, now=None, max_frames=None):
+        """ Frames that have come due since the last call. If more than max_frames are due, the oldest
+        are skipped (counted as sent but never delivered, like an overflowing USB buffer). """
+        n = self.frames_due(now)
+        if max_frames is not None and n > max_frames:
+            self.frames_sent += n - max_frames
+            n = max_frames
+        return self.make_frames(n)
+
+    def handle_command_bytes(self, data):
+        """ Feed bytes written by the host; returns the ACK!s to send back. """
+        self.command_parser.feed(data)
+        reply = b''
+        for magic, frame in self.command_parser.frames():
+            if self._handle_command(magic, bytes(frame)):
+                reply += MAGIC_ACK
+                self.commands_received += 1
+            else:
+                self.commands_rejected += 1
+        return reply
+
+    def _handle_command(self, magic, frame):
+        if magic == rx_calibration_magic:
+            return True
+        if calculate_crc(frame[:-4]) != struct.unpack('<I', frame[-4:])[0]:
+            return False
+
+        if magic == rx_valve_cmd_magic:
+            actions = struct.unpack(rx_valve_cmd_format, frame)[1:-1]
+            for channel, action in enumerate(actions):
+                if action == CHANNEL_SET:
+                    self.valves[channel] = True
+                elif action == CHANNEL_RESET:
+                    self.valves[channel] = False
+                elif action == CHANNEL_TOGGLE:
+                    self.valves[channel] = not self.valves[channel]
+        elif magic == rx_auto_valve_cmd_magic:
+            _, channel, enabled, open_above, source, pressure, hyst, _ = struct.unpack(rx_auto_valve_cmd_format, frame)
+            if channel < N_CHANNELS and source < N_CHANNELS:
+                self.auto[channel] = (source, bool(open_above), pressure, hyst) if enabled else None
+        return True
+
+
+class EmulatedPort:
+    """ In-process replacement for serial.Serial backed by a DeviceEmulator.
+
+    Frames are generated lazily from the wall clock whenever the port is polled. At most buffer_size
+    bytes are held, like the OS/USB buffers of a real port; frames beyond that are lost.
+    """
+
+    def __init__(self, emulator, timeout=1.0, buffer_size=1 << 20, port='emulator'):
+        self.emulator = emulator
+        self.timeout = timeout
+        self.buffer_size = buffer_size
+        self.port = port
+        self.is_open = True
+        self._rx = bytearray()
+        # The reader thread and command senders on other threads share the emulator and buffer
+        self._lock = threading.Lock()
+
+    def _pump(self):
+        with self._lock:
+            max_frames = max((self.buffer_size - len(self._rx)) // RX_PACKET_SIZE, 0)
+            self._rx += self.emulator.generate(max_frames=max_frames)
+
+    @property
+    def in_waiting(self):
+        self._pump()
+        return len(self._rx)
+
+    def read(self, size=1):
+        deadline = time.monotonic() + (self.timeout if self.timeout is not None else float('inf'))
+        self._pump()
+        while len(self._rx) < size and self.is_open:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            next_frame = self.emulator.frame_time(self.emulator.frames_sent)
+            time.sleep(min(max(next_frame - now, 0), deadline - now))
+            self._pump()
+        with self._lock:
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+        return data
+
+    def write(self, data):
+        with self._lock:
+            self._rx += self.emulator.handle_command_bytes(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self._rx.clear()
+
+    def close(self):
+        self.is_open = False
+
+
+class ReplayPort:
+    """ Replays a captured byte stream (see CapturingPort) as if it came from a board.
+
+    With bytes_per_sec set the data is paced in real time, otherwise it is delivered as fast as it
+    is read. Writes are accepted and discarded.
+    """
+
+    def __init__(self, data, bytes_per_sec=None, timeout=1.0, loop=False, port='replay'):
+        self.data = data
+        self.bytes_per_sec = bytes_per_sec
+        self.timeout = timeout
+        self.loop = loop
+        self.port = port
+        self.is_open = True
+        self.position = 0
+        self.start_time = time.monotonic()
+
+    @classmethod
+    def from_file(cls, filename, **kwargs):
+        with open(filename, 'rb') as f:
+            return cls(f.read(), port=filename, **kwargs)
+
+    def _available_end(self):
+        if self.bytes_per_sec is None:
+            return len(self.data)
+        return min(int((time.monotonic() - self.start_time) * self.bytes_per_sec), len(self.data))
+
+    @property
+    def in_waiting(self):
+        if self.loop and self.position >= len(self.data):
+            self.position = 0
+            self.start_time = time.monotonic()
+        return self._available_end() - self.position
+
+    def read(self, size=1):
+        deadline = time.monotonic() + (self.timeout if self.timeout is not None else float('inf'))
+        while self.in_waiting < size and time.monotonic() < deadline and self.is_open:
+            if self.position >= len(self.data) and not self.loop:
+                break
+            time.sleep(0.001)
+        end = min(self.position + size, self._available_end())
+        data = self.data[self.position:end]
+        self.position = end
+        return data
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class CapturingPort:
+    """ Wraps a port and tees every byte read from it into a file, for later replay. """
+
+    def __init__(self, port, filename):
+        self.wrapped = port
+        self.capture = open(filename, 'wb')
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def read(self, size=1):
+        data = self.wrapped.read(size)
+        self.capture.write(data)
+        return data
+
+    def close(self):
+        self.capture.close()
+        self.wrapped.close()
+
+
+class PtyBridge:
+    """ Serves a DeviceEmulator on a pseudo-terminal (POSIX only), so anything that opens a serial
+    port, including the GUI, can talk to it. """
+
+    def __init__(self, emulator, poll_interval=0.001):
+        import tty
+        self.emulator = emulator
+        self.poll_interval = poll_interval
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.slave_name = os.ttyname(self.slave)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='pty-bridge', daemon=True)
+
+    def start(self):
+        self.emulator.start_time = time.monotonic()
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def _run(self):
+        import select
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], self.poll_interval)
+            if readable:
+                self._write(self.emulator.handle_command_bytes(os.read(self.master, 4096)))
+            self._write(self.emulator.generate(max_frames=int(self.emulator.rate_hz) + 1))
+
+    def _write(self, data):
+        try:
+            while data:
+                data = data[os.write(self.master, data):]
+        except BlockingIOError:
+            pass  # Nobody is reading the other end; drop the rest like a full USB buffer
+
+
+if __name__ == '__main__':
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 100.0
+    bridge = PtyBridge(DeviceEmulator(rate_hz=rate))
+    bridge.start()
+    print(f'Emulated board at {rate:g} Hz on {bridge.slave_name}')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        bridge.stop()
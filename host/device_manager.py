@@ -0,0 +1,490 @@
+""" Several boards read in parallel, addressed as one set of channels.
+
+Each Board owns its port through an AsyncSerialTransport on its own event loop thread, so decoding
+for one board never waits on another, and appends its samples straight into its own DataSeries and
+MinMaxPyramid on that thread (under board.lock) rather than funnelling every block through a GUI
+slot. Channels are addressed globally as 'board:channel', e.g. 'rig2:5'. Every board timestamps
+samples with the same host clock, so DeviceManager.aligned() can resample any set of channels onto
+a common time base.
+
+With publish=True each serial board also writes its samples to a shared-memory ring (shm_bus), and
+a source named 'shm:<bus>' attaches to a ring another process publishes as a read-only BusBoard,
+so several local programs can watch the same boards without sharing the port.
+
+Run standalone to watch per-board throughput without the GUI:
+
+    python device_manager.py SOURCE [SOURCE ...]
+"""
+import abc
+import collections
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from archive import ARCHIVE_EXTENSION, ArchiveWriter
+from async_transport import AsyncioThread, AsyncSerialTransport
+from command_scheduler import CommandScheduler
+from control_loop import ControlLoop
+from data_series import DataSeries, SampleBlock
+from data_source import SHM_SOURCE_PREFIX, open_data_source
+from dsp import Pipeline
+from metrics import Metrics
+from minmax_pyramid import MinMaxPyramid
+from protocol import N_CHANNELS
+from receiver import FrameReceiver
+from recording import RECORDING_EXTENSION, Recorder, default_channels, unique_filename
+from running_stats import RunningStats
+from shm_bus import SharedRingReader, SharedRingWriter, bus_name
+from triggers import Trigger, TriggerEngine
+
+ADDRESS_SEPARATOR = ':'
+BUS_POLL_SEC = 0.005
+
+
+class BaseBoard(abc.ABC):
+    """ Sample store, listeners and counters shared by every kind of board. """
+
+    def __init__(self, name, max_samples=None, on_error=None, lod=True, channels=None):
+        self.name = name
+        self.channels = channels or default_channels()  # Name and units per stored column, raw ones first
+        self.max_samples = max_samples
+        # Called as on_error(message, fatal) from the board's thread. Fatal errors (port or bus lost)
+        # end the stream; others (a failing controller or listener) leave acquisition running
+        self.on_error = on_error
+        self.lod = lod  # Maintain a MinMaxPyramid for plotting
+        self.commands = None  # Read-only unless the board has a command queue
+
+        # Guards data and pyramid, which are appended to on the board's own thread
+        self.lock = threading.Lock()
+        self.data = DataSeries(n_channels=len(self.channels), max_samples=max_samples)
+        self.pyramid = MinMaxPyramid(self.data) if lod else None
+        # Per-column session and sliding-window statistics, readable from any thread without the lock
+        self.channel_stats = RunningStats(len(self.channels))
+        self.valve_states = [False] * N_CHANNELS
+        self.listeners = []  # Called as listener(board, block) on the board's thread
+        self.failed_listeners = []  # Listeners that raised; they are skipped from then on
+
+        self.acquiring = False
+        self.recorder = None
+        self.samples_received = 0
+        self.blocks_received = 0
+        self._rate_count = 0
+        self._rate_time = time.monotonic()
+
+        # Pipeline metrics (see metrics), recorded on the board's thread
+        self.metrics = Metrics()
+        self.store_time = self.metrics.histogram('store')  # Append to data and pyramid, lock wait included
+        self.listener_time = self.metrics.histogram('listeners')
+        self.stats_time = self.metrics.histogram('stats')
+        self.metrics.gauge('samples', lambda: self.samples_received, cumulative=True)
+        self.metrics.gauge('blocks', lambda: self.blocks_received, cumulative=True)
+        self.metrics.gauge('record_queue', lambda: self.recorder.queue.qsize() if self.recorder is not None else 0)
+        self.metrics.gauge('record_dropped', lambda: self.recorder.blocks_dropped if self.recorder is not None else 0)
+        self.metrics.gauge('listener_failures', lambda: len(self.failed_listeners))
+
+    def _on_block(self, block):
+        self.valve_states = block.valves[-1].tolist()
+        if not self.acquiring:
+            return
+        start = time.perf_counter()
+        with self.lock:
+            self.data.append(block.timestamps, block.pressures)
+            if self.pyramid is not None:
+                self.pyramid.update()
+        stored = time.perf_counter()
+        self.store_time.record(stored - start)
+        self.channel_stats.update(block.timestamps, block.pressures)
+        updated = time.perf_counter()
+        self.stats_time.record(updated - stored)
+        self.samples_received += len(block)
+        self.blocks_received += 1
+        for listener in self.listeners:
+            if listener in self.failed_listeners:
+                continue
+            try:
+                listener(self, block)
+            except Exception as e:
+                # A broken consumer (trigger, publisher, ...) must not stop the board's stream
+                self.failed_listeners.append(listener)
+                self._report_error(f'{getattr(listener, "__qualname__", listener)} failed and was disabled: '
+                                   f'{type(e).__name__}: {e}', fatal=False)
+        if self.listeners:
+            self.listener_time.record(time.perf_counter() - updated)
+
+    def _report_error(self, error, fatal=True):
+        if not fatal:
+            print(f'{self.name}: {error}')
+        if self.on_error is not None:
+            self.on_error(error, fatal)
+
+    @abc.abstractmethod
+    def _synchronized(self, fn):
+        """ Run fn without racing the thread that delivers blocks. """
+
+    def _set_recorder(self, recorder):
+        self.recorder = recorder
+
+    def start(self, recorder=None):
+        """ Start storing samples in a fresh store (and recording them, if given a Recorder). A
+        recorder already in use is closed. """
+        previous = self.recorder
+        def start_synchronized():
+            with self.lock:
+                self.data = DataSeries(n_channels=len(self.channels), max_samples=self.max_samples)
+                self.pyramid = MinMaxPyramid(self.data) if self.lod else None
+            self.channel_stats = RunningStats(len(self.channels))
+            self._set_recorder(recorder)
+            self.acquiring = True
+        self._synchronized(start_synchronized)
+        if previous is not None and previous is not recorder:
+            previous.close()
+
+    def stop(self):
+        """ Stop storing samples; returns the recorder that was in use (not closed). """
+        recorder = self.recorder
+        def stop_synchronized():
+            self._set_recorder(None)
+            self.acquiring = False
+        self._synchronized(stop_synchronized)
+        return recorder
+
+    def stats(self):
+        """ Counters for this board; the rate is samples/sec since the previous call. """
+        now = time.monotonic()
+        rate = (self.samples_received - self._rate_count) / max(now - self._rate_time, 1e-9)
+        self._rate_count, self._rate_time = self.samples_received, now
+        return {
+            'port': self.port,
+            'samples': self.samples_received,
+            'samples_per_sec': rate,
+            'crc_dropped': 0,
+            'bytes_discarded': 0,
+            'resyncs': 0,
+            'record_dropped': self.recorder.blocks_dropped if self.recorder is not None else 0,
+            'cmd_rtt_ms': None,
+            'rate_hz': None,  # Sample clock figures, for boards that reconstruct timestamps
+            'jitter_ms': None,
+            'dsp_ms_p99': None,  # Per-block processing time, for boards with derived channels
+        }
+
+    def close(self):
+        if self.acquiring:
+            recorder = self.stop()
+            if recorder is not None:
+                recorder.close()
+
+
+class Board(BaseBoard):
+    """ One connected board: its transport, command queue, receiver and sample store. With a
+    processor (dsp.Pipeline) its derived channels are stored after the raw ones. """
+
+    def __init__(self, name, port, max_samples=None, on_error=None, lod=True, processor=None):
+        channels = default_channels() + (processor.channels if processor is not None else [])
+        super().__init__(name, max_samples, on_error, lod, channels)
+        self.processor = processor
+        # ACKs are matched whether or not we're acquiring
+        self.receiver = FrameReceiver(self._on_block, self._on_ack, processor=processor, metrics=self.metrics)
+        self.loop_thread = AsyncioThread()
+        self.transport = AsyncSerialTransport(port, self.receiver, on_error=self._report_error,
+                                              loop_thread=self.loop_thread)
+        self.commands = CommandScheduler(self.transport.write)
+        self.command_task = self.loop_thread.submit(self.commands.run())
+        self.control = None  # ControlLoop, created with the first controller
+
+        self.metrics.gauge('bytes_read', lambda: self.transport.bytes_read, cumulative=True)
+        self.metrics.gauge('frames', lambda: self.receiver.packets_received, cumulative=True)
+        self.metrics.gauge('crc_failures', lambda: self.receiver.packets_dropped, cumulative=True)
+        self.metrics.gauge('resync_bytes', lambda: self.receiver.parser.bytes_discarded, cumulative=True)
+        self.metrics.gauge('pending_samples', lambda: self.receiver.pending_samples)
+        self.metrics.gauge('write_queue', lambda: self.transport.writes_pending)
+
+    @property
+    def port(self):
+        return self.transport.port
+
+    def _on_ack(self):
+        self.commands.ack()
+
+    def _synchronized(self, fn):
+        self.loop_thread.call(fn)
+
+    def _set_recorder(self, recorder):
+        # Pending samples go to the recorder they arrived under
+        self.receiver.flush()
+        self.recorder = recorder
+        self.receiver.recorder = recorder
+
+    def add_controller(self, controller):
+        """ Run a control_loop.Controller on every sample from now on, on this board's loop thread. """
+        if self.control is None:
+            control = ControlLoop(self)
+            self._synchronized(lambda: self.receiver.sample_listeners.append(control.on_samples))
+            self.control = control
+        self.control.add(controller)
+
+    def remove_controller(self, controller):
+        if self.control is not None:
+            self.control.remove(controller)
+
+    def stats(self):
+        stats = super().stats()
+        rtt = self.commands.rtt_percentiles()
+        stats.update({
+            'crc_dropped': self.receiver.packets_dropped,
+            'bytes_discarded': self.receiver.parser.bytes_discarded,
+            'resyncs': self.receiver.parser.resyncs,
+            'cmd_rtt_ms': None if rtt is None else float(rtt[0]),
+        })
+        stats.update(self.receiver.clock.stats())
+        if self.processor is not None:
+            stats.update(self.processor.stats())
+        if self.control is not None:
+            stats.update(self.control.stats())
+        return stats
+
+    def close(self):
+        super().close()
+        self.command_task.cancel()
+        self.transport.close()
+        self.loop_thread.stop()
+
+
+class BusBoard(BaseBoard):
+    """ A board published on the shared-memory bus by another process (see shm_bus). Read-only: the
+    publishing process owns the port, so there are no commands. """
+
+    def __init__(self, name, bus, max_samples=None, on_error=None, lod=True, poll_interval=BUS_POLL_SEC):
+        self.reader = SharedRingReader(bus)
+        super().__init__(name, max_samples, on_error, lod,
+                         self.reader.metadata.get('channels') or default_channels(self.reader.n_channels))
+        self.bus = bus
+        self.poll_interval = poll_interval
+        self.metrics.gauge('samples_lost', lambda: self.reader.samples_lost, cumulative=True)
+        self.sync_lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f'bus-{name}', daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return f'{SHM_SOURCE_PREFIX}{self.bus}'
+
+    def _run(self):
+        read_time = self.metrics.histogram('bus_read')
+        while self.running:
+            with self.sync_lock:
+                start = time.perf_counter()
+                block = self.reader.read()
+                read_time.record(time.perf_counter() - start)
+                if len(block):
+                    # Copy out of the ring: the store and recorder keep these arrays
+                    block = SampleBlock(block.timestamps.copy(), block.pressures.copy(), block.valves)
+                    if self.recorder is not None:
+                        self.recorder.write(block)
+                    self._on_block(block)
+                elif self.reader.closed:
+                    self.running = False
+                    self._report_error(f'{self.bus} was closed by its publisher')
+            time.sleep(self.poll_interval)
+
+    def _synchronized(self, fn):
+        with self.sync_lock:
+            fn()
+
+    def stats(self):
+        stats = super().stats()
+        stats['samples_lost'] = self.reader.samples_lost
+        return stats
+
+    def close(self):
+        super().close()
+        self.running = False
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        self.reader.close()
+
+
+class DeviceManager:
+    """ The set of connected boards, in the order they were added. """
+
+    def __init__(self, max_samples=None, lod=True, publish=False, processing=None, triggers=None):
+        self.max_samples = max_samples
+        self.lod = lod
+        self.publish = publish  # Put every serial board's samples on the shared-memory bus
+        self.processing = processing  # dsp stage config; every serial board gets its own Pipeline
+        self.triggers = triggers  # Trigger configs, armed on every board while acquiring with a capture_dir
+        self.trigger_engines = {}
+        self.boards = collections.OrderedDict()
+        self.bus_writers = {}
+
+    def __len__(self):
+        return len(self.boards)
+
+    def __getitem__(self, name):
+        return self.boards[name]
+
+    def next_name(self):
+        """ The name add_board() gives a board added now without one. """
+        n = len(self.boards)
+        while f'board{n}' in self.boards:
+            n += 1
+        return f'board{n}'
+
+    def add_board(self, source, name=None, on_error=None, **kwargs):
+        """ Open a data source (see data_source.list_data_sources) as a new board. """
+        self._check_name(name)
+        if source.startswith(SHM_SOURCE_PREFIX):
+            name = name or self.next_name()
+            board = BusBoard(name, source[len(SHM_SOURCE_PREFIX):], max_samples=self.max_samples,
+                             on_error=on_error, lod=self.lod)
+            self.boards[name] = board
+            return board
+        return self.add_port(open_data_source(source, **kwargs), name, on_error)
+
+    def add_port(self, port, name=None, on_error=None):
+        """ Add a board on an already open port (or anything behaving like one). """
+        name = name or self.next_name()
+        self._check_name(name)
+        processor = Pipeline.from_config(self.processing) if self.processing else None
+        board = Board(name, port, max_samples=self.max_samples, on_error=on_error, lod=self.lod, processor=processor)
+        if self.publish:
+            writer = SharedRingWriter(bus_name(name), n_channels=len(board.channels),
+                                      metadata={'board': name, 'port': board.port, 'channels': board.channels})
+            board.listeners.append(writer.publish)
+            self.bus_writers[name] = writer
+        self.boards[name] = board
+        return board
+
+    def _check_name(self, name):
+        if name is not None and (name in self.boards or ADDRESS_SEPARATOR in name):
+            raise ValueError(f'Invalid or duplicate board name {name!r}')
+
+    def remove_board(self, name):
+        self.boards.pop(name).close()
+        if name in self.bus_writers:
+            self.bus_writers.pop(name).close()
+        if name in self.trigger_engines:
+            self.trigger_engines.pop(name).close()
+
+    def addresses(self):
+        return [f'{name}{ADDRESS_SEPARATOR}{i}' for name, board in self.boards.items()
+                for i in range(len(board.channels))]
+
+    def resolve(self, address):
+        """ (Board, column) for a 'board:channel' address; channel is a column number or the name of
+        a derived channel, e.g. 'rig2:5' or 'rig2:dP0'. """
+        name, _, channel = address.rpartition(ADDRESS_SEPARATOR)
+        board = self.boards.get(name)
+        if board is not None:
+            names = [c['name'] for c in board.channels]
+            if channel in names:
+                return board, names.index(channel)
+            if channel.isdigit() and int(channel) < len(names):
+                return board, int(channel)
+        raise KeyError(f'No channel {address!r}')
+
+    @property
+    def acquiring(self):
+        return any(board.acquiring for board in self.boards.values())
+
+    def start(self, recording_dir=None, metadata=None, capture_dir=None, archive=False):
+        """ Start acquiring on every board, each recording to its own file if recording_dir is given
+        (a compressed archive if archive is set) and saving triggered captures to capture_dir.
+        An acquisition already running is stopped first. Returns {board name: recording filename}. """
+        if self.acquiring:
+            self.stop()
+        filenames = {}
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        for name, board in self.boards.items():
+            self._disarm_triggers(name)
+            if capture_dir is not None and self.triggers:
+                engine = TriggerEngine(capture_dir, [Trigger.from_config(spec) for spec in self.triggers],
+                                       channels=board.channels, prefix=f'{name}_',
+                                       metadata=dict(metadata or {}, board=name, port=board.port))
+                board.listeners.append(engine.process)
+                self.trigger_engines[name] = engine
+            recorder = None
+            if recording_dir is not None:
+                extension = ARCHIVE_EXTENSION if archive else RECORDING_EXTENSION
+                filenames[name] = unique_filename(
+                    os.path.join(recording_dir, f'recording_{timestamp}_{name}{extension}'))
+                recorder = (ArchiveWriter if archive else Recorder)(
+                    filenames[name], metadata=dict(metadata or {}, board=name, port=board.port), channels=board.channels)
+            board.start(recorder)
+        return filenames
+
+    def stop(self):
+        for name, board in self.boards.items():
+            recorder = board.stop()
+            if recorder is not None:
+                recorder.close()
+            self._disarm_triggers(name)
+
+    def _disarm_triggers(self, name):
+        engine = self.trigger_engines.pop(name, None)
+        if engine is not None:
+            board = self.boards[name]
+            if engine.process in board.listeners:
+                board.listeners.remove(engine.process)
+            engine.close()
+
+    def window(self, address, t_start, t_end=None):
+        """ Copies of (timestamps, values) for one channel between t_start and t_end. """
+        board, channel = self.resolve(address)
+        with board.lock:
+            timestamps, values = board.data.window(t_start, t_end)
+            return timestamps.copy(), values[:, channel].copy()
+
+    def aligned(self, addresses, t_start, t_end, period):
+        """ Channels from any boards linearly interpolated onto one time grid with the given period.
+        Returns (grid, values) with values[:, i] for addresses[i], NaN where a board has no data. """
+        grid = np.arange(t_start, t_end, period)
+        values = np.full((len(grid), len(addresses)), np.nan, dtype=np.float32)
+        for i, address in enumerate(addresses):
+            board, c = self.resolve(address)
+            with board.lock:
+                # One sample past each end so the whole grid can be interpolated
+                timestamps = board.data.timestamps
+                i0 = max(np.searchsorted(timestamps, t_start, side='right') - 1, 0)
+                i1 = np.searchsorted(timestamps, t_end, side='left') + 1
+                timestamps, channel = timestamps[i0:i1].copy(), board.data.values[i0:i1, c].copy()
+            if len(timestamps) == 0:
+                continue
+            covered = (grid >= timestamps[0]) & (grid <= timestamps[-1])
+            values[covered, i] = np.interp(grid[covered], timestamps, channel)
+        return grid, values
+
+    def stats(self):
+        return {name: board.stats() for name, board in self.boards.items()}
+
+    def metrics(self):
+        """ {board name: Metrics}, e.g. as the sources of a metrics.MetricsLog. """
+        return {name: board.metrics for name, board in self.boards.items()}
+
+    def close(self):
+        for name in list(self.boards):
+            self.remove_board(name)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    manager = DeviceManager(max_samples=100000)
+    for source in sys.argv[1:]:
+        board = manager.add_board(source)
+        print(f'{board.name}: {source}')
+    manager.start()
+    try:
+        while True:
+            time.sleep(1)
+            for name, stats in manager.stats().items():
+                print(f"{name}: {stats['samples_per_sec']:10,.0f} samples/s  {stats['samples']:>10} total  "
+                      f"{stats['crc_dropped']} CRC errors  {stats['bytes_discarded']} bytes discarded")
+    except KeyboardInterrupt:
+        pass
+    manager.stop()
+    manager.close()
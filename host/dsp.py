@@ -0,0 +1,308 @@
+""" Streaming signal processing between decoding and storage.
+
+A Pipeline runs a list of stages over each SampleBlock a board delivers and appends their outputs
+as extra channels, so derived signals (filtered pressures, dP/dt, differences between channels)
+are stored, plotted, recorded and published exactly like the raw ones. Every stage works on whole
+blocks with numpy/scipy and carries its state (filter delay lines, the previous sample) from one
+block to the next, so the output is the same however the stream happens to be split into blocks.
+
+Pipelines are configured with a list of stage descriptions, e.g. from a JSON file:
+
+    [
+        {"type": "lowpass", "name": "P0_lp", "source": 0, "cutoff_hz": 5},
+        {"type": "moving_average", "name": "P1_avg", "source": 1, "window": 50},
+        {"type": "derivative", "name": "dP0", "source": "P0_lp"},
+        {"type": "expression", "name": "dP01", "expression": "P[0] - P[1]"}
+    ]
+
+A source is a raw channel number or the name of an earlier stage. Expressions are numpy
+expressions over P (raw channels, P[i] is channel i), t (timestamps), np and earlier stage names.
+
+Stages that depend on the sample rate are designed from the board's SampleClock once its fit has
+converged, and redesigned whenever the fitted rate moves by more than RATE_TOLERANCE. Until then
+filter outputs are NaN rather than raw samples under the filtered channel's name.
+
+scipy.signal takes over a second to import, so it is only loaded by the stages that filter.
+"""
+import abc
+import json
+import time
+
+import numpy as np
+
+from data_series import SampleBlock
+from protocol import N_CHANNELS
+
+# Processing time above this for one block is counted as an overrun (blocks are at most
+# FrameReceiver.max_block_samples long, and every stage is linear in the block length)
+BLOCK_BUDGET_SEC = 0.002
+TIMING_HISTORY = 1000
+RESERVED_NAMES = ('P', 't', 'np')  # Taken in expressions
+RATE_TOLERANCE = 0.01  # Relative change of the clock's rate that redesigns the stages
+
+
+class Stage(abc.ABC):
+    """ One derived channel. process() gets the block's timestamps and a dict of every channel so
+    far (raw 'P[i]' and earlier stage names, float64) and returns this stage's output. """
+    units = 'kPa'
+
+    def __init__(self, name):
+        if not name.isidentifier():
+            raise ValueError(f'Stage name {name!r} must be a valid identifier')
+        self.name = name
+
+    def configure(self, rate_hz):
+        """ Called when the sample rate is known, and again whenever the estimate moves. """
+
+    @abc.abstractmethod
+    def process(self, timestamps, columns):
+        pass
+
+    def reset(self):
+        pass
+
+
+def _source_key(source):
+    return f'P[{source}]' if isinstance(source, int) else source
+
+
+class Filter(Stage):
+    """ IIR or FIR filter (b, a coefficients) with its state carried between blocks. """
+
+    def __init__(self, name, source, b=None, a=(1.0,)):
+        super().__init__(name)
+        from scipy import signal  # Loaded now (when a board connects), not on its first block
+        self.source = _source_key(source)
+        self.b = None if b is None else np.asarray(b, dtype=np.float64)
+        self.a = np.asarray(a, dtype=np.float64)
+        self.zi = None
+
+    def process(self, timestamps, columns):
+        x = columns[self.source]
+        if self.b is None or (self.zi is None and np.isnan(x[0])):
+            # Not designed yet (sample rate unknown), or the source isn't either
+            return np.full_like(x, np.nan)
+        from scipy import signal
+        if self.zi is None:
+            # Start from steady state at the first sample rather than ringing up from zero
+            self.zi = signal.lfilter_zi(self.b, self.a) * x[0]
+        y, self.zi = signal.lfilter(self.b, self.a, x, zi=self.zi)
+        return y
+
+    def reset(self):
+        self.zi = None
+
+
+class LowPass(Filter):
+    """ Butterworth low-pass, designed when the sample rate is known. """
+
+    def __init__(self, name, source, cutoff_hz, order=2):
+        super().__init__(name, source)
+        self.cutoff_hz = cutoff_hz
+        self.order = order
+
+    def configure(self, rate_hz):
+        from scipy import signal
+        self.b, self.a = signal.butter(self.order, min(self.cutoff_hz / (rate_hz / 2), 0.99))
+        self.zi = None
+
+
+class MovingAverage(Stage):
+    """ Mean of the last `window` samples. Cost per block doesn't depend on the window length. """
+
+    def __init__(self, name, source, window):
+        super().__init__(name)
+        self.source = _source_key(source)
+        self.window = int(window)
+        self.history = None  # Last window - 1 inputs
+
+    def process(self, timestamps, columns):
+        x = columns[self.source]
+        if self.history is None:
+            self.history = np.full(self.window - 1, x[0])
+        padded = np.concatenate((self.history, x))
+        sums = np.cumsum(padded)
+        sums[self.window:] -= sums[:-self.window].copy()
+        self.history = padded[len(padded) - self.window + 1:] if self.window > 1 else padded[:0]
+        return sums[self.window - 1:] / self.window
+
+    def reset(self):
+        self.history = None
+
+
+class Derivative(Stage):
+    """ Rate of change per second (backward difference on the sample timestamps). """
+    units = 'kPa/s'
+
+    def __init__(self, name, source):
+        super().__init__(name)
+        self.source = _source_key(source)
+        self.period = None
+        self.previous = None  # (timestamp, value) of the last sample of the previous block
+
+    def configure(self, rate_hz):
+        self.period = 1 / rate_hz
+
+    def process(self, timestamps, columns):
+        x = columns[self.source]
+        if self.previous is None:
+            self.previous = (timestamps[0], x[0])
+        t_prev, x_prev = self.previous
+        dt = np.diff(timestamps, prepend=t_prev)
+        dx = np.diff(x, prepend=x_prev)
+        self.previous = (timestamps[-1], x[-1])
+        # Repeated timestamps (clock still converging) fall back to the nominal spacing
+        return dx / np.where(dt > 0, dt, self.period or 1.0)
+
+    def reset(self):
+        self.previous = None
+
+
+class Expression(Stage):
+    """ A numpy expression over the other channels, e.g. 'P[0] - P[1]' or '(P[2] + P[3]) / 2'. """
+
+    def __init__(self, name, expression, units=''):
+        super().__init__(name)
+        self.expression = expression
+        self.units = units
+        self.code = compile(expression, f'<{name}>', 'eval')
+
+    def process(self, timestamps, columns):
+        namespace = {'np': np, 't': timestamps, 'P': columns['P']}
+        namespace.update((key, value) for key, value in columns.items() if key.isidentifier())
+        result = eval(self.code, {'__builtins__': {}}, namespace)
+        return np.broadcast_to(np.asarray(result, dtype=np.float64), timestamps.shape)
+
+
+STAGE_TYPES = {
+    'filter': Filter,
+    'lowpass': LowPass,
+    'moving_average': MovingAverage,
+    'derivative': Derivative,
+    'expression': Expression,
+}
+
+
+class Pipeline:
+    """ The processing stage for one board (stages keep per-stream state, so never share one). """
+
+    def __init__(self, stages, rate_hz=None, n_channels=N_CHANNELS):
+        self.stages = list(stages)
+        self.n_channels = n_channels
+        self.rate_hz = None
+        names = [f'P[{i}]' for i in range(n_channels)] + list(RESERVED_NAMES)
+        for stage in self.stages:
+            if stage.name in names:
+                raise ValueError(f'Channel name {stage.name!r} is reserved or already in use')
+            names.append(stage.name)
+        if rate_hz is not None:
+            self.configure(rate_hz)
+
+        self.block_times = np.zeros(TIMING_HISTORY)
+        self.block_sizes = np.zeros(TIMING_HISTORY, dtype=np.int64)
+        self.blocks_processed = 0
+        self.budget_overruns = 0
+
+        # Catch bad sources and expressions now rather than on the acquisition thread
+        self._validate()
+
+    @classmethod
+    def from_config(cls, config, rate_hz=None):
+        """ Build from a list of {'type': ..., 'name': ..., **parameters} dicts. """
+        stages = []
+        for spec in config:
+            spec = dict(spec)
+            kind = spec.pop('type')
+            if kind not in STAGE_TYPES:
+                raise ValueError(f"Unknown stage type {kind!r} (expected one of {', '.join(STAGE_TYPES)})")
+            stages.append(STAGE_TYPES[kind](**spec))
+        return cls(stages, rate_hz)
+
+    @property
+    def channels(self):
+        """ Name and units of each output channel, in the recording header's format. """
+        return [{'name': stage.name, 'units': stage.units} for stage in self.stages]
+
+    def configure(self, rate_hz):
+        self.rate_hz = rate_hz
+        for stage in self.stages:
+            stage.configure(rate_hz)
+
+    def _validate(self):
+        timestamps = np.arange(2, dtype=np.float64)
+        columns = self._raw_columns(timestamps, np.zeros((2, self.n_channels)))
+        for stage in self.stages:
+            try:
+                columns[stage.name] = stage.process(timestamps, columns)
+            except Exception as e:
+                raise ValueError(f'Stage {stage.name!r} failed on test data: {e!r}') from e
+        for stage in self.stages:
+            stage.reset()
+
+    def _raw_columns(self, timestamps, pressures):
+        raw = pressures.astype(np.float64).T
+        columns = {f'P[{i}]': raw[i] for i in range(self.n_channels)}
+        columns['P'] = raw
+        return columns
+
+    def update_rate(self, clock):
+        """ Follow a SampleClock's fitted rate: design the stages once it has converged, and redesign
+        them if it moves by more than RATE_TOLERANCE. """
+        if clock.period is None:
+            return
+        rate_hz = 1 / clock.period
+        if self.rate_hz is None or abs(rate_hz / self.rate_hz - 1) > RATE_TOLERANCE:
+            if self.rate_hz is not None:
+                print(f'Sample rate moved from {self.rate_hz:,.1f} to {rate_hz:,.1f} Hz, redesigning DSP stages')
+            self.configure(rate_hz)
+
+    def process(self, block, clock=None):
+        """ The block with every stage's output appended as extra pressure columns. Live, clock is the
+        board's SampleClock; without one (offline) the rate is taken from the first block's timestamps. """
+        n = len(block)
+        if n == 0:
+            return SampleBlock(block.timestamps, np.empty((0, self.n_channels + len(self.stages)), np.float32),
+                               block.valves, block.arrival_times)
+        if clock is not None:
+            self.update_rate(clock)
+        elif self.rate_hz is None and n >= 2 and block.timestamps[-1] > block.timestamps[0]:
+            self.configure((n - 1) / (block.timestamps[-1] - block.timestamps[0]))
+        start = time.perf_counter()
+
+        columns = self._raw_columns(block.timestamps, block.pressures)
+        out = np.empty((n, self.n_channels + len(self.stages)), dtype=np.float32)
+        out[:, :self.n_channels] = block.pressures
+        for i, stage in enumerate(self.stages):
+            columns[stage.name] = stage.process(block.timestamps, columns)
+            out[:, self.n_channels + i] = columns[stage.name]
+
+        elapsed = time.perf_counter() - start
+        slot = self.blocks_processed % TIMING_HISTORY
+        self.block_times[slot] = elapsed
+        self.block_sizes[slot] = n
+        self.blocks_processed += 1
+        if elapsed > BLOCK_BUDGET_SEC:
+            if not self.budget_overruns:
+                print(f'DSP took {elapsed * 1e3:.2f} ms for {n} samples (budget {BLOCK_BUDGET_SEC * 1e3:g} ms)')
+            self.budget_overruns += 1
+        return SampleBlock(block.timestamps, out, block.valves, block.arrival_times)
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def stats(self):
+        count = min(self.blocks_processed, TIMING_HISTORY)
+        if not count:
+            return {'dsp_ms_p99': None, 'dsp_us_per_sample': None, 'dsp_overruns': self.budget_overruns}
+        times = self.block_times[:count]
+        return {
+            'dsp_ms_p99': float(np.percentile(times, 99) * 1e3),
+            'dsp_us_per_sample': float(times.sum() / self.block_sizes[:count].sum() * 1e6),
+            'dsp_overruns': self.budget_overruns,
+        }
+
+
+def load_config(filename):
+    with open(filename) as f:
+        return json.load(f)
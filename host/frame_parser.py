@@ -0,0 +1,112 @@
+class FrameParser:
+    """ Streaming decoder that splits a serial byte stream into frames.
+
+    Bytes are pulled from the port in whatever chunk size is waiting and copied into one
+    reusable buffer. Frames are located by their 4-byte magic; garbage between frames is
+    skipped with a single bytearray.find per resync rather than byte-by-byte.
+    """
+
+    MAGIC_LEN = 4
+
+    def __init__(self, frame_sizes, buffer_size=64 * 1024):
+        # frame_sizes maps magic bytes -> total frame length (including the magic)
+        self.frame_sizes = dict(frame_sizes)
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+        self.bytes_received = 0
+        self.bytes_discarded = 0
+        self.resyncs = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def read_from(self, ser):
+        """ Read everything currently waiting on the port (blocking for at least one byte, up to the
+        port's timeout) and append it to the buffer. Returns the number of bytes read. """
+        data = ser.read(max(ser.in_waiting, 1))
+        self.feed(data)
+        return len(data)
+
+    def feed(self, data):
+        n = len(data)
+        if n == 0:
+            return
+        if self.end + n > len(self.buffer):
+            self._make_room(n)
+        self.view[self.end:self.end + n] = data
+        self.end += n
+        self.bytes_received += n
+
+    def _make_room(self, n):
+        pending = self.end - self.start
+        if pending + n > len(self.buffer):
+            # Grow (rare: only if a single read is larger than the buffer)
+            new_buffer = bytearray(max(2 * len(self.buffer), pending + n))
+            new_buffer[:pending] = self.view[self.start:self.end]
+            self.buffer = new_buffer
+            self.view = memoryview(self.buffer)
+        else:
+            # Move the unparsed tail back to the front of the buffer
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+    def _resync(self):
+        """ Drop bytes up to the next candidate magic. If none is found, keep the last few bytes
+        since they might be the start of a magic that hasn't fully arrived yet. """
+        next_start = None
+        for magic in self.frame_sizes:
+            idx = self.buffer.find(magic, self.start + 1, self.end)
+            if idx != -1 and (next_start is None or idx < next_start):
+                next_start = idx
+        if next_start is None:
+            next_start = max(self.start + 1, self.end - (self.MAGIC_LEN - 1))
+
+        self.bytes_discarded += next_start - self.start
+        self.resyncs += 1
+        self.start = next_start
+
+    def runs(self):
+        """ Yield (magic, frames, count) for every complete frame in the buffer, merging back-to-back
+        frames with the same magic into one contiguous run so they can be decoded as a batch.
+
+        frames is a memoryview into the internal buffer and is only valid until the next feed().
+        """
+        run_magic = None
+        run_start = run_count = 0
+        while self.end - self.start >= self.MAGIC_LEN:
+            magic = bytes(self.view[self.start:self.start + self.MAGIC_LEN])
+            size = self.frame_sizes.get(magic)
+            if size is None or self.end - self.start < size:
+                if run_count:
+                    yield run_magic, self.view[run_start:self.start], run_count
+                    run_count = 0
+                if size is None:
+                    self._resync()
+                    continue
+                break
+            if magic != run_magic or not run_count:
+                if run_count:
+                    yield run_magic, self.view[run_start:self.start], run_count
+                run_magic, run_start, run_count = magic, self.start, 0
+            self.start += size
+            run_count += 1
+
+        if run_count:
+            yield run_magic, self.view[run_start:self.start], run_count
+
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def frames(self):
+        """ Yield (magic, frame) for every complete frame in the buffer.
+
+        frame is a memoryview into the internal buffer and is only valid until the next feed().
+        """
+        for magic, run, count in self.runs():
+            size = self.frame_sizes[magic]
+            for i in range(count):
+                yield magic, run[i * size:(i + 1) * size]
@@ -0,0 +1,185 @@
+""" Live sample stream over a local socket, for consumers outside the acquiring process.
+
+A client that connects first receives a header: LIVE_MAGIC, a u32 length and JSON metadata (board
+names and each board's channels). After that it receives one message per sample block: a
+'<HI' (board index, record count) prefix followed by that many records, the same layout as
+recording files, so np.frombuffer(payload, record_dtype(n_channels of that board)) decodes them.
+
+Clients that fall behind lose whole blocks (counted per client) rather than slowing acquisition.
+The address is a filesystem path (Unix domain socket) or 'host:port' (TCP, for platforms without
+Unix sockets).
+"""
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from recording import block_to_records, default_channels, record_dtype
+
+LIVE_MAGIC = b'PRZLLIVE'
+MESSAGE_HEADER = struct.Struct('<HI')
+MAX_QUEUED_BLOCKS = 256
+
+_STOP = object()
+
+
+def _open_socket(address):
+    if ':' in address and not address.startswith(os.sep):
+        host, port = address.rsplit(':', 1)
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+def _recv_exactly(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while view:
+        received = sock.recv_into(view)
+        if received == 0:
+            raise ConnectionError('live stream closed')
+        view = view[received:]
+    return bytes(buf)
+
+
+class _Client:
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.queue = queue.Queue(maxsize=MAX_QUEUED_BLOCKS)
+        self.blocks_dropped = 0
+        self.thread = threading.Thread(target=self._run, name='live-client', daemon=True)
+
+    def send(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.blocks_dropped += 1
+
+    def _run(self):
+        try:
+            self.sock.sendall(self.server.header())
+            while True:
+                message = self.queue.get()
+                if message is _STOP:
+                    break
+                self.sock.sendall(message)
+        except OSError:
+            pass  # Client went away
+        finally:
+            self.sock.close()
+            self.server.remove_client(self)
+
+    def stop(self):
+        try:
+            self.queue.put_nowait(_STOP)
+        except queue.Full:
+            self.sock.close()  # Unblocks the sender with an error
+
+
+class LiveServer:
+    """ Accepts clients on a background thread; publish() is non-blocking and safe from any thread. """
+
+    def __init__(self, address, board_names, metadata=None, channels=None):
+        self.address = address
+        self.board_names = list(board_names)
+        self.metadata = metadata or {}
+        # {board name: channel list} for boards with derived channels; the rest have the raw ones
+        self.channels = {name: (channels or {}).get(name) or default_channels() for name in self.board_names}
+        self.clients = []
+        self.lock = threading.Lock()
+
+        family, bind_address = _open_socket(address)
+        self.family = family
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.unlink(address)  # Left behind by a previous run
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(bind_address)
+        self.sock.listen()
+        self.running = True
+        self.thread = threading.Thread(target=self._accept, name='live-server', daemon=True)
+        self.thread.start()
+
+    def header(self):
+        meta = dict(self.metadata, boards=self.board_names, channels=self.channels, created=time.time())
+        encoded = json.dumps(meta).encode()
+        return LIVE_MAGIC + len(encoded).to_bytes(4, 'little') + encoded
+
+    def _accept(self):
+        while self.running:
+            try:
+                sock, _ = self.sock.accept()
+            except OSError:
+                break
+            client = _Client(self, sock)
+            with self.lock:
+                self.clients.append(client)
+            client.thread.start()
+
+    def remove_client(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def publish(self, board, block):
+        """ Board listener (see device_manager.Board.listeners). """
+        if not self.clients:
+            return
+        records = block_to_records(block)
+        message = MESSAGE_HEADER.pack(self.board_names.index(board.name), len(records)) + records.tobytes()
+        with self.lock:
+            for client in self.clients:
+                client.send(message)
+
+    def blocks_dropped(self):
+        with self.lock:
+            return sum(client.blocks_dropped for client in self.clients)
+
+    def close(self):
+        self.running = False
+        self.sock.close()
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.stop()
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+class LiveClient:
+    """ Connects to a LiveServer. Iterating yields (board name, records) for each block. """
+
+    def __init__(self, address, timeout=None):
+        family, connect_address = _open_socket(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(connect_address)
+
+        if _recv_exactly(self.sock, len(LIVE_MAGIC)) != LIVE_MAGIC:
+            raise ValueError('not a live pressure stream')
+        length = int.from_bytes(_recv_exactly(self.sock, 4), 'little')
+        self.metadata = json.loads(_recv_exactly(self.sock, length))
+        self.board_names = self.metadata['boards']
+        self.dtypes = [record_dtype(len(self.metadata['channels'][name])) for name in self.board_names]
+
+    def read_block(self):
+        board, n = MESSAGE_HEADER.unpack(_recv_exactly(self.sock, MESSAGE_HEADER.size))
+        dtype = self.dtypes[board]
+        records = np.frombuffer(_recv_exactly(self.sock, n * dtype.itemsize), dtype=dtype)
+        return self.board_names[board], records
+
+    def __iter__(self):
+        try:
+            while True:
+                yield self.read_block()
+        except ConnectionError:
+            return
+
+    def close(self):
+        self.sock.close()
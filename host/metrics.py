@@ -0,0 +1,170 @@
+""" Low-overhead pipeline metrics.
+
+Every stage of the data path records into metrics owned by the thread that runs it, so recording
+never takes a lock: a Counter is a plain integer, a Histogram a fixed list of log-spaced buckets
+(1 us to ~17 s, 4 per octave), each written by a single thread. Gauges are functions evaluated
+when a snapshot is taken (queue depths, existing counters kept by other classes).
+
+Readers aggregate periodically: Metrics.snapshot() copies the cumulative state (cheap, and
+consistent enough for diagnostics without stopping the writers), and summarize(current, previous)
+turns two snapshots into rates and the latency percentiles of just that interval. Each reader
+keeps its own previous snapshot, so the GUI overlay and a MetricsLog can watch the same metrics.
+"""
+import bisect
+import json
+import threading
+import time
+
+import numpy as np
+
+BUCKETS_PER_OCTAVE = 4
+MIN_SECONDS = 1e-6
+N_BUCKETS = BUCKETS_PER_OCTAVE * 24 + 1
+# Upper bound of each bucket; the last one also takes anything slower
+BUCKET_BOUNDS = [MIN_SECONDS * 2 ** (i / BUCKETS_PER_OCTAVE) for i in range(N_BUCKETS)]
+LOG_INTERVAL_SEC = 10.0
+
+
+class Counter:
+    """ Monotonic count, written by one thread. """
+
+    def __init__(self):
+        self.value = 0
+
+    def add(self, n=1):
+        self.value += n
+
+
+class Histogram:
+    """ Durations in seconds, written by one thread. """
+
+    def __init__(self):
+        self.counts = [0] * (N_BUCKETS + 1)
+        self.total = 0.0
+        self.max = 0.0  # Since the start: readers snapshot independently, so it can't be reset per interval
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self):
+        return np.array(self.counts), self.total, self.max
+
+
+def bucket_percentile(counts, q):
+    """ Upper bound of the bucket holding the q-th percentile (resolution ~19%). """
+    total = counts.sum()
+    if not total:
+        return None
+    i = int(np.searchsorted(np.cumsum(counts), q / 100 * total))
+    return BUCKET_BOUNDS[min(i, N_BUCKETS - 1)]
+
+
+class Metrics:
+    """ One component's named counters, histograms and gauges. """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}  # name -> (fn, cumulative)
+
+    def counter(self, name):
+        return self.counters.setdefault(name, Counter())
+
+    def histogram(self, name):
+        return self.histograms.setdefault(name, Histogram())
+
+    def gauge(self, name, fn, cumulative=False):
+        """ fn() is read at each snapshot; cumulative gauges (running totals) also get a rate. """
+        self.gauges[name] = (fn, cumulative)
+
+    def snapshot(self):
+        values = {name: counter.value for name, counter in self.counters.items()}
+        for name, (fn, cumulative) in self.gauges.items():
+            try:
+                values[name] = fn()
+            except Exception:  # A gauge on something that has gone away (e.g. a closed recorder)
+                values[name] = None
+        return {
+            'time': time.monotonic(),
+            'values': values,
+            'rates': set(self.counters) | {name for name, (fn, cumulative) in self.gauges.items() if cumulative},
+            'histograms': {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+        }
+
+
+def summarize(current, previous=None):
+    """ Flat dict of one interval: values, '<name>_per_sec' rates, and '<name>_p50_ms', '_p99_ms',
+    '_count' of each histogram over the interval (over everything so far without a previous), plus
+    its '_session_max_ms', the slowest sample since the start. """
+    elapsed = current['time'] - previous['time'] if previous is not None else None
+    summary = {}
+    for name, value in current['values'].items():
+        summary[name] = value
+        if name in current['rates'] and elapsed and previous['values'].get(name) is not None and value is not None:
+            summary[f'{name}_per_sec'] = (value - previous['values'][name]) / elapsed
+    for name, (counts, total, peak) in current['histograms'].items():
+        if previous is not None and name in previous['histograms']:
+            before_counts, before_total, _ = previous['histograms'][name]
+            counts, total = counts - before_counts, total - before_total
+        n = int(counts.sum())
+        # Percentiles are bucket upper bounds; no sample in the interval is slower than the session
+        # max, so that bounds them too and keeps p99 from reading above the max shown next to it
+        p50, p99 = (None if p is None else min(p, peak) for p in (bucket_percentile(counts, q) for q in (50, 99)))
+        summary[f'{name}_count'] = n
+        summary[f'{name}_mean_ms'] = total / n * 1e3 if n else None
+        summary[f'{name}_p50_ms'] = None if p50 is None else p50 * 1e3
+        summary[f'{name}_p99_ms'] = None if p99 is None else p99 * 1e3
+        summary[f'{name}_session_max_ms'] = peak * 1e3
+    return summary
+
+
+def format_summary(summary, histograms):
+    """ Lines of text for the overlay: counters and rates first, then one line per histogram. """
+    lines = []
+    for name, value in summary.items():
+        if any(name.startswith(f'{h}_') for h in histograms) or name.endswith('_per_sec') or value is None:
+            continue
+        rate = summary.get(f'{name}_per_sec')
+        lines.append(f'{name:<18}{value:>14,.0f}' + ('' if rate is None else f'{rate:>14,.1f}/s'))
+    for name in histograms:
+        if summary.get(f'{name}_count'):
+            lines.append(f"{name:<18}{summary[f'{name}_count']:>8,} x  p50 {summary[f'{name}_p50_ms']:7.3f}  "
+                         f"p99 {summary[f'{name}_p99_ms']:7.3f}  session max {summary[f'{name}_session_max_ms']:7.3f} ms")
+    return lines
+
+
+class MetricsLog:
+    """ Appends a JSON line of every source's interval summary to filename every interval seconds.
+    sources() returns {name: Metrics}, so boards that come and go are followed. """
+
+    def __init__(self, filename, sources, interval=LOG_INTERVAL_SEC):
+        self.filename = filename
+        self.sources = sources
+        self.interval = interval
+        self.previous = {}
+        self.stopped = threading.Event()
+        self.file = open(filename, 'a')
+        self.thread = threading.Thread(target=self._run, name='metrics-log', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+        self.write()
+        self.file.close()
+
+    def write(self):
+        line = {'time': time.time()}
+        for name, metrics in self.sources().items():
+            snapshot = metrics.snapshot()
+            line[name] = summarize(snapshot, self.previous.get(name))
+            self.previous[name] = snapshot
+        self.file.write(json.dumps(line) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
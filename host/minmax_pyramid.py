@@ -0,0 +1,156 @@
+import json
+import os
+
+import numpy as np
+
+from data_series import DataSeries
+
+# Bound the temporaries when folding a large backlog (e.g. indexing a recording on disk)
+UPDATE_CHUNK_BLOCKS = 1 << 16
+
+
+class MinMaxPyramid:
+    """ Min/max decimation levels over a DataSeries, extended incrementally as the series grows.
+
+    Level k summarizes blocks of factor**k raw samples: each block keeps its first timestamp and the
+    per-channel min and max. A query picks the coarsest level that still gives enough points for the
+    requested pixel width, so drawing costs O(width) regardless of how long the recording is.
+    """
+
+    def __init__(self, source, factor=8):
+        self.source = source
+        self.factor = factor
+        self.n_channels = source.n_channels
+        # levels[k - 1] is level k, stored as a DataSeries with columns [mins..., maxes...]
+        self.levels = []
+        # consumed[k - 1] is the absolute index (in level k - 1) of the next sample to fold into level k
+        self.consumed = []
+
+    def clear(self):
+        self.levels = []
+        self.consumed = []
+
+    def level(self, k):
+        return self.levels[k - 1] if k else self.source
+
+    def _add_level(self):
+        below = self.level(len(self.levels))
+        max_samples = below.max_samples // self.factor + 1 if below.max_samples else None
+        self.levels.append(DataSeries(n_channels=2 * self.n_channels, max_samples=max_samples))
+        self.consumed.append(below.n_appended - len(below))
+
+    def update(self):
+        """ Fold any complete blocks of new samples into the pyramid. Cost is proportional to the
+        number of samples added since the last call. """
+        if not self.levels and len(self.source) >= 2 * self.factor:
+            self._add_level()
+
+        n = self.n_channels
+        k = 1
+        while k <= len(self.levels):
+            below = self.level(k - 1)
+            while True:
+                first = below.n_appended - len(below)
+                start = max(self.consumed[k - 1], first)
+                n_blocks = min((below.n_appended - start) // self.factor, UPDATE_CHUNK_BLOCKS)
+                if not n_blocks:
+                    break
+                i0 = start - first
+                i1 = i0 + n_blocks * self.factor
+                blocks = below.values[i0:i1].reshape(n_blocks, self.factor, -1)
+                if k == 1:
+                    mins, maxs = blocks.min(axis=1), blocks.max(axis=1)
+                else:
+                    mins, maxs = blocks[:, :, :n].min(axis=1), blocks[:, :, n:].max(axis=1)
+                self.levels[k - 1].append(below.timestamps[i0:i1:self.factor], np.concatenate((mins, maxs), axis=1))
+                self.consumed[k - 1] = start + n_blocks * self.factor
+
+            if k == len(self.levels) and len(self.levels[k - 1]) >= 2 * self.factor:
+                self._add_level()
+            k += 1
+
+    def save(self, dirname):
+        """ Persist the index next to a recording so it doesn't have to be rebuilt on the next open.
+        Each level is a plain .npy pair, so load() can memory-map it. """
+        os.makedirs(dirname, exist_ok=True)
+        for k, level in enumerate(self.levels, start=1):
+            np.save(os.path.join(dirname, f'level{k}_timestamps.npy'), level.timestamps)
+            np.save(os.path.join(dirname, f'level{k}_values.npy'), level.values)
+        with open(os.path.join(dirname, 'index.json'), 'w') as f:
+            json.dump({'factor': self.factor, 'n_channels': self.n_channels, 'consumed': self.consumed,
+                       'source_appended': self.source.n_appended}, f)
+
+    @classmethod
+    def load(cls, dirname, source):
+        """ Open a saved index for source with its levels memory-mapped, then fold in anything the
+        source gained since it was saved. Returns None if there is no usable index. """
+        try:
+            with open(os.path.join(dirname, 'index.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta['n_channels'] != source.n_channels or meta['source_appended'] > source.n_appended:
+            return None
+
+        pyramid = cls(source, factor=meta['factor'])
+        for k in range(1, len(meta['consumed']) + 1):
+            timestamps = np.load(os.path.join(dirname, f'level{k}_timestamps.npy'), mmap_mode='r')
+            values = np.load(os.path.join(dirname, f'level{k}_values.npy'), mmap_mode='r')
+            pyramid.levels.append(DataSeries.from_arrays(timestamps, values))
+        pyramid.consumed = list(meta['consumed'])
+        pyramid.update()
+        return pyramid
+
+    def _coverage_end(self, k):
+        """ Timestamp of the first sample in level k - 1 that hasn't been folded into level k yet. """
+        below = self.level(k - 1)
+        idx = self.consumed[k - 1] - (below.n_appended - len(below))
+        if idx >= len(below):
+            return np.inf
+        return below.timestamps[max(idx, 0)]
+
+    def select_level(self, t_start, t_end, width):
+        """ Coarsest-needed level: raw data if it has at most 2*width points in range, otherwise the
+        finest level with at most width blocks in range (each block draws as two points). """
+        for k in range(len(self.levels) + 1):
+            timestamps = self.level(k).timestamps
+            count = np.searchsorted(timestamps, t_end, side='right') - np.searchsorted(timestamps, t_start)
+            if count <= (2 * width if k == 0 else width):
+                return k
+        return len(self.levels)
+
+    def query(self, channel, t_start, t_end, width):
+        """ (x, y) arrays for one channel over [t_start, t_end] with roughly at most 2*width points.
+
+        The selected level covers the range up to where it has been built; the remaining tail is
+        filled in from progressively finer levels (each contributing fewer than factor blocks).
+        """
+        k = self.select_level(t_start, t_end, width)
+        xs, ys = [], []
+        t_from = t_start
+        for j in range(k, 0, -1):
+            level = self.levels[j - 1]
+            timestamps = level.timestamps
+            t_to = min(t_end, self._coverage_end(j))
+            # Include the block that contains t_from
+            i0 = max(np.searchsorted(timestamps, t_from, side='right') - 1, 0)
+            i1 = np.searchsorted(timestamps, t_to, side='left')
+            if i1 > i0:
+                xs.append(np.repeat(timestamps[i0:i1], 2))
+                ys.append(np.column_stack((level.values[i0:i1, channel],
+                                           level.values[i0:i1, self.n_channels + channel])).ravel())
+            t_from = max(t_from, t_to)
+            if t_from >= t_end:
+                break
+        else:
+            timestamps = self.source.timestamps
+            i0 = np.searchsorted(timestamps, t_from, side='left')
+            if not xs:
+                i0 = max(i0 - 1, 0)  # One point past each edge so lines reach the border
+            i1 = np.searchsorted(timestamps, t_end, side='right') + 1
+            xs.append(timestamps[i0:i1])
+            ys.append(self.source.values[i0:i1, channel])
+
+        if len(xs) == 1:
+            return xs[0], ys[0]
+        return np.concatenate(xs), np.concatenate(ys)
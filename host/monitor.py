@@ -1,67 +1,137 @@
-import struct
-import serial
-import crcmod
+""" Headless acquisition daemon: reads one or more boards, records to disk and serves live data.
+
+Nothing here imports PyQt5 or pyqtgraph, so it runs on small Linux boxes without a display:
+
+    python monitor.py /dev/ttyACM0 [/dev/ttyACM1 ...] [--record-dir DIR] [--live ADDRESS] [--dsp CONFIG]
+
+Each board records to its own file in --record-dir (unless --no-record). Live samples are published
+on --live (a Unix socket path, or host:port) for other processes; see live_stream.LiveClient, or
+run `python monitor.py --listen ADDRESS` to print what a running daemon is sending. Local processes
+can also attach to each board's shared-memory ring (shm_bus; 'shm:<bus>' in the GUI's port list)
+without going through the socket, unless --no-shm. Runs until
+SIGINT/SIGTERM, then closes every recording cleanly. --dsp adds derived channels to every board
+(a JSON list of stages, see dsp), which are recorded and served after the raw ones. --triggers
+arms triggered captures (see triggers) on every board, saved to --capture-dir whether or not the
+whole session is recorded, e.g. `--no-record --triggers bursts.json` keeps only the events.
+--archive records compressed, indexed archives (see archive) instead of raw recordings.
+--metrics FILE appends every board's pipeline metrics (see metrics) to FILE as a JSON line per
+stats interval.
+"""
+import argparse
+import os
+import signal
+import sys
 import threading
 import time
-from queue import Queue
 
-# Constants
-SERIAL_PORT = "/dev/ttyACM2"  # Replace with your serial port
-BAUDRATE = 115200
-MAGIC = b'PRZL'  # Expected magic bytes
-PACKET_SIZE = 4 + 8 * 4 + 4  # 4 bytes for magic, 8 floats, 4 bytes for CRC
+from device_manager import DeviceManager
+import dsp
+import triggers
+from live_stream import LiveClient, LiveServer
+from metrics import MetricsLog
+
+DEFAULT_RECORD_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'recordings')
+DEFAULT_LIVE_ADDRESS = '/tmp/pressure-monitor.sock' if hasattr(os, 'fork') else 'localhost:47011'
+HISTORY_SAMPLES = 10000  # In-memory history per board; the recording has the full session
+STATS_INTERVAL_SEC = 10.0
+
+
+def run_daemon(sources, record_dir=DEFAULT_RECORD_DIR, live_address=DEFAULT_LIVE_ADDRESS,
+               stats_interval=STATS_INTERVAL_SEC, publish_shm=True, processing=None, trigger_config=None,
+               capture_dir=DEFAULT_RECORD_DIR, archive=False, metrics_file=None):
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+
+    # No plotting, so no level-of-detail index
+    devices = DeviceManager(max_samples=HISTORY_SAMPLES, lod=False, publish=publish_shm, processing=processing,
+                            triggers=trigger_config)
+    for source in sources:
+        board = devices.add_board(source, on_error=lambda error, fatal: stop.set() if fatal else None)
+        print(f'{board.name}: {source}')
+    for name, writer in devices.bus_writers.items():
+        print(f'{name}: shared-memory bus {writer.name}')
+
+    server = None
+    if live_address:
+        server = LiveServer(live_address, list(devices.boards),
+                            channels={name: board.channels for name, board in devices.boards.items()})
+        for board in devices.boards.values():
+            board.listeners.append(server.publish)
+        print(f'Serving live data on {live_address}')
+
+    if record_dir:
+        os.makedirs(record_dir, exist_ok=True)
+    for name, filename in devices.start(record_dir or None, capture_dir=capture_dir if trigger_config else None,
+                                        archive=archive).items():
+        print(f'{name}: recording to {filename}')
+    if trigger_config:
+        print(f"Triggers {', '.join(spec['name'] for spec in trigger_config)} capturing to {capture_dir}")
+
+    metrics_log = MetricsLog(metrics_file, devices.metrics, stats_interval) if metrics_file else None
+    devices.stats()
+    while not stop.wait(stats_interval):
+        for name, stats in devices.stats().items():
+            print(f"{time.strftime('%H:%M:%S')} {name}: {stats['samples_per_sec']:,.1f} samples/s  "
+                  f"{stats['samples']} total  {stats['crc_dropped']} CRC errors  "
+                  f"{stats['bytes_discarded']} bytes discarded  {stats['record_dropped']} blocks not recorded")
+            if stats['jitter_ms'] is not None:
+                print(f"    sample clock {stats['rate_hz']:,.3f} Hz  latency {stats['latency_ms']:.2f} ms  "
+                      f"jitter {stats['jitter_ms']:.2f} ms (p99 {stats['jitter_p99_ms']:.2f})  "
+                      f"{stats['burst_mean']:.1f} samples/burst (max {stats['burst_max']})")
+            if stats['dsp_ms_p99'] is not None:
+                print(f"    DSP {stats['dsp_us_per_sample']:.2f} us/sample, p99 {stats['dsp_ms_p99']:.2f} ms/block, "
+                      f"{stats['dsp_overruns']} blocks over budget")
+        for name, engine in devices.trigger_engines.items():
+            print(f"    {name} triggers: " + '  '.join(f'{t.name} {t.events}' for t in engine.triggers) +
+                  (f'  ({engine.events_dropped} captures dropped)' if engine.events_dropped else ''))
+        if server is not None and server.clients:
+            print(f'{len(server.clients)} live clients, {server.blocks_dropped()} blocks dropped')
+
+    print('Stopping')
+    devices.stop()
+    if metrics_log is not None:
+        metrics_log.close()
+    if server is not None:
+        server.close()
+    devices.close()
+
+
+def listen(address):
+    """ Print a one-line summary of every block a running daemon publishes. """
+    client = LiveClient(address)
+    print(f"Connected to {address}: boards {', '.join(client.board_names)}")
+    try:
+        for board, records in client:
+            print(f"{board}: {len(records)} samples, last {records['pressures'][-1].round(2).tolist()}")
+    except KeyboardInterrupt:
+        pass
+    client.close()
 
 
-def calculate_crc(data):
-    pcrc = crcmod.Crc(0x104c11db7, initCrc=0xffffffff, rev=False)
-    pcrc.update(data)
-    return pcrc.crcValue
-
-
-def ser_read_thread(ser):
-    while True:
-        # Read the expected packet size from the serial port
-        raw_data = ser.read(PACKET_SIZE)
-
-        if len(raw_data) != PACKET_SIZE:
-            print("Incomplete packet received")
-            continue
-
-        # Unpack the packet
-        try:
-            unpacked_data = struct.unpack('<4s8fI', raw_data)
-            magic = unpacked_data[0]
-            pressures = unpacked_data[1:9]
-            received_crc = unpacked_data[9]
-
-            # Check magic bytes
-            if magic != MAGIC:
-                print("Magic bytes mismatch. Discarding packet.")
-                continue
-
-            # Calculate CRC on the received data except the last 4 bytes (the CRC)
-            data_for_crc = raw_data[0:-4]
-            calculated_crc = calculate_crc(data_for_crc)
-
-            # Verify CRC
-            if calculated_crc != received_crc:
-                print(f"CRC mismatch! Expected: {received_crc:#010x}, Calculated: {calculated_crc:#010x}")
-                continue
-
-            # If everything checks out, print the pressures
-            # print("Received pressures:", pressures)
-
-        except struct.error as e:
-            print("Failed to unpack data:", e)
-
-
-# Main function to read and parse data
-def read_serial_data():
-    with serial.Serial(SERIAL_PORT, BAUDRATE, timeout=1) as ser:
-        read_thread = threading.Thread(target=ser_read_thread, args=(ser,), daemon=True)
-        read_thread.start()
-
-
-# Run the function
 if __name__ == "__main__":
-    read_serial_data()
+    parser = argparse.ArgumentParser(description='Headless pressure board acquisition')
+    parser.add_argument('sources', nargs='*', help='Serial ports (or Emulator, replay:<file>)')
+    parser.add_argument('--record-dir', default=DEFAULT_RECORD_DIR)
+    parser.add_argument('--no-record', action='store_true')
+    parser.add_argument('--archive', action='store_true', help='Record compressed archives (see archive.py)')
+    parser.add_argument('--live', default=DEFAULT_LIVE_ADDRESS, help="Unix socket path or host:port; '' to disable")
+    parser.add_argument('--no-shm', action='store_true', help="Don't publish boards on the shared-memory bus")
+    parser.add_argument('--dsp', metavar='CONFIG', help='JSON file of derived channel stages (see dsp.py)')
+    parser.add_argument('--triggers', metavar='CONFIG', help='JSON file of triggers (see triggers.py)')
+    parser.add_argument('--capture-dir', default=DEFAULT_RECORD_DIR, help='Where triggered captures are saved')
+    parser.add_argument('--metrics', metavar='FILE', help='Append pipeline metrics to FILE (JSON lines)')
+    parser.add_argument('--stats-interval', type=float, default=STATS_INTERVAL_SEC)
+    parser.add_argument('--listen', metavar='ADDRESS', help='Print the live stream of a running daemon instead')
+    args = parser.parse_args()
+
+    if args.listen:
+        listen(args.listen)
+    elif not args.sources:
+        parser.error('no sources given')
+    else:
+        run_daemon(args.sources, None if args.no_record else args.record_dir, args.live, args.stats_interval,
+                   not args.no_shm, dsp.load_config(args.dsp) if args.dsp else None,
+                   triggers.load_config(args.triggers) if args.triggers else None, args.capture_dir, args.archive,
+                   args.metrics)
+    sys.exit(0)
@@ -1,42 +1,101 @@
 import os
 import sys
 import random
+import threading
 import time
-from PyQt5 import QtWidgets, QtCore
+from PyQt5 import QtWidgets, QtCore, QtGui
+import numpy as np
 import pyqtgraph as pg
 from PyQt5.QtWidgets import QFileDialog
 from pyqtgraph.parametertree import ParameterTree
 from pyqtgraph.parametertree.parameterTypes import SimpleParameter
 
-from parameters import GuiParameters
-from serial_comms import SerialWorker
+from parameters import STATS_SESSION, GuiParameters
 from serial_connection import SerialConnectionWidget
 
-from data_series import DataSeries, DataPoint
+from data_series import DataSeries
+from device_manager import DeviceManager
+from metrics import Metrics, format_summary, summarize
+import dsp
+import triggers
+from minmax_pyramid import MinMaxPyramid
+import archive
+import export
+from recording import RECORDING_EXTENSION, open_records
+from running_stats import RunningStats, format_table
+from timestamping import now
 
 N_CHANNELS = 8
+MAX_HISTORY_SAMPLES = None  # Set to keep only the most recent N samples in memory (ring mode)
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'recordings')
+PUBLISH_SHARED_MEMORY = True  # Other local processes can attach to connected boards as 'shm:<bus>'
+LOD_SUFFIX = '.lod'  # Saved MinMaxPyramid directory next to each opened recording
+# Derived channels (a JSON list of dsp stages) added to every connected board, if the file exists
+DSP_CONFIG_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'dsp.json')
+# Triggers (see triggers.py) armed on every board while running, captures saved to RECORDINGS_DIR
+TRIGGER_CONFIG_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'triggers.json')
+ARCHIVE_RECORDINGS = False  # Record compressed archives (see archive.py) instead of raw recordings
+METRICS_UPDATE_MS = 1000  # Performance overlay refresh (and the interval its rates are taken over)
+EXPORT_PROGRESS_MS = 100
+STATS_UPDATE_MS = 500
+AUTOSCALE_PADDING = 0.05
+COMPARE_POINTS_PER_PIXEL = 2  # Resolution of the board comparison plot's common time grid
 
 
 class Application(QtWidgets.QWidget):
-    # Signal to start the serial listening worker in a separate thread
-    start_serial_sig = QtCore.pyqtSignal()
-
     def __init__(self):
         super().__init__()
 
+        # PlotItems and their curves are only built the first time a channel is shown (None until then)
         self.graphs = []
         self.plots = []
+        self.plot_labels = []
+        self.startup_finished = False
         self.n_channels = N_CHANNELS
+        # Checklist label per plotted column: raw channels by number, derived ones by name
+        self.channel_labels = [str(i) for i in range(N_CHANNELS)]
 
         self.graph_panel = pg.GraphicsLayoutWidget()
 
-        self.data = DataSeries(n_channels=N_CHANNELS)
-
-        self.serial_connection = None
-
-        self.serial_worker = None
-        self.serial_worker_thread = QtCore.QThread(self)
-        self.serial_connection = None
+        # What is plotted: the selected board's store while live, or a recording opened for review.
+        # Boards append on their own threads, so reads go through data_lock.
+        self.data = DataSeries(n_channels=N_CHANNELS, max_samples=MAX_HISTORY_SAMPLES)
+        self.data_pyramid = MinMaxPyramid(self.data)
+        self.data_lock = threading.Lock()
+        self.visible_channels = set(range(N_CHANNELS))
+
+        # Channels of any connected boards ('board:channel'), plotted together on DeviceManager.aligned()'s
+        # common time grid in one extra plot below the selected board's
+        self.compare_addresses = []
+        self.compare_boards = set()
+        self.compare_plot = None
+        self.compare_curves = []
+
+        processing = dsp.load_config(DSP_CONFIG_FILE) if os.path.exists(DSP_CONFIG_FILE) else None
+        trigger_config = triggers.load_config(TRIGGER_CONFIG_FILE) if os.path.exists(TRIGGER_CONFIG_FILE) else None
+        self.devices = DeviceManager(max_samples=MAX_HISTORY_SAMPLES, publish=PUBLISH_SHARED_MEMORY,
+                                     processing=processing, triggers=trigger_config)
+        self.board = None  # Selected board: plotted, and the target of valve commands
+
+        # Plotting's own metrics, shown in the performance overlay with every board's
+        self.metrics = Metrics()
+        self.frames_drawn = self.metrics.counter('frames')
+        self.render_time = self.metrics.histogram('render')  # update_plots' work; Qt paints afterwards
+        self.display_latency = self.metrics.histogram('display_latency')  # Newest sample's age when drawn
+        self.metrics_previous = {}
+
+        self.recording_filenames = {}
+        self.recording_filename = None
+        # Statistics of an opened recording; live boards keep their own (board.channel_stats)
+        self.review_stats = None
+        self.y_ranges = {}  # Last autoscaled Y range per plot
+
+        # Saving runs on a background thread (see export.py); the progress dialog is polled
+        self.exporter = None
+        self.export_progress = None
+        self.export_timer = QtCore.QTimer(self)
+        self.export_timer.setInterval(EXPORT_PROGRESS_MS)
+        self.export_timer.timeout.connect(self.update_export)
 
         # Timer for updating graphs
         self.update_graph_timer = QtCore.QTimer()
@@ -44,6 +103,7 @@ class Application(QtWidgets.QWidget):
         self.update_graph_timer.setSingleShot(True)
         self.running = False
         self.new_data_available = False
+        self.view_changed = False
 
         # Set up the layout
         self.setWindowTitle("Pneumatic Interface GUI")
@@ -54,6 +114,7 @@ class Application(QtWidgets.QWidget):
         self.start_button = QtWidgets.QPushButton("Start")
         self.stop_button = QtWidgets.QPushButton("Stop")
         self.save_button = QtWidgets.QPushButton("Save Data")
+        self.open_button = QtWidgets.QPushButton("Open Recording")
 
         self.param_list = ParameterTree()
         self.params = GuiParameters(self)
@@ -71,26 +132,14 @@ class Application(QtWidgets.QWidget):
 
         self.control_panel.addWidget(start_stop_frame)
         self.control_panel.addWidget(self.save_button)
+        self.control_panel.addWidget(self.open_button)
         self.control_panel.addSpacing(50)
         self.control_panel.addWidget(self.param_list)
         # self.control_panel.addStretch()
 
-        # Create 8 line graphs in the graph panel TODO Move this to app_state
+        # One plot per channel TODO Move this to app_state. Built lazily: see finish_startup
         for i in range(8):
-            plot = self.graph_panel.addPlot(row=i, col=0, axisItems={'bottom': pg.DateAxisItem()})
-            plot.showGrid(x=True, y=True)
-            plot.setLabel('left', f"P[{i}]")
-            plot.setLabel('bottom', "Time")
-            plot.setXRange(0, 10)  # Initial time range of 10 seconds
-            plot.setYRange(-10, 10)  # Set reasonable Y-axis range for signal
-            plot.setDownsampling(mode='peak')
-            plot.showGrid(x=True, y=True)
-            plot_curve = plot.plot(pen=pg.mkPen(color=(i * 30, 100, 200)), fillLevel=-0.3, brush=(50, 50, 200, 100))
-            self.graphs.append(plot)
-            self.plots.append(plot_curve)
-
-        for i in range(1, 8):
-            self.graphs[i].setXLink(self.graphs[0])
+            self.add_plot(i, f"P[{i}]")
 
         # Add control and graph panels to main layout
         self.layout = QtWidgets.QSplitter()
@@ -107,10 +156,130 @@ class Application(QtWidgets.QWidget):
         hbox = QtWidgets.QHBoxLayout()
         hbox.addWidget(self.layout)
         self.setLayout(hbox)
+
+        # Performance overlay, floating over the top left of the plots
+        self.overlay = QtWidgets.QLabel(self.graph_panel)
+        self.overlay.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.overlay.setStyleSheet("background-color: rgba(0, 0, 0, 170); color: white; padding: 4px;")
+        self.overlay.move(60, 10)
+        self.overlay.hide()
+        self.overlay_timer = QtCore.QTimer(self)
+        self.overlay_timer.setInterval(METRICS_UPDATE_MS)
+        self.overlay_timer.timeout.connect(self.update_overlay)
+        self.stats_timer = QtCore.QTimer(self)
+        self.stats_timer.setInterval(STATS_UPDATE_MS)
+        self.stats_timer.timeout.connect(self.update_stats_table)
         # Connect buttons to methods
         self.start_button.clicked.connect(self.start_data)
         self.stop_button.clicked.connect(self.stop_data)
         self.save_button.clicked.connect(self.save_data)
+        self.open_button.clicked.connect(self.open_recording)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.startup_finished:
+            # The window is on screen; build the rest once this paint is done
+            self.startup_finished = True
+            QtCore.QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
+        """ Deferred from __init__ so the window appears at once: the device control subtrees and
+        the plots of the visible channels. """
+        self.params.add_device_controls()
+        self.params.update_graph_visibility()
+        self.stats_timer.start()
+
+    def add_plot(self, i, label):
+        """ Declare plot i; its PlotItem is created by plot_item() when it is first shown. """
+        self.graphs.append(None)
+        self.plots.append(None)
+        self.plot_labels.append(label)
+
+    def plot_item(self, i):
+        """ Plot i, created on first use. Plot 0 always exists once any plot does: every plot's X
+        axis is linked to it. """
+        if self.graphs[i] is not None:
+            return self.graphs[i]
+        if i != 0:
+            self.plot_item(0)
+        plot = pg.PlotItem(axisItems={'bottom': pg.DateAxisItem()})
+        plot.showGrid(x=True, y=True)
+        plot.setLabel('left', self.plot_labels[i])
+        plot.setLabel('bottom', "Time")
+        plot.setXRange(0, 10)  # Initial time range of 10 seconds
+        plot.enableAutoRange(y=False)  # Autoscaled from the channel statistics, see autoscale()
+        plot.setDownsampling(mode='peak')
+        plot.showGrid(x=True, y=True)
+        plot_curve = plot.plot(pen=pg.mkPen(color=(i * 30 % 256, 100, 200)), fillLevel=-0.3, brush=(50, 50, 200, 100))
+        if i == 0:
+            plot.sigXRangeChanged.connect(self.plot_view_changed)
+        else:
+            plot.setXLink(self.graphs[0])
+        self.graphs[i] = plot
+        self.plots[i] = plot_curve
+        return plot
+
+    def compare_plot_item(self):
+        """ The board comparison plot, created on first use and X-linked to the channel plots. """
+        if self.compare_plot is None:
+            plot = pg.PlotItem(axisItems={'bottom': pg.DateAxisItem()})
+            plot.showGrid(x=True, y=True)
+            plot.setLabel('left', 'Boards')
+            plot.setLabel('bottom', "Time")
+            plot.addLegend()
+            plot.setXLink(self.plot_item(0))
+            self.compare_plot = plot
+        return self.compare_plot
+
+    def available_addresses(self):
+        """ Every connected board's channels as 'board:channel': raw ones by number, derived ones by name. """
+        return [f'{name}:{i if i < N_CHANNELS else channel["name"]}' for name, board in self.devices.boards.items()
+                for i, channel in enumerate(board.channels)]
+
+    def set_compare_addresses(self, addresses):
+        self.compare_addresses = list(addresses)
+        self.compare_boards = {address.rpartition(':')[0] for address in self.compare_addresses}
+        if self.compare_addresses or self.compare_plot is not None:
+            plot = self.compare_plot_item()
+            plot.clear()  # Also empties the legend
+            self.compare_curves = [plot.plot(name=address, pen=pg.intColor(k, hues=max(len(addresses), 8)))
+                                   for k, address in enumerate(self.compare_addresses)]
+        self.params.update_graph_visibility()
+
+    def update_compare_plot(self, width):
+        """ Redraw the compared channels over the plots' current time range. They are interpolated
+        onto a common grid of about COMPARE_POINTS_PER_PIXEL points per pixel rather than reduced
+        to a min/max envelope, so spikes narrower than a grid step can be missed. """
+        t_start, t_end = self.compare_plot.getViewBox().viewRange()[0]
+        if t_end <= t_start:
+            return
+        addresses = [address for address in self.compare_addresses if address.rpartition(':')[0] in self.devices.boards]
+        grid, values = self.devices.aligned(addresses, t_start, t_end,
+                                            (t_end - t_start) / (width * COMPARE_POINTS_PER_PIXEL))
+        columns = dict(zip(addresses, values.T))
+        for address, curve in zip(self.compare_addresses, self.compare_curves):
+            if address in columns:
+                curve.setData(x=grid, y=columns[address], connect='finite')
+            else:
+                curve.clear()
+
+    def set_channels(self, channels):
+        """ Match the plots to a store's columns (recording header format): the raw channels plus
+        one plot per derived channel. """
+        derived = channels[N_CHANNELS:]
+        labels = [str(i) for i in range(N_CHANNELS)] + [c['name'] for c in derived]
+        if labels == self.channel_labels:
+            return
+        while len(self.graphs) > N_CHANNELS:
+            plot = self.graphs.pop()
+            self.plots.pop()
+            self.plot_labels.pop()
+            if plot is not None and plot.scene() is not None:
+                self.graph_panel.removeItem(plot)
+        for i, channel in enumerate(derived, N_CHANNELS):
+            self.add_plot(i, f"{channel['name']} ({channel['units']})" if channel.get('units') else channel['name'])
+        self.channel_labels = labels
+        self.params.set_channel_labels(labels)
 
     def set_graph_update_time(self, interval_sec: SimpleParameter):
         # Set timer interval in ms
@@ -118,60 +287,251 @@ class Application(QtWidgets.QWidget):
         print(f'update rate set to {interval_sec.value()} sec')
 
     def start_data(self):
+        if len(self.devices) == 0:
+            print('Not connected')
+            return
+        if self.running:
+            return
         self.running = True
-        self.data.clear()  # Reset data arrays
-        self.start_serial_worker()
+        self.start_button.setEnabled(False)
+        recording = self.params.record_param.value()
+        # Only create the directory when something will be written to it
+        capture_dir = RECORDINGS_DIR if self.devices.triggers else None
+        if recording or capture_dir is not None:
+            os.makedirs(RECORDINGS_DIR, exist_ok=True)
+        if recording:
+            self.recording_filenames = self.devices.start(RECORDINGS_DIR, capture_dir=capture_dir,
+                                                          archive=ARCHIVE_RECORDINGS)
+            print(f'Recording to {", ".join(self.recording_filenames.values())}')
+        else:
+            self.recording_filenames = {}
+            self.devices.start(capture_dir=capture_dir)
+        # Every board now has a fresh store; show the selected one
+        if self.board is not None:
+            self.select_board(self.board.name)
         self.update_graph_timer.start()
 
     def stop_data(self):
         self.running = False
+        self.start_button.setEnabled(True)
         self.update_graph_timer.stop()
-        self.stop_serial_worker()
+        self.devices.stop()
+
+    def board_connected(self, board):
+        board.listeners.append(self.board_data_received)
+        self.params.set_compare_limits(self.available_addresses())
+
+    def board_disconnecting(self, name):
+        if self.running and len(self.devices) == 1:
+            self.stop_data()
+        if self.board is not None and self.board.name == name:
+            self.board = None
+        self.params.set_compare_limits([address for address in self.available_addresses()
+                                        if address.rpartition(':')[0] != name])
+
+    def select_board(self, name):
+        """ Plot the named board and send valve commands to it. """
+        if name not in self.devices.boards:
+            return
+        self.board = self.devices[name]
+        self.set_channels(self.board.channels)
+        self.data, self.data_pyramid, self.data_lock = self.board.data, self.board.pyramid, self.board.lock
+        self.review_stats = None
+        self.reset_autoscale()
+        self.recording_filename = self.recording_filenames.get(name)
+        self.view_changed = True
+
+    def board_data_received(self, board, block):
+        # Called on the board's thread: only flag that the next plot update has work to do
+        if board is self.board or board.name in self.compare_boards:
+            self.new_data_available = True
 
     def save_data(self):
+        if self.exporter is not None:
+            print('Already saving data')
+            return
         timestamp = time.strftime("%Y%m%d-%H%M%S")
         filename = f"{os.path.dirname(os.path.realpath(__file__))}/data_{timestamp}.csv"
-        filename = QFileDialog.getSaveFileName(self, "Save data", filename, "Comma-separated values (*.csv)")[0]
+        filename, selected = QFileDialog.getSaveFileName(self, "Save data", filename, ';;'.join(export.FORMATS.values()))
         if filename == '':
             print('Data not saved')
             return
-        self.data.save_to_file(filename)
-
-    @QtCore.pyqtSlot(DataPoint)
-    def new_data_received(self, datum):
-        # print('*', end='')
-        self.data.add_point(datum)
-        # self.update_plots()
-        self.new_data_available = True
-
-    def start_serial_worker(self):
-        self.serial_worker = SerialWorker(self.serial_connection, data_rx_slot=self.new_data_received, valve_rx_slot=self.params.set_valve_states)
-        self.serial_worker.moveToThread(self.serial_worker_thread)
-        self.serial_worker_thread.start()
-
-        # Start receiving data
-        self.start_serial_sig.connect(self.serial_worker.start_work)
-        self.start_serial_sig.emit()
-
-    def stop_serial_worker(self):
-        if self.serial_worker is None:
-            print('serial worker isn\'t started yet dummy')
+        if not os.path.splitext(filename)[1]:
+            filename += next(ext for ext, name in export.FORMATS.items() if name == selected)
+
+        chunks, n_rows = self.export_source()
+        self.exporter = export.Export(filename, chunks, n_rows)
+        self.export_progress = QtWidgets.QProgressDialog(f"Saving {os.path.basename(filename)}", "Cancel", 0, 1000, self)
+        self.export_progress.setWindowTitle("Save data")
+        self.export_progress.canceled.connect(self.exporter.cancel)
+        self.export_timer.start()
+
+    def export_source(self):
+        """ (chunks of records, number of records) to save: a snapshot, so acquisition carries on
+        while it is written. Always timestamps and pressures only, whatever the source: the live
+        store keeps no valve history, so valve states are only exported from recordings themselves
+        (recording.py / archive.py export_csv). """
+        if self.recording_filename is not None and self.recording_filename.endswith(archive.ARCHIVE_EXTENSION):
+            reader = archive.ArchiveReader(self.recording_filename)
+            return export.without_valves(archive.record_chunks(reader)), len(reader)
+        if self.recording_filename is not None:
+            # The on-disk recording has the whole session (the live store may be a ring); the
+            # records written so far are mapped and don't change
+            header, records = open_records(self.recording_filename)
+            return export.without_valves(export.record_chunks(records)), len(records)
+        with self.data_lock:
+            timestamps, values = self.data.snapshot()
+        return export.array_chunks(timestamps, values), len(timestamps)
+
+    def update_export(self):
+        if not self.exporter.finished.is_set():
+            # Shows itself once the export has taken a while (QProgressDialog.minimumDuration)
+            self.export_progress.setValue(int(self.exporter.fraction * 1000))
             return
-        self.serial_worker.stop_work()
-        print('stopping serial worker')
-
-        if self.serial_worker is not None:
-            self.serial_worker.deleteLater()
-            self.serial_worker = None
-
-        self.serial_worker_thread.exit()
+        self.export_timer.stop()
+        self.export_progress.reset()
+        if self.exporter.error is not None:
+            QtWidgets.QMessageBox.critical(self, "Save failed", f"{self.exporter.filename}: {self.exporter.error}")
+        self.exporter = self.export_progress = None
+
+    def open_recording(self):
+        """ Load a recording for offline review; samples stay memory-mapped on disk (archives are
+        decompressed into memory). """
+        filename = QFileDialog.getOpenFileName(self, "Open recording", RECORDINGS_DIR,
+                                               f"Pressure recordings (*{RECORDING_EXTENSION} *{archive.ARCHIVE_EXTENSION})")[0]
+        if filename == '':
+            return
+        if self.running:
+            self.stop_data()
+
+        reader = archive.open_reader(filename)
+        self.set_channels(reader.header['channels'])
+        self.data = reader.to_data_series()
+        self.data_lock = threading.Lock()
+        # One pass over the recording; an unbounded window makes the window statistics the session's
+        self.review_stats = RunningStats(self.data.n_channels, window_sec=np.inf)
+        self.review_stats.update_from(self.data.timestamps, self.data.values)
+        self.reset_autoscale()
+
+        # Reuse the saved level-of-detail index if there is one, otherwise build and keep it
+        lod_dir = filename + LOD_SUFFIX
+        self.data_pyramid = MinMaxPyramid.load(lod_dir, self.data)
+        if self.data_pyramid is None:
+            self.data_pyramid = MinMaxPyramid(self.data)
+            self.data_pyramid.update()
+            self.data_pyramid.save(lod_dir)
+        self.recording_filename = filename
+        print(f'Opened {filename} ({len(reader)} samples)')
+
+        self.plot_item(0).getViewBox().enableAutoRange(x=True)
+        self.view_changed = True
+        self.update_plots()
+
+    def plot_view_changed(self):
+        self.view_changed = True
+
+    def reset_autoscale(self):
+        self.y_ranges = {}
+        self.view_changed = True
+
+    def channel_stats(self):
+        """ Moments of what is plotted (the selected board while live, else the opened recording), over
+        the window or the whole session as chosen in the statistics panel; None if there's nothing. """
+        stats = self.review_stats
+        if stats is None and self.board is not None:
+            stats = self.board.channel_stats
+        if stats is None:
+            return None
+        return stats.session if self.params.stats_over_param.value() == STATS_SESSION else stats.window
+
+    def update_stats_table(self):
+        moments = self.channel_stats()
+        if moments is None or not moments.n:
+            self.params.stats_table.setValue('No data')
+            return
+        rate = moments.sample_rate
+        header = f"{moments.n:,} samples" + ('' if rate is None else f", {rate:,.1f} S/s")
+        self.params.stats_table.setValue('\n'.join([header] + format_table(moments, self.channel_labels)))
+
+    def autoscale(self):
+        """ Fit each visible plot's Y axis to its channel's min and max: O(channels), with no pass
+        over the data. """
+        moments = self.channel_stats()
+        if moments is None or not moments.n:
+            return
+        for i in self.visible_channels:
+            low, high = float(moments.min[i]), float(moments.max[i])
+            if not np.isfinite(low) or not np.isfinite(high) or self.y_ranges.get(i) == (low, high):
+                continue
+            self.y_ranges[i] = (low, high)
+            if high == low:
+                low, high = low - 1, high + 1
+            self.graphs[i].setYRange(low, high, padding=AUTOSCALE_PADDING)
+
+    def set_overlay_visible(self, visible):
+        self.overlay.setVisible(visible)
+        if visible:
+            self.update_overlay()
+            self.overlay_timer.start()
+        else:
+            self.overlay_timer.stop()
+
+    def update_overlay(self):
+        """ Every source's metrics since the previous refresh. """
+        lines = []
+        for name, metrics in {'plots': self.metrics, **self.devices.metrics()}.items():
+            snapshot = metrics.snapshot()
+            lines.append(name)
+            lines += ['  ' + line for line in format_summary(summarize(snapshot, self.metrics_previous.get(name)),
+                                                             metrics.histograms)]
+            self.metrics_previous[name] = snapshot
+        self.overlay.setText('\n'.join(lines))
+        self.overlay.adjustSize()
+        self.overlay.raise_()
+
+    def closeEvent(self, event):
+        if self.exporter is not None:
+            self.exporter.cancel()
+            self.exporter.wait()
+        if self.running:
+            self.stop_data()
+        self.devices.close()
+        super().closeEvent(event)
 
     def update_plots(self):
-        if self.new_data_available:
-            for i in range(8):
-                self.plots[i].setData(x=self.data.timestamps, y=self.data.data[i])
+        start = time.perf_counter()
+        if (self.new_data_available or self.view_changed) and (self.visible_channels or self.compare_addresses):
+            # All plots share the same X range, so any visible one gives the window and pixel width
+            plot = self.graphs[min(self.visible_channels)] if self.visible_channels else self.compare_plot
+            view_box = plot.getViewBox()
+            if view_box.state['autoRange'][0]:
+                # Following the data: draw everything, the pyramid keeps it to ~2 points per pixel
+                t_start, t_end = -np.inf, np.inf
+            else:
+                t_start, t_end = view_box.viewRange()[0]
+            width = max(int(view_box.width()), 100)
+
+            with self.data_lock:
+                curves = [(i, *self.data_pyramid.query(i, t_start, t_end, width)) for i in self.visible_channels]
+                # Raw-level results are views into a store that keeps being appended to
+                curves = [(i, np.array(x), np.array(y)) for i, x, y in curves]
+                newest = self.data.timestamps[-1] if self.running and self.new_data_available and len(self.data) else None
+            for i, x, y in curves:
+                self.plots[i].setData(x=x, y=y)
+            if self.compare_addresses:
+                self.update_compare_plot(width)
+            if self.params.autoscale_param.value():
+                self.autoscale()
+            self.render_time.record(time.perf_counter() - start)
+            self.frames_drawn.add()
+            if newest is not None:
+                self.display_latency.record(now() - newest)
+
+        if self.board is not None:
+            self.params.set_valve_states(self.board.valve_states)
 
         self.new_data_available = False
+        self.view_changed = False
         if self.running:
             self.update_graph_timer.start()
 
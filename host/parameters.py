@@ -1,14 +1,15 @@
 import pyqtgraph.parametertree.parameterTypes as pTypes
+from pyqtgraph.Qt import QtGui, QtWidgets
 from pyqtgraph.parametertree import Parameter, ParameterTree
-import serial
 
-import serial_comms
-from serial_comms import create_tx_autoctl_packet, create_tx_set_packet
+import protocol
 
 # from monitor_GUI import Application
 
 PRESSURE_CHANNELS_NAME = 'Pressure Channels'
 INITIAL_UPDATE_RATE_HZ = 10
+STATS_WINDOW = 'Window'
+STATS_SESSION = 'Session'
 
 
 class FrequencyParameter(pTypes.GroupParameter):
@@ -31,6 +32,19 @@ class FrequencyParameter(pTypes.GroupParameter):
         self.freq.setValue(1.0 / self.t.value(), blockSignal=self.freq_changed)
 
 
+class StatsTableParameterItem(pTypes.TextParameterItem):
+    def makeWidget(self):
+        w = super().makeWidget()
+        w.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        w.setLineWrapMode(QtWidgets.QTextEdit.NoWrap)
+        return w
+
+
+class StatsTableParameter(pTypes.TextParameter):
+    """ Read-only text box in a fixed-width font, for a table of numbers. """
+    itemClass = StatsTableParameterItem
+
+
 class ChannelCtlParameter(pTypes.GroupParameter):
     def __init__(self, parent_app, channel=0, **opts):
         self.channel = channel
@@ -73,9 +87,13 @@ class ChannelCtlParameter(pTypes.GroupParameter):
             self.state_param.setWritable(True)
 
     def send_auto_cmd(self):
-        if self.parent_app.serial_connection is None:
+        board = self.parent_app.board
+        if board is None:
             print('Cannot set auto state while disconnected')
             return
+        if board.commands is None:
+            print(f'{board.name} is read-only (shared-memory bus), commands go to the process that owns it')
+            return
 
         auto_mode = self.auto_param.value()
         source_channel = self.source_channel_param.value()
@@ -84,22 +102,25 @@ class ChannelCtlParameter(pTypes.GroupParameter):
             source_channel = 0
             auto_mode = False
         open_above = self.above_below_param.value() == 'Above'
-        tx_packet = create_tx_autoctl_packet(self.channel, auto_mode, open_above,
-                                             source_channel, self.pressure_param.value(),
-                                             self.hyst_param.value())
         print(f'Setting auto state for channel {self.channel}')
-        self.parent_app.serial_connection.write(tx_packet)
+        # Queued: while a command for this channel is unacknowledged, only the newest setpoint is kept
+        board.commands.set_auto(self.channel, auto_mode, open_above, source_channel,
+                                self.pressure_param.value(), self.hyst_param.value())
 
     def send_manual_cmd(self):
-        if self.parent_app.serial_connection is None:
-            print('Cannot set auto state while disconnected')
+        board = self.parent_app.board
+        if board is None:
+            print('Cannot set valve state while disconnected')
             return
-        tx_packet = create_tx_set_packet(
+        if board.commands is None:
+            print(f'{board.name} is read-only (shared-memory bus), commands go to the process that owns it')
+            return
+        print(f'Setting valve channel {self.channel} state')
+        # Merged with other channels' pending changes into one VCMD frame
+        board.commands.set_valves(
             {self.channel:
-                 serial_comms.CHANNEL_SET if self.state_param.value() else serial_comms.CHANNEL_RESET
+                 protocol.CHANNEL_SET if self.state_param.value() else protocol.CHANNEL_RESET
              })
-        print(f'Setting valve channel {self.channel} state')
-        self.parent_app.serial_connection.write(tx_packet)
 
 # Valve control channel
 # [checkbox] Enabled # Disable input when in auto mode
@@ -134,8 +155,26 @@ class GuiParameters(pTypes.GroupParameter):
                 ]
              })
         self.addChild(self.update_rate_param)
-
-        self.addChild({'name': 'Device Controls', 'type': 'group', 'children': self.channel_ctls})
+        self.record_param = self.addChild({'name': 'Record to Disk', 'type': 'bool', 'value': True})
+        self.overlay_param = self.addChild({'name': 'Performance Overlay', 'type': 'bool', 'value': False})
+        self.overlay_param.sigValueChanged.connect(lambda param, value: parent.set_overlay_visible(value))
+        # Y ranges follow each channel's min/max from the statistics below, instead of scanning the plotted data
+        self.autoscale_param = self.addChild({'name': 'Autoscale Y', 'type': 'bool', 'value': True})
+        self.autoscale_param.sigValueChanged.connect(parent.reset_autoscale)
+
+        stats = self.addChild({'name': 'Channel Statistics', 'type': 'group', 'expanded': False})
+        self.stats_over_param = stats.addChild(
+            {'name': 'Over', 'type': 'list', 'limits': [STATS_WINDOW, STATS_SESSION], 'value': STATS_WINDOW})
+        self.stats_over_param.sigValueChanged.connect(parent.reset_autoscale)
+        self.stats_table = stats.addChild(StatsTableParameter(name='Table', value='', readonly=True))
+
+        # Channels of any connected boards, plotted together on a common time grid
+        compare = self.addChild({'name': 'Compare Boards', 'type': 'group', 'expanded': False})
+        self.compare_param = compare.addChild({'name': 'Channels', 'type': 'checklist', 'limits': []})
+        self.compare_param.sigValueChanged.connect(lambda param, value: parent.set_compare_addresses(value))
+
+        # Filled in by add_device_controls() once the window is up: 8 subtrees are slow to build
+        self.device_controls = self.addChild({'name': 'Device Controls', 'type': 'group'})
 
         self.graph_vis.sigValueChanged.connect(self.update_graph_visibility)
 
@@ -144,23 +183,48 @@ class GuiParameters(pTypes.GroupParameter):
         self.update_rate_param.t.sigValueChanged.connect(parent.set_graph_update_time)
 
         def button_pressed():
-            if parent.serial_connection is not None:
-                ser: serial.Serial = parent.serial_connection
-                try:
-                    ser.write(b'test123\n')
-                except Exception as e:
-                    print(e)
+            if getattr(parent.board, 'transport', None) is not None:
+                parent.board.transport.write(b'test123\n')
 
         test_button_param.sigActivated.connect(button_pressed)
 
+    def add_device_controls(self):
+        if not self.device_controls.children():
+            self.device_controls.addChildren(self.channel_ctls)
+
     def update_graph_visibility(self):
-        for i in range(self.parent.n_channels):  # Remove all graphs
+        for graph in self.parent.graphs + [self.parent.compare_plot]:  # Remove all graphs
+            if graph is None:
+                continue  # Never shown, not built yet
             try:
-                self.parent.graph_panel.removeItem(self.parent.graphs[i])
+                self.parent.graph_panel.removeItem(graph)
             except ValueError:
                 pass  # Item is already gone
-        for row, channel in enumerate(self.graph_vis.value()):  # Re-add graphs
-            self.parent.graph_panel.addItem(self.parent.graphs[int(channel)], row=row, col=0)
+        labels = self.parent.channel_labels
+        visible = [labels.index(label) for label in labels if label in self.graph_vis.value()]
+        for row, channel in enumerate(visible):  # Re-add graphs, building any shown for the first time
+            self.parent.graph_panel.addItem(self.parent.plot_item(channel), row=row, col=0)
+
+        if self.parent.compare_addresses:
+            self.parent.graph_panel.addItem(self.parent.compare_plot_item(), row=len(visible), col=0)
+
+        # Only visible channels get redrawn; bring newly shown ones up to date on the next tick
+        self.parent.visible_channels = set(visible)
+        self.parent.view_changed = True
+
+    def set_channel_labels(self, labels):
+        """ New set of plottable channels (derived channels come and go with the selected board);
+        raw channels keep their visibility, derived ones start out shown. """
+        checked = self.graph_vis.value()
+        self.graph_vis.setLimits(labels)
+        self.graph_vis.setValue([label for label in labels if label in checked or not label.isdigit()])
+        self.update_graph_visibility()
+
+    def set_compare_limits(self, addresses):
+        """ Addresses of the connected boards' channels; checked ones stay checked while their board is connected. """
+        checked = self.compare_param.value()
+        self.compare_param.setLimits(addresses)
+        self.compare_param.setValue([address for address in checked if address in addresses])
 
     def set_valve_states(self, states):
         for ctl, state in zip(self.channel_ctls, states):
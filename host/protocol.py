@@ -0,0 +1,95 @@
+import struct
+
+import numpy as np
+
+from stm32_crc import crc32_stm, crc32_stm_batch
+
+BAUDRATE = 115200
+MAGIC = b'PRZL'  # Expected magic bytes
+MAGIC_ACK = b'ACK!'
+
+RX_PACKET_SIZE = 4 + 8 * 4 + 4 + 4  # 4 bytes for magic, 8 floats, 4 bytes for valve states + packing, 4 bytes for CRC
+N_CHANNELS = 8
+# Below this many frames, checking CRCs one frame at a time beats the batch's fixed numpy overhead
+# (about 5 us per frame against 120 us per call; they cross at about 20 frames)
+BATCH_CRC_MIN_FRAMES = 16
+
+# Same layout as '<4s8fB3sI', so a buffer of back-to-back frames can be viewed as an array of packets
+RX_PACKET_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('pressures', '<f4', (N_CHANNELS,)),
+    ('valves', 'u1'),
+    ('pad', 'V3'),
+    ('crc', '<u4'),
+])
+assert RX_PACKET_DTYPE.itemsize == RX_PACKET_SIZE
+
+
+def calculate_crc(data):
+    return crc32_stm(data)
+
+
+# Set channel format:
+# '<' indicates little-endian byte order; all fields are packed tightly
+rx_valve_cmd_format = '<4s8B I'  # 4 bytes for magic, 8 bytes for state_changes, 4 bytes for crc
+rx_valve_cmd_magic = b'VCMD'
+
+# 4 bytes magic, 1 byte valve  channel, 1 byte enabled, 1 byte open_above, 1 byte source channel, 2 float pressure values, 1 uint32 crc
+rx_auto_valve_cmd_format = '<4s B B B B f f I'
+rx_auto_valve_cmd_magic = b'AUTO'
+
+rx_calibration_magic = b'CALB'
+
+CHANNEL_NOP = 0
+CHANNEL_SET = 1
+CHANNEL_RESET = 2
+CHANNEL_TOGGLE = 3
+
+
+# Pass a dict of {channel:action}, like {1: CHANNEL_SET, 2:CHANNEL_TOGGLE}
+def create_tx_set_packet(actions):
+    channel_actions = [CHANNEL_NOP] * 8
+    for channel in range(8):
+        if channel in actions:
+            channel_actions[channel] = actions[channel]
+
+    tx_struct = struct.pack(rx_valve_cmd_format, rx_valve_cmd_magic, *channel_actions, 0)
+    tx_struct = struct.pack(rx_valve_cmd_format, rx_valve_cmd_magic, *channel_actions, calculate_crc(tx_struct[:-4]))
+
+    return tx_struct
+
+
+def create_tx_autoctl_packet(channel, enabled, open_above, source_channel, pressure, pressure_hyst):
+    tx_struct = struct.pack(rx_auto_valve_cmd_format, rx_auto_valve_cmd_magic, int(channel), int(enabled), int(open_above), int(source_channel), float(pressure), float(pressure_hyst), 0)
+    tx_struct = struct.pack(rx_auto_valve_cmd_format, rx_auto_valve_cmd_magic, int(channel), int(enabled), int(open_above), int(source_channel), float(pressure), float(pressure_hyst), calculate_crc(tx_struct[:-4]))
+
+    return tx_struct
+
+
+def create_tx_calib_packet():
+    return rx_calibration_magic
+
+
+def decode_data_packets(buf):
+    """ Decode N back-to-back PRZL frames in one go.
+
+    Returns (pressures, valve_states, n_bad): an (M, 8) float32 array, an (M, 8) bool array with
+    valve i in column i, and the number of frames dropped for a bad CRC (M = N - n_bad).
+    The returned arrays are copies, so buf may be reused afterwards.
+    """
+    raw = np.frombuffer(buf, dtype=np.uint8).reshape(-1, RX_PACKET_SIZE)
+    packets = raw.view(RX_PACKET_DTYPE)[:, 0]
+
+    if len(raw) < BATCH_CRC_MIN_FRAMES:
+        crcs = np.array([crc32_stm(frame) for frame in raw[:, :-4]], dtype=np.uint32)
+    else:
+        crcs = crc32_stm_batch(raw[:, :-4])
+    crc_ok = crcs == packets['crc']
+    n_bad = len(crc_ok) - int(np.count_nonzero(crc_ok))
+    if n_bad:
+        packets = packets[crc_ok]
+
+    pressures = packets['pressures'].copy()
+    valve_states = np.unpackbits(packets['valves'][:, None], axis=1, bitorder='little').view(bool)
+    return pressures, valve_states, n_bad
+
@@ -0,0 +1,142 @@
+import time
+
+from data_series import SampleBlock
+from frame_parser import FrameParser
+from metrics import Metrics
+from protocol import MAGIC, MAGIC_ACK, RX_PACKET_SIZE, decode_data_packets
+from timestamping import SampleClock, now
+
+# Decoded samples are handed on in blocks rather than one callback per packet
+MAX_DELIVERY_LATENCY_SEC = 0.05
+MAX_BLOCK_SAMPLES = 1000
+# Resyncs and CRC failures are summarized at most this often rather than printed as they happen
+ERROR_REPORT_SEC = 5.0
+
+
+class FrameReceiver:
+    """ Turns the raw byte stream from a board into SampleBlocks. Has no Qt dependency.
+
+    Bytes can be pushed in with feed() (event-driven transports) or pulled with read_from() (a
+    blocking reader thread). Decoded samples are gathered into a pending list and passed to
+    on_block as one block once max_block_samples have been collected or the oldest pending sample
+    is max_latency seconds old. A delivered block is never touched again by the receiver (it starts
+    a fresh pending list), so the consumer can keep it without copying or locking.
+
+    Samples are timestamped by a SampleClock (see timestamping) from their position in the stream
+    and the time each read arrived; the arrival times travel along in block.arrival_times. If a
+    processor (see dsp.Pipeline) is given, each block goes through it on delivery, and the recorder
+    gets the processed block, derived channels included.
+
+    sample_listeners are called with every burst of raw samples as soon as it is decoded, before
+    it waits in the pending list; they are for consumers that must react to each sample quickly
+    (see control_loop) and run on whatever thread feeds the receiver.
+
+    Time spent decoding each read, waiting in the pending list and in the processor is recorded in
+    metrics (see metrics; all written from the feeding thread).
+    """
+
+    def __init__(self, on_block, on_ack=None, max_latency=MAX_DELIVERY_LATENCY_SEC,
+                 max_block_samples=MAX_BLOCK_SAMPLES, recorder=None, processor=None, metrics=None):
+        self.on_block = on_block
+        self.on_ack = on_ack
+        self.max_latency = max_latency
+        self.max_block_samples = max_block_samples
+        self.recorder = recorder
+        self.processor = processor
+        self.parser = FrameParser({MAGIC: RX_PACKET_SIZE, MAGIC_ACK: len(MAGIC_ACK)})
+        self.clock = SampleClock()
+        self.sample_listeners = []
+
+        self.pending = []
+        self.pending_samples = 0
+        self.pending_since = 0.0
+
+        self.packets_received = 0
+        self.packets_dropped = 0  # Failed CRC
+
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.reads = self.metrics.counter('reads')
+        self.decode_time = self.metrics.histogram('decode')  # Per read: parse, CRC, timestamps, sample listeners
+        self.queue_time = self.metrics.histogram('queue')  # Oldest pending sample's wait for delivery
+        self.processing_time = self.metrics.histogram('dsp')
+        self._reported = (0, 0)  # (bytes discarded, packets dropped) at the last error report
+        self._report_time = 0.0
+
+    def read_from(self, ser):
+        """ Read whatever is waiting on ser (blocking up to its timeout) and process it. """
+        self.parser.read_from(ser)
+        self._process(now())
+
+    def feed(self, data, rx_timestamp=None):
+        self.parser.feed(data)
+        self._process(now() if rx_timestamp is None else rx_timestamp)
+
+    def _process(self, rx_timestamp):
+        start = time.perf_counter()
+        self.reads.add()
+        discarded = self.parser.bytes_discarded
+        for magic, frames, count in self.parser.runs():
+            if magic == MAGIC:
+                self.handle_data_rx(frames, rx_timestamp)
+            elif magic == MAGIC_ACK:
+                for _ in range(count):
+                    if self.on_ack is not None:
+                        self.on_ack()
+        if self.parser.bytes_discarded != discarded:
+            # Best guess at how many samples the garbage replaced, to keep the sample count in step
+            self.clock.skip(round((self.parser.bytes_discarded - discarded) / RX_PACKET_SIZE))
+            self._report_errors()
+        self.decode_time.record(time.perf_counter() - start)
+
+        if self.pending_samples >= self.max_block_samples or self.time_to_flush() == 0:
+            self.flush()
+
+    def handle_data_rx(self, raw_data, rx_timestamp):
+        pressures, valve_states, n_bad = decode_data_packets(raw_data)
+        self.packets_received += len(pressures)
+        self.packets_dropped += n_bad
+        if n_bad:
+            self.clock.skip(n_bad)
+            self._report_errors()
+        if len(pressures) == 0:
+            return
+
+        timestamps, arrival_times = self.clock.stamp(len(pressures), rx_timestamp)
+        block = SampleBlock(timestamps, pressures, valve_states, arrival_times)
+        for listener in self.sample_listeners:
+            listener(block)
+        if not self.pending:
+            self.pending_since = time.monotonic()
+        self.pending.append(block)
+        self.pending_samples += len(pressures)
+
+    def _report_errors(self):
+        if time.monotonic() - self._report_time < ERROR_REPORT_SEC:
+            return
+        discarded, dropped = self.parser.bytes_discarded - self._reported[0], self.packets_dropped - self._reported[1]
+        print(f'Discarded {discarded} bytes out of sync, dropped {dropped} packets with bad CRC'
+              f'{"" if self._report_time == 0 else f" in the last {time.monotonic() - self._report_time:.0f} s"}')
+        self._reported = (self.parser.bytes_discarded, self.packets_dropped)
+        self._report_time = time.monotonic()
+
+    def time_to_flush(self):
+        """ Seconds until pending samples must be delivered, or None if nothing is pending. """
+        if not self.pending:
+            return None
+        return max(self.pending_since + self.max_latency - time.monotonic(), 0)
+
+    def flush(self):
+        """ Deliver everything pending as a single block. """
+        if not self.pending:
+            return
+        self.queue_time.record(time.monotonic() - self.pending_since)
+        block = SampleBlock.concatenate(self.pending)
+        self.pending = []
+        self.pending_samples = 0
+        if self.processor is not None:
+            start = time.perf_counter()
+            block = self.processor.process(block, self.clock)
+            self.processing_time.record(time.perf_counter() - start)
+        if self.recorder is not None:
+            self.recorder.write(block)
+        self.on_block(block)
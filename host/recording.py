@@ -0,0 +1,261 @@
+""" Binary session recordings.
+
+A recording is a fixed 4 KiB header (magic, JSON metadata) followed by fixed-size little-endian
+records of RECORD_DTYPE, widened to record_dtype(n) when a board stores derived channels (see dsp)
+after its raw ones; the header's n_channels and channels entries describe every column. Records
+are appended continuously while acquiring, so a crash loses at most the last unflushed chunk, and
+the file can be memory-mapped for analysis or converted to CSV.
+"""
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+import export
+from data_series import DataSeries
+from protocol import N_CHANNELS
+
+RECORDING_MAGIC = b'PRZLREC1'
+HEADER_SIZE = 4096
+RECORDING_EXTENSION = '.przl'
+
+
+def record_dtype(n_channels=N_CHANNELS):
+    return np.dtype([
+        ('timestamp', '<f8'),
+        ('pressures', '<f4', (n_channels,)),
+        ('valves', 'u1'),  # bit i = valve i
+    ])
+
+
+RECORD_DTYPE = record_dtype()
+
+CHUNK_RECORDS = 4096
+FSYNC_INTERVAL_SEC = 1.0
+MAX_QUEUED_BLOCKS = 1024
+
+_STOP = object()
+
+
+def default_channels(n_channels=N_CHANNELS):
+    return [{'name': f'P[{i}]', 'units': 'kPa'} for i in range(n_channels)]
+
+
+def unique_filename(filename):
+    """ filename, or with a -1, -2, ... suffix if it exists (timestamps in names only have 1 s resolution). """
+    stem, extension = os.path.splitext(filename)
+    n = 0
+    while os.path.exists(filename):
+        n += 1
+        filename = f'{stem}-{n}{extension}'
+    return filename
+
+
+def make_header(metadata=None, channels=None):
+    channels = channels or default_channels()
+    header = {
+        'version': 1,
+        'created': time.time(),
+        'record_dtype': record_dtype(len(channels)).descr,
+        'n_channels': len(channels),
+        'channels': channels,
+    }
+    header.update(metadata or {})
+    encoded = json.dumps(header).encode()
+    if len(RECORDING_MAGIC) + 4 + len(encoded) > HEADER_SIZE:
+        raise ValueError('recording metadata too large for header')
+    return (RECORDING_MAGIC + len(encoded).to_bytes(4, 'little') + encoded).ljust(HEADER_SIZE, b'\0')
+
+
+def read_header(f):
+    raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE or not raw.startswith(RECORDING_MAGIC):
+        raise ValueError('not a pressure recording')
+    length = int.from_bytes(raw[len(RECORDING_MAGIC):len(RECORDING_MAGIC) + 4], 'little')
+    start = len(RECORDING_MAGIC) + 4
+    return json.loads(raw[start:start + length])
+
+
+def open_records(filename):
+    """ (header, records) with records memory-mapped read-only. A trailing partial record (e.g. from
+    a crash mid-write) is ignored. """
+    with open(filename, 'rb') as f:
+        header = read_header(f)
+    dtype = record_dtype(header['n_channels'])
+    n_records = (os.path.getsize(filename) - HEADER_SIZE) // dtype.itemsize
+    if n_records == 0:
+        return header, np.empty(0, dtype=dtype)
+    return header, np.memmap(filename, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(n_records,))
+
+
+def block_to_records(block):
+    records = np.empty(len(block), dtype=record_dtype(block.pressures.shape[1]))
+    records['timestamp'] = block.timestamps
+    records['pressures'] = block.pressures
+    records['valves'] = np.packbits(block.valves, axis=1, bitorder='little')[:, 0]
+    return records
+
+
+class Recorder:
+    """ Appends SampleBlocks to a recording on a background thread.
+
+    write() never blocks the caller: blocks go through a bounded queue (dropped and counted if the
+    disk can't keep up) and are packed into a fixed-size chunk buffer, which is written out when
+    full. The file is flushed and fsync'd every fsync_interval seconds, so memory use is constant
+    no matter how long the session runs.
+    """
+
+    def __init__(self, filename, metadata=None, channels=None, chunk_records=CHUNK_RECORDS,
+                 fsync_interval=FSYNC_INTERVAL_SEC, max_queued_blocks=MAX_QUEUED_BLOCKS):
+        self.filename = filename
+        self.fsync_interval = fsync_interval
+        self.queue = queue.Queue(maxsize=max_queued_blocks)
+        self.chunk = np.empty(chunk_records, dtype=record_dtype(len(channels or default_channels())))
+        self.chunk_fill = 0
+
+        self.records_written = 0
+        self.blocks_dropped = 0
+
+        self.file = open(filename, 'wb')
+        self._write_header(metadata, channels)
+        self.thread = threading.Thread(target=self._run, name='recorder', daemon=True)
+        self.thread.start()
+
+    def write(self, block):
+        try:
+            self.queue.put_nowait(block)
+        except queue.Full:
+            self.blocks_dropped += 1
+
+    def _write_header(self, metadata, channels):
+        self.file.write(make_header(metadata, channels))
+
+    def close(self):
+        self.queue.put(_STOP)
+        self.thread.join()
+        print(f'Recorded {self.records_written} samples to {self.filename}')
+
+    def _run(self):
+        last_sync = time.monotonic()
+        while True:
+            try:
+                block = self.queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                block = None
+            if block is _STOP:
+                break
+            if block is not None:
+                self._append(block_to_records(block))
+            if time.monotonic() - last_sync >= self.fsync_interval:
+                self._sync()
+                last_sync = time.monotonic()
+        self._finish()
+
+    def _finish(self):
+        self._sync()
+        self.file.close()
+
+    def _append(self, records):
+        while len(records):
+            n = min(len(records), len(self.chunk) - self.chunk_fill)
+            self.chunk[self.chunk_fill:self.chunk_fill + n] = records[:n]
+            self.chunk_fill += n
+            records = records[n:]
+            if self.chunk_fill == len(self.chunk):
+                self._write_chunk()
+
+    def _write_chunk(self):
+        if self.chunk_fill:
+            self.file.write(self.chunk[:self.chunk_fill])
+            self.records_written += self.chunk_fill
+            self.chunk_fill = 0
+
+    def _sync(self):
+        self._write_chunk()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+
+class RecordingReader:
+    """ Read-only, memory-mapped view of a recording.
+
+    Exposes the same columnar accessors as DataSeries (timestamps, values, data, channel(), window())
+    as views into the file, so multi-GB sessions can be sliced and plotted without loading them.
+    Time ranges are located by binary search on the timestamp column.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.refresh()
+
+    def refresh(self):
+        """ Re-map the file to pick up records appended since it was opened (e.g. a live session). """
+        self.header, self.records = open_records(self.filename)
+        self.n_channels = self.header['n_channels']
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def timestamps(self):
+        return self.records['timestamp']
+
+    @property
+    def values(self):
+        return self.records['pressures']
+
+    @property
+    def data(self):
+        return self.values.T
+
+    @property
+    def valve_bits(self):
+        """ Raw valve byte per sample (bit i = valve i). """
+        return self.records['valves']
+
+    def channel(self, i):
+        return self.records['pressures'][:, i]
+
+    def valve(self, i, start=0, stop=None):
+        return (self.records['valves'][start:stop] >> i) & 1 == 1
+
+    def valves(self, start=0, stop=None):
+        """ (n, n_channels) bool valve states for records[start:stop]. """
+        bits = self.records['valves'][start:stop, None]
+        return np.unpackbits(bits, axis=1, bitorder='little').view(bool)
+
+    def index_range(self, t_start, t_end=None):
+        timestamps = self.timestamps
+        i0 = int(np.searchsorted(timestamps, t_start, side='left'))
+        i1 = len(timestamps) if t_end is None else int(np.searchsorted(timestamps, t_end, side='left'))
+        return i0, i1
+
+    def window(self, t_start, t_end=None):
+        i0, i1 = self.index_range(t_start, t_end)
+        return self.timestamps[i0:i1], self.values[i0:i1]
+
+    def time_slice(self, t_start, t_end=None):
+        """ DataSeries view of the samples with t_start <= t < t_end. """
+        i0, i1 = self.index_range(t_start, t_end)
+        return DataSeries.from_arrays(self.timestamps[i0:i1], self.values[i0:i1])
+
+    def to_data_series(self):
+        return DataSeries.from_arrays(self.timestamps, self.values)
+
+
+def export_csv(filename, csv_filename, chunk_records=export.CHUNK_ROWS):
+    """ Convert a recording to CSV (timestamp, pressures..., valve bits) a chunk at a time. """
+    header, records = open_records(filename)
+    export.write_csv(csv_filename, export.record_chunks(records, chunk_records))
+    print(f'Exported {len(records)} samples to {csv_filename}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(f'usage: python {sys.argv[0]} <recording{RECORDING_EXTENSION}> <output.csv>')
+        sys.exit(1)
+    export_csv(sys.argv[1], sys.argv[2])
@@ -0,0 +1,185 @@
+""" Streaming per-channel statistics, updated a block at a time.
+
+Each block of samples is summarized once (count, mean, sum of squared deviations M2, min, max,
+and the time moments for a least-squares slope), and summaries are merged with the pairwise form
+of Welford's algorithm (Chan et al.), which is exact and numerically stable. The whole-session
+summary is one merge per block. The sliding window keeps its blocks in two stacks (the standard
+two-stack sliding aggregation): the newer stack carries a running summary, the older one suffix
+summaries rebuilt only when it runs empty, so adding and evicting a block are O(1) amortized
+merges. Cost per sample is therefore constant, whatever the session length or window size.
+
+The window holds whole blocks: those whose newest sample is within window_sec of the newest
+sample overall.
+"""
+import collections
+
+import numpy as np
+
+WINDOW_SEC = 10.0
+CHUNK_SAMPLES = 1 << 16  # Bounds the temporaries when summarizing a long recording
+
+
+class Moments:
+    """ Summary statistics of some samples, per channel. Immutable: combine() returns a new one.
+
+    n counts samples (rows); a NaN value is left out of its own channel's statistics only, so each
+    channel keeps its own count and time moments. """
+
+    __slots__ = ('n', 'count', 'mean', 'm2', 'min', 'max', 't_first', 't_last', 't_mean', 't_m2', 'c_tx')
+
+    def __init__(self, n, count, mean, m2, minimum, maximum, t_first, t_last, t_mean, t_m2, c_tx):
+        self.n = n
+        self.count = count  # (n_channels,) non-NaN samples per channel
+        self.mean = mean  # (n_channels,) float64
+        self.m2 = m2  # Sum of squared deviations from the mean
+        self.min = minimum
+        self.max = maximum
+        self.t_first = t_first
+        self.t_last = t_last
+        self.t_mean = t_mean  # Per channel, over that channel's samples
+        self.t_m2 = t_m2
+        self.c_tx = c_tx  # Sum of (t - t_mean) * (x - mean), for the slope
+
+    @classmethod
+    def empty(cls, n_channels):
+        zeros = np.zeros(n_channels)
+        return cls(0, zeros, zeros, zeros, np.full(n_channels, np.inf), np.full(n_channels, -np.inf),
+                   np.inf, -np.inf, zeros, zeros, zeros)
+
+    @classmethod
+    def of_block(cls, timestamps, values):
+        """ Summary of (n,) timestamps and (n, n_channels) values (n > 0). """
+        x = np.asarray(values, dtype=np.float64)
+        t = np.asarray(timestamps, dtype=np.float64)
+        missing = np.isnan(x)
+        if not missing.any():
+            mean = x.mean(axis=0)
+            dx = x - mean
+            t_mean = t.mean()
+            dt = t - t_mean
+            n_channels = x.shape[1]
+            return cls(len(t), np.full(n_channels, float(len(t))), mean, np.einsum('ij,ij->j', dx, dx),
+                       x.min(axis=0), x.max(axis=0), t[0], t[-1], np.full(n_channels, t_mean),
+                       np.full(n_channels, float(dt @ dt)), dt @ dx)
+
+        valid = ~missing
+        count = valid.sum(axis=0).astype(np.float64)
+        has = count > 0
+        mean = np.divide(np.where(valid, x, 0).sum(axis=0), count, out=np.zeros(len(count)), where=has)
+        dx = np.where(valid, x - mean, 0)
+        t_mean = np.divide(valid.T @ t, count, out=np.zeros(len(count)), where=has)
+        dt = np.where(valid, t[:, None] - t_mean, 0)
+        return cls(len(t), count, mean, np.einsum('ij,ij->j', dx, dx),
+                   np.where(valid, x, np.inf).min(axis=0), np.where(valid, x, -np.inf).max(axis=0),
+                   t[0], t[-1], t_mean, np.einsum('ij,ij->j', dt, dt), np.einsum('ij,ij->j', dt, dx))
+
+    def combine(self, other):
+        """ Summary of the samples of both. """
+        if not other.n:
+            return self
+        if not self.n:
+            return other
+        count = self.count + other.count
+        if count.all():
+            share = other.count / count
+        else:  # Channels with no samples in either yet
+            share = np.divide(other.count, count, out=np.zeros(len(count)), where=count > 0)
+        weight = self.count * share
+        dx = other.mean - self.mean
+        dt = other.t_mean - self.t_mean
+        return Moments(self.n + other.n, count, self.mean + dx * share, self.m2 + other.m2 + dx * dx * weight,
+                       np.minimum(self.min, other.min), np.maximum(self.max, other.max),
+                       min(self.t_first, other.t_first), max(self.t_last, other.t_last),
+                       self.t_mean + dt * share, self.t_m2 + other.t_m2 + dt * dt * weight,
+                       self.c_tx + other.c_tx + dt * dx * weight)
+
+    @property
+    def std(self):
+        """ Sample standard deviation (zero until a channel has two samples). """
+        return np.sqrt(np.divide(self.m2, self.count - 1, out=np.zeros_like(self.m2), where=self.count > 1))
+
+    @property
+    def peak_to_peak(self):
+        return self.max - self.min
+
+    @property
+    def slope(self):
+        """ Least-squares rate of change, in units per second. """
+        return np.divide(self.c_tx, self.t_m2, out=np.zeros_like(self.c_tx), where=self.t_m2 > 0)
+
+    @property
+    def sample_rate(self):
+        span = self.t_last - self.t_first
+        return (self.n - 1) / span if self.n > 1 and span > 0 else None
+
+
+class RunningStats:
+    """ Whole-session and sliding-window Moments of a stream of blocks.
+
+    update() runs on the thread that receives the blocks. The summaries it keeps are replaced, never
+    modified, so other threads can read session and window without a lock.
+    """
+
+    def __init__(self, n_channels, window_sec=WINDOW_SEC):
+        self.n_channels = n_channels
+        self.window_sec = window_sec
+        self.reset()
+
+    def reset(self):
+        self._empty = Moments.empty(self.n_channels)
+        self.session = self._empty
+        self._window_parts = (self._empty, self._empty)  # Older stack's total, newer stack's total
+        self._newer = collections.deque()  # Blocks, oldest first
+        self._newer_total = self._empty
+        self._older = []  # (block, summary of it and every newer block in this stack); oldest last
+
+    def update(self, timestamps, values):
+        if not len(timestamps):
+            return
+        block = Moments.of_block(timestamps, values)
+        self.session = self.session.combine(block)
+        self._newer.append(block)
+        self._newer_total = self._newer_total.combine(block)
+
+        # Evict blocks that ended before the window
+        t_start = block.t_last - self.window_sec
+        while True:
+            if not self._older:
+                if len(self._newer) <= 1:
+                    break
+                # Flip: rebuild the suffix summaries, newest first
+                total = self._empty
+                while self._newer:
+                    newest = self._newer.pop()
+                    total = newest.combine(total)
+                    self._older.append((newest, total))
+                self._newer_total = self._empty
+            if self._older[-1][0].t_last >= t_start:
+                break
+            self._older.pop()
+        self._window_parts = (self._older[-1][1] if self._older else self._empty, self._newer_total)
+
+    @property
+    def window(self):
+        """ Moments of the blocks in the window, merged when read rather than on every block. """
+        older, newer = self._window_parts
+        return older.combine(newer)
+
+    def update_from(self, timestamps, values, chunk=CHUNK_SAMPLES):
+        """ Feed a long series (e.g. an opened recording) a chunk at a time. """
+        for i in range(0, len(timestamps), chunk):
+            self.update(timestamps[i:i + chunk], values[i:i + chunk])
+
+
+def format_table(moments, labels):
+    """ Lines of text for the statistics panel: one row per column of the store. """
+    lines = [f"{'':<6}{'mean':>11}{'std':>10}{'min':>11}{'max':>11}{'p-p':>10}{'rate/s':>10}"]
+    if not moments.n:
+        return lines
+    for i, label in enumerate(labels):
+        if not moments.count[i]:
+            lines.append(f'{label[:6]:<6}{"-":>11}')  # Only NaN so far, e.g. a filter not yet designed
+            continue
+        lines.append(f'{label[:6]:<6}{moments.mean[i]:11.4g}{moments.std[i]:10.3g}{moments.min[i]:11.4g}'
+                     f'{moments.max[i]:11.4g}{moments.peak_to_peak[i]:10.3g}{moments.slope[i]:+10.2g}')
+    return lines
@@ -1,13 +1,24 @@
 import sys
+import threading
 from PyQt5 import QtWidgets, QtCore, QtGui
 
 import serial
-import serial.tools.list_ports
+
+from data_source import list_data_sources
 
 # from monitor_GUI import Application
 
+STATUS_UPDATE_MS = 1000
+
 
 class SerialConnectionWidget(QtWidgets.QWidget):
+    # (board name, error), emitted from the board's event loop thread when its port fails
+    connection_lost = QtCore.pyqtSignal(str, str)
+    # A board's controller or listener failed; the board keeps running
+    board_warning = QtCore.pyqtSignal(str, str)
+    # Data source names, emitted from the thread that enumerates them
+    ports_listed = QtCore.pyqtSignal(list)
+
     def __init__(self, parent):
         super().__init__()
         self.parent = parent
@@ -15,7 +26,6 @@ class SerialConnectionWidget(QtWidgets.QWidget):
         # Initialize layout and components
         self.setLayout(QtWidgets.QVBoxLayout())
 
-        # TODO Connection status text
         self.label = QtWidgets.QLabel()
         self.label.setAlignment(QtCore.Qt.AlignCenter)
         font = QtGui.QFont()
@@ -40,54 +50,139 @@ class SerialConnectionWidget(QtWidgets.QWidget):
         self.refresh_button = QtWidgets.QPushButton("Refresh")
         control_hbox.addWidget(self.refresh_button)
 
-        # Create connect/disconnect button
+        # Create connect button; every connection adds another board
         self.connect_button = QtWidgets.QPushButton("Connect")
         control_hbox.addWidget(self.connect_button)
 
-        # Initial state
-        self.parent.serial_connection = None
-        self.refresh_ports()
+        # Connected boards: the selected one is plotted and receives valve commands
+        board_hbox = QtWidgets.QHBoxLayout()
+        board_frame = QtWidgets.QFrame()
+        board_frame.setLayout(board_hbox)
+        self.layout().addWidget(board_frame)
+
+        self.board_dropdown = QtWidgets.QComboBox()
+        board_hbox.addWidget(self.board_dropdown)
+        self.disconnect_button = QtWidgets.QPushButton("Disconnect")
+        board_hbox.addWidget(self.disconnect_button)
+
+        # Per-board throughput and error counters
+        self.stats_label = QtWidgets.QLabel()
+        self.stats_label.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.layout().addWidget(self.stats_label)
 
         # Connect signals to actions
         self.refresh_button.clicked.connect(self.refresh_ports)
-        self.connect_button.clicked.connect(self.toggle_connection)
+        self.connect_button.clicked.connect(self.connect_board)
+        self.disconnect_button.clicked.connect(lambda: self.disconnect_board())
+        self.board_dropdown.currentTextChanged.connect(self.parent.select_board)
+        self.connection_lost.connect(self.handle_connection_lost)
+        self.board_warning.connect(self.handle_board_warning)
+        self.ports_listed.connect(self.show_ports)
+        self.refresh_ports()
+
+        self.status_timer = QtCore.QTimer(self)
+        self.status_timer.setInterval(STATUS_UPDATE_MS)
+        self.status_timer.timeout.connect(self.update_stats)
 
     def _not_connected(self):
         self.label.setStyleSheet("color: red;")
         self.label.setText("Not connected")
+        self.stats_label.setText("")
 
     def _connected(self):
         self.label.setStyleSheet("color: green;")
-        self.label.setText("Connected")
+        n_boards = len(self.parent.devices)
+        self.label.setText("Connected" if n_boards == 1 else f"{n_boards} boards connected")
 
     def refresh_ports(self):
-        """ Refresh the list of available serial ports. """
+        """ Refresh the list of available serial ports. Enumerating ports can take a while (seconds,
+        on some systems), so it runs on a background thread and the list fills in when it's done. """
+        if not self.refresh_button.isEnabled():
+            return  # Already listing
+        self.refresh_button.setEnabled(False)
+        threading.Thread(target=self._list_ports, name='list-ports', daemon=True).start()
+
+    def _list_ports(self):
+        # Always answer, so show_ports re-enables the refresh button
+        try:
+            names = list_data_sources()
+        except Exception as e:
+            print(f"Listing serial ports failed: {e}")
+            names = []
+        self.ports_listed.emit(names)
+
+    @QtCore.pyqtSlot(list)
+    def show_ports(self, names):
+        current = self.port_dropdown.currentText()
         self.port_dropdown.clear()
-        ports = serial.tools.list_ports.comports()
-        for port in ports:
-            self.port_dropdown.addItem(port.device)
-
-    def toggle_connection(self):
-        """ Connect or disconnect to the selected serial device. """
-        if self.parent.serial_connection is None:
-            # Connect
-            port_name = self.port_dropdown.currentText()
-            if port_name:
-                try:
-                    self.parent.serial_connection = serial.Serial(port_name, baudrate=115200, timeout=1, write_timeout=1)
-                    self.connect_button.setText("Disconnect")
-                    print(f"Connected to {port_name}")
-
-                    # Update label
-                    self._connected()
-                except serial.SerialException as e:
-                    QtWidgets.QMessageBox.critical(self, "Connection Error", str(e))
-                    self._not_connected()
-
-        else:
-            # Disconnect
-            self.parent.serial_connection.close()
-            self.parent.serial_connection = None
-            self.connect_button.setText("Connect")
-            print("Disconnected")
+        for name in names:
+            self.port_dropdown.addItem(name)
+        if current in names:
+            self.port_dropdown.setCurrentText(current)
+        self.refresh_button.setEnabled(True)
+
+    def connect_board(self):
+        """ Connect to the selected serial device as an additional board. """
+        port_name = self.port_dropdown.currentText()
+        if not port_name:
+            return
+        # Port and bus errors are reported on the board's own thread; the signal queues them to the GUI
+        # thread. The handler is in place before the port starts, so an error on opening isn't lost
+        name = self.parent.devices.next_name()
+        on_error = lambda error, fatal: (self.connection_lost if fatal else self.board_warning).emit(name, error)
+        try:
+            board = self.parent.devices.add_board(port_name, name=name, on_error=on_error)
+        except (serial.SerialException, OSError, ValueError) as e:
+            QtWidgets.QMessageBox.critical(self, "Connection Error", str(e))
+            return
+
+        self.parent.board_connected(board)
+        print(f"Connected to {port_name} as {board.name}")
+
+        self.board_dropdown.addItem(board.name)
+        self.board_dropdown.setCurrentText(board.name)
+        self._connected()
+        self.update_stats()
+        self.status_timer.start()
+
+    def disconnect_board(self, name=None):
+        """ Disconnect the selected board (or the named one). """
+        name = name or self.board_dropdown.currentText()
+        if name not in self.parent.devices.boards:
+            return
+        self.parent.board_disconnecting(name)
+        self.parent.devices.remove_board(name)
+        self.board_dropdown.removeItem(self.board_dropdown.findText(name))
+        print(f"Disconnected {name}")
+
+        if len(self.parent.devices) == 0:
+            self.status_timer.stop()
             self._not_connected()
+        else:
+            self._connected()
+            self.update_stats()
+
+    def update_stats(self):
+        lines = []
+        for name, stats in self.parent.devices.stats().items():
+            rtt = '' if stats['cmd_rtt_ms'] is None else f"  RTT {stats['cmd_rtt_ms']:.1f} ms"
+            clock = '' if stats['jitter_ms'] is None else \
+                f"\n  clock {stats['rate_hz']:,.1f} Hz  jitter {stats['jitter_ms']:.2f} ms  burst {stats['burst_mean']:.1f}"
+            if stats.get('control_latency_ms_p50') is not None:
+                clock += f"\n  control {stats['control_latency_ms_p50']:.2f}/{stats['control_latency_ms_p99']:.2f} ms p50/p99"
+            lines.append(f"{name}: {stats['samples_per_sec']:,.0f} S/s  {stats['crc_dropped']} CRC  "
+                         f"{stats['bytes_discarded']} B lost{rtt}{clock}")
+        self.stats_label.setText('\n'.join(lines))
+
+    @QtCore.pyqtSlot(str, str)
+    def handle_board_warning(self, name, error):
+        # Not modal: acquisition carries on behind it
+        box = QtWidgets.QMessageBox(QtWidgets.QMessageBox.Warning, "Board Warning", f"{name}: {error}",
+                                    parent=self)
+        box.setModal(False)
+        box.show()
+
+    @QtCore.pyqtSlot(str, str)
+    def handle_connection_lost(self, name, error):
+        self.disconnect_board(name)
+        QtWidgets.QMessageBox.critical(self, "Connection Lost", f"{name}: {error}")
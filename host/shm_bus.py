@@ -0,0 +1,211 @@
+""" Shared-memory live data bus: decoded samples from one board, readable by any local process.
+
+The acquiring process writes each board's samples into a multiprocessing.shared_memory ring. The
+segment starts with a fixed header (magic, capacity, the total number of samples ever written and
+a JSON metadata area) followed by columns: float64 timestamps, float32 pressures (capacity x
+n_channels) and uint8 valve bits. Sample number seq lives at row seq % capacity. The writer fills
+rows first and only then advances `written`, so a reader that sees written == w can use every
+sample below w, unless the writer has lapped it (more than capacity samples ahead), which is
+detected and counted as lost samples.
+
+Readers attach by segment name and tail the ring with numpy views straight into the shared memory:
+no serial access, no pickling, and no copy unless a read wraps around the end of the ring.
+"""
+import json
+import os
+import sys
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from data_series import SampleBlock
+from protocol import N_CHANNELS
+
+SHM_MAGIC = b'PRZLSHM1'
+SHM_PREFIX = 'przl_'
+SHM_CAPACITY = 1 << 18  # Samples per board, ~2.6 s at 100 kHz
+HEADER_BYTES = 4096
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('capacity', '<u8'),
+    ('n_channels', '<u4'),
+    ('closed', '<u4'),
+    ('written', '<u8'),
+    ('writer_pid', '<u4'),
+    ('meta_len', '<u4'),
+])
+META_OFFSET = 64
+
+
+def bus_name(board_name, pid=None):
+    """ Segment name for a board published by process pid (default: this one). """
+    return f'{SHM_PREFIX}{os.getpid() if pid is None else pid}_{board_name}'
+
+
+def list_buses(include_own=False):
+    """ Names of live buses on this machine. Only implemented where segments show up in /dev/shm. """
+    if not os.path.isdir('/dev/shm'):
+        return []
+    names = []
+    for name in sorted(os.listdir('/dev/shm')):
+        if not name.startswith(SHM_PREFIX):
+            continue
+        try:
+            pid = int(name[len(SHM_PREFIX):].split('_', 1)[0])
+            os.kill(pid, 0)  # Skip segments left behind by processes that are gone
+        except (ValueError, ProcessLookupError):
+            continue
+        except PermissionError:
+            pass
+        if include_own or pid != os.getpid():
+            names.append(name)
+    return names
+
+
+def _layout(capacity, n_channels):
+    timestamps = HEADER_BYTES
+    pressures = timestamps + 8 * capacity
+    valves = pressures + 4 * capacity * n_channels
+    return timestamps, pressures, valves, valves + capacity
+
+
+def _map_columns(buf, capacity, n_channels):
+    t_off, p_off, v_off, _ = _layout(capacity, n_channels)
+    header = np.ndarray((), dtype=HEADER_DTYPE, buffer=buf)
+    timestamps = np.ndarray((capacity,), dtype='<f8', buffer=buf, offset=t_off)
+    pressures = np.ndarray((capacity, n_channels), dtype='<f4', buffer=buf, offset=p_off)
+    valves = np.ndarray((capacity,), dtype='u1', buffer=buf, offset=v_off)
+    return header, timestamps, pressures, valves
+
+
+def _attach(name):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    shm = shared_memory.SharedMemory(name)
+    header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+    if int(header['writer_pid']) != os.getpid():
+        # Before 3.13 every process that attaches registers the segment with its resource tracker,
+        # which would unlink it when a reader exits; only the writer should own it
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except (ImportError, AttributeError, KeyError):
+            pass
+    del header
+    return shm
+
+
+class SharedRingWriter:
+    """ Creates the ring for one board; publish() is a board listener (see device_manager.Board). """
+
+    def __init__(self, name, capacity=SHM_CAPACITY, n_channels=N_CHANNELS, metadata=None):
+        self.name = name
+        self.capacity = capacity
+        self.n_channels = n_channels
+        self.shm = shared_memory.SharedMemory(name, create=True, size=_layout(capacity, n_channels)[-1])
+        self.header, self.timestamps, self.pressures, self.valves = _map_columns(self.shm.buf, capacity, n_channels)
+
+        meta = json.dumps(dict(metadata or {}, n_channels=n_channels)).encode()
+        if META_OFFSET + len(meta) > HEADER_BYTES:
+            raise ValueError('bus metadata too large for header')
+        self.shm.buf[META_OFFSET:META_OFFSET + len(meta)] = meta
+        self.header['capacity'] = capacity
+        self.header['n_channels'] = n_channels
+        self.header['writer_pid'] = os.getpid()
+        self.header['meta_len'] = len(meta)
+        self.header['written'] = 0
+        self.header['magic'] = SHM_MAGIC  # Last: readers treat the segment as valid from here on
+
+    def write(self, timestamps, pressures, valve_bits):
+        """ Append n samples: timestamps (n,), pressures (n, n_channels), valve_bits (n,) packed. """
+        n = len(timestamps)
+        if n > self.capacity:
+            timestamps, pressures, valve_bits = timestamps[-self.capacity:], pressures[-self.capacity:], \
+                valve_bits[-self.capacity:]
+            skipped, n = n - self.capacity, self.capacity
+        else:
+            skipped = 0
+        written = int(self.header['written']) + skipped
+        start = written % self.capacity
+        first = min(n, self.capacity - start)
+        for column, values in ((self.timestamps, timestamps), (self.pressures, pressures), (self.valves, valve_bits)):
+            column[start:start + first] = values[:first]
+            column[:n - first] = values[first:]
+        self.header['written'] = written + n
+
+    def publish(self, board, block):
+        self.write(block.timestamps, block.pressures, np.packbits(block.valves, axis=1, bitorder='little')[:, 0])
+
+    def close(self):
+        self.header['closed'] = 1
+        del self.header, self.timestamps, self.pressures, self.valves
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedRingReader:
+    """ Attaches to a ring by name and tails it.
+
+    read() returns a SampleBlock of everything written since the previous call (from the moment of
+    attaching, or the oldest sample still in the ring if from_start). Its arrays are views into
+    shared memory, valid until the writer laps them, so copy anything kept for long.
+    """
+
+    def __init__(self, name, from_start=False):
+        self.name = name
+        self.shm = _attach(name)
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.shm.buf)
+        if header['magic'] != SHM_MAGIC:
+            self.shm.close()
+            raise ValueError(f'{name} is not a pressure data bus')
+        self.capacity = int(header['capacity'])
+        self.n_channels = int(header['n_channels'])
+        self.metadata = json.loads(bytes(self.shm.buf[META_OFFSET:META_OFFSET + int(header['meta_len'])]))
+        self.header, self.timestamps, self.pressures, self.valves = \
+            _map_columns(self.shm.buf, self.capacity, self.n_channels)
+
+        written = int(self.header['written'])
+        self.next_seq = max(written - self.capacity, 0) if from_start else written
+        self.samples_lost = 0
+
+    @property
+    def closed(self):
+        return bool(self.header['closed'])
+
+    def available(self):
+        return int(self.header['written']) - self.next_seq
+
+    def read(self, max_samples=None):
+        written = int(self.header['written'])
+        oldest = max(written - self.capacity, 0)
+        if self.next_seq < oldest:
+            self.samples_lost += oldest - self.next_seq
+            self.next_seq = oldest
+        end = written if max_samples is None else min(written, self.next_seq + max_samples)
+
+        start, stop = self.next_seq % self.capacity, (end - 1) % self.capacity + 1 if end > self.next_seq else 0
+        if end == self.next_seq:
+            columns = (self.timestamps[:0], self.pressures[:0], self.valves[:0])
+        elif start < stop:
+            columns = (self.timestamps[start:stop], self.pressures[start:stop], self.valves[start:stop])
+        else:
+            columns = tuple(np.concatenate((column[start:], column[:stop]))
+                            for column in (self.timestamps, self.pressures, self.valves))
+        # Anything the writer overwrote while we were reading is dropped
+        first_seq, self.next_seq = self.next_seq, end
+        lapped = min(int(self.header['written']) - self.capacity - first_seq, end - first_seq)
+        if lapped > 0:
+            self.samples_lost += lapped
+            columns = tuple(column[lapped:] for column in columns)
+
+        timestamps, pressures, valve_bits = columns
+        valves = np.unpackbits(valve_bits[:, None], axis=1, count=self.n_channels, bitorder='little').astype(bool)
+        return SampleBlock(timestamps, pressures, valves)
+
+    def close(self):
+        del self.header, self.timestamps, self.pressures, self.valves
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # Blocks returned by read() are still in use; the mapping goes when they do
@@ -0,0 +1,60 @@
+import struct
+
+import numpy as np
+
+# CRC-32 as computed by the STM32 CRC peripheral: polynomial 0x04C11DB7, init 0xFFFFFFFF,
+# no input/output reflection and no final XOR. The firmware feeds the peripheral __REV()'d
+# words, so the result is the same as running the CRC MSB-first over the raw byte stream.
+CRC_POLY = 0x04C11DB7
+CRC_INIT = 0xFFFFFFFF
+
+
+def _make_tables():
+    t0 = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC_POLY) if crc & 0x80000000 else (crc << 1)
+        t0.append(crc & 0xFFFFFFFF)
+
+    # Slicing-by-4 tables: tables[k][i] is the CRC contribution of byte i followed by k zero bytes
+    tables = [t0]
+    for _ in range(3):
+        prev = tables[-1]
+        tables.append([((c << 8) & 0xFFFFFFFF) ^ t0[c >> 24] for c in prev])
+    return tables
+
+
+CRC_TABLES = _make_tables()
+CRC_TABLES_NP = np.array(CRC_TABLES, dtype=np.uint32)
+
+
+def crc32_stm(data, crc=CRC_INIT):
+    """ CRC of a single packet. Whole words are processed 4 bytes at a time, any tail bytewise. """
+    t0, t1, t2, t3 = CRC_TABLES
+    n_words = len(data) // 4
+    for word in struct.unpack_from(f'>{n_words}I', data):
+        crc ^= word
+        crc = t3[crc >> 24] ^ t2[(crc >> 16) & 0xFF] ^ t1[(crc >> 8) & 0xFF] ^ t0[crc & 0xFF]
+    for byte in bytes(data[n_words * 4:]):
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ t0[(crc >> 24) ^ byte]
+    return crc
+
+
+def crc32_stm_batch(frames):
+    """ CRCs of N equal-length packets at once.
+
+    frames is anything that can be viewed as an (N, L) uint8 array with L a multiple of 4.
+    Returns an (N,) uint32 array.
+    """
+    frames = np.ascontiguousarray(frames, dtype=np.uint8)
+    if frames.ndim != 2 or frames.shape[1] % 4 != 0:
+        raise ValueError('frames must be an (N, L) array with L a multiple of 4')
+
+    words = frames.view('>u4').astype(np.uint32)
+    t0, t1, t2, t3 = CRC_TABLES_NP
+    crc = np.full(frames.shape[0], CRC_INIT, dtype=np.uint32)
+    for col in range(words.shape[1]):
+        crc ^= words[:, col]
+        crc = t3[crc >> 24] ^ t2[(crc >> 16) & 0xFF] ^ t1[(crc >> 8) & 0xFF] ^ t0[crc & 0xFF]
+    return crc
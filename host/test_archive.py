@@ -0,0 +1,64 @@
+import numpy as np
+
+import archive
+from data_series import SampleBlock
+
+RATE_HZ = 1000.0
+
+
+def write_archive(filename, seconds=12.0, chunk_sec=1.0):
+    """ An archive of seconds of noisy samples, written a block at a time; returns the records. """
+    rng = np.random.default_rng(0)
+    n = int(seconds * RATE_HZ)
+    timestamps = 1000.0 + np.arange(n) / RATE_HZ
+    pressures = np.cumsum(rng.normal(size=(n, 8)), axis=0).astype(np.float32)
+    valves = rng.random((n, 8)) < 0.05
+    writer = archive.ArchiveWriter(filename, chunk_sec=chunk_sec)
+    for i in range(0, n, 250):
+        writer.write(SampleBlock(timestamps[i:i + 250], pressures[i:i + 250], valves[i:i + 250]))
+    writer.close()
+    return timestamps, pressures, valves
+
+
+def test_round_trip_is_lossless(tmp_path):
+    filename = str(tmp_path / 'session.przz')
+    timestamps, pressures, valves = write_archive(filename)
+    reader = archive.ArchiveReader(filename)
+    records = reader.read()
+    assert len(reader) == len(timestamps)
+    assert np.array_equal(records['timestamp'], timestamps)
+    assert np.array_equal(records['pressures'], pressures)
+    assert np.array_equal(np.unpackbits(records['valves'][:, None], axis=1, bitorder='little').view(bool), valves)
+    reader.close()
+
+
+def test_read_decodes_only_overlapping_chunks(tmp_path):
+    filename = str(tmp_path / 'session.przz')
+    timestamps, pressures, _ = write_archive(filename)
+    reader = archive.ArchiveReader(filename)
+    assert len(reader.index) == 12
+    records = reader.read(1003.5, 1005.5)
+    assert reader.chunks_decoded == 3
+    inside = (timestamps >= 1003.5) & (timestamps < 1005.5)
+    assert np.array_equal(records['timestamp'], timestamps[inside])
+    assert np.array_equal(records['pressures'], pressures[inside])
+    reader.close()
+
+
+def test_truncated_archive_is_recovered(tmp_path):
+    filename = str(tmp_path / 'session.przz')
+    timestamps, pressures, _ = write_archive(filename)
+    reader = archive.ArchiveReader(filename)
+    complete = reader.index.copy()
+    reader.close()
+
+    # As if the process died while writing the last chunk: no index, and that chunk cut short
+    with open(filename, 'r+b') as f:
+        f.truncate(int(complete['offset'][-1]) + 20)
+    reader = archive.ArchiveReader(filename)
+    assert np.array_equal(reader.index, complete[:-1])
+    n = int(complete['n_records'][:-1].sum())
+    records = reader.read()
+    assert np.array_equal(records['timestamp'], timestamps[:n])
+    assert np.array_equal(records['pressures'], pressures[:n])
+    reader.close()
@@ -0,0 +1,77 @@
+from command_scheduler import CommandScheduler
+from protocol import CHANNEL_RESET, CHANNEL_SET, CHANNEL_TOGGLE, create_tx_autoctl_packet, create_tx_set_packet
+
+
+def scheduler(**kwargs):
+    sent = []
+    return CommandScheduler(sent.append, **kwargs), sent
+
+
+def test_acks_confirm_commands_in_order():
+    s, sent = scheduler()
+    s.set_valves({0: CHANNEL_SET})
+    s.set_auto(1, True, True, 1, 2.0, 0.1)
+    s.calibrate()
+    assert len(sent) == 3 and len(s.in_flight) == 3
+    for _ in range(3):
+        s.ack()
+    assert not s.in_flight and not s.unconfirmed
+    assert s.stats()['acked'] == 3 and len(s.rtts) == 3
+    s.ack()
+    assert s.unexpected_acks == 1
+
+
+def test_window_limits_commands_in_flight():
+    s, sent = scheduler(max_in_flight=2)
+    s.calibrate()
+    s.set_valves({0: CHANNEL_SET})
+    s.set_auto(1, True, True, 1, 2.0, 0.1)
+    assert len(sent) == 2
+    s.ack()
+    assert len(sent) == 3
+    assert sent[2] == create_tx_autoctl_packet(1, True, True, 1, 2.0, 0.1)
+
+
+def test_valve_changes_coalesce_while_in_flight():
+    s, sent = scheduler()
+    s.set_valves({0: CHANNEL_SET})
+    # Waits behind the first VCMD; later changes merge into it
+    s.set_valves({1: CHANNEL_SET})
+    s.set_valves({1: CHANNEL_TOGGLE, 2: CHANNEL_RESET})
+    assert len(sent) == 1 and s.commands_coalesced == 1
+    s.ack()
+    assert sent[1] == create_tx_set_packet({1: CHANNEL_RESET, 2: CHANNEL_RESET})
+
+
+def test_auto_setpoints_coalesce_per_channel():
+    s, sent = scheduler()
+    for pressure in (1.0, 2.0, 3.0):
+        s.set_auto(1, True, True, 1, pressure, 0.1)
+    s.set_auto(2, True, True, 2, 5.0, 0.1)
+    assert len(sent) == 2
+    s.ack()
+    assert sent[2] == create_tx_autoctl_packet(1, True, True, 1, 3.0, 0.1)
+    assert s.commands_coalesced == 1
+
+
+def test_unacknowledged_commands_resent_one_at_a_time():
+    s, sent = scheduler(ack_timeout=0)
+    s.set_valves({0: CHANNEL_SET})
+    s.calibrate()
+    s.ack()  # Taken for the VCMD; the CALB is still in flight
+    s.poll()
+    # Both are resent, since there's no telling which one was lost, starting with the oldest alone
+    assert sent[2:] == [create_tx_set_packet({0: CHANNEL_SET})]
+    assert s.retries == 1
+    s.ack()
+    assert sent[3] == b'CALB'
+    s.ack()
+    assert not s.in_flight and not s.recovering
+
+
+def test_commands_fail_after_max_retries():
+    s, sent = scheduler(ack_timeout=0, max_retries=2)
+    s.calibrate()
+    for _ in range(3):
+        s.poll()
+    assert len(sent) == 3 and s.commands_failed == 1 and not s.in_flight
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from control_loop import Controller
+from device_manager import DeviceManager
+
+
+class DividesByZero(Controller):
+    def on_sample(self, t, pressures, valves):
+        return {0: 1 // 0}
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_failing_controller_is_disabled_and_stream_continues():
+    errors = []
+    reported = threading.Event()
+
+    def on_error(error, fatal):
+        errors.append((error, fatal))
+        reported.set()
+
+    devices = DeviceManager(lod=False)
+    try:
+        board = devices.add_board('Emulator', on_error=on_error)
+        board.add_controller(DividesByZero())
+        devices.start()
+        assert reported.wait(5.0)
+        count = board.samples_received
+        assert wait_for(lambda: board.samples_received > count + 10)
+        assert board.control.failures == 1
+        assert board.control.controllers == []
+        assert board.stats()['control_failures'] == 1
+        assert errors == [(errors[0][0], False)] and 'ZeroDivisionError' in errors[0][0]
+    finally:
+        devices.close()
+
+
+def test_failing_listener_is_skipped_and_stream_continues():
+    errors = []
+    calls = []
+
+    def broken(board, block):
+        calls.append(len(block))
+        raise RuntimeError('broken listener')
+
+    devices = DeviceManager(lod=False)
+    try:
+        board = devices.add_board('Emulator', on_error=lambda error, fatal: errors.append(fatal))
+        board.listeners.append(broken)
+        devices.start()
+        assert wait_for(lambda: errors)
+        count = board.samples_received
+        assert wait_for(lambda: board.samples_received > count + 10)
+        assert calls == calls[:1] and errors == [False]
+        assert board.failed_listeners == [broken]
+    finally:
+        devices.close()
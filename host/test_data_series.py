@@ -0,0 +1,58 @@
+import numpy as np
+
+from data_series import DataSeries
+
+
+def samples(start, n, n_channels=3):
+    timestamps = np.arange(start, start + n, dtype=np.float64)
+    return timestamps, np.repeat(timestamps[:, None], n_channels, axis=1) + np.arange(n_channels)
+
+
+def test_growing_store_keeps_everything():
+    series = DataSeries(n_channels=3, capacity=4)
+    for start in range(0, 100, 7):
+        series.append(*samples(start, 7))
+    assert len(series) == series.n_appended == 105
+    assert np.array_equal(series.timestamps, np.arange(105))
+    assert np.array_equal(series.channel(2), np.arange(105) + 2)
+
+
+def test_ring_wraps_around_keeping_the_newest():
+    series = DataSeries(n_channels=3, max_samples=10)
+    appended = 0
+    for n in (4, 7, 1, 9, 3, 10, 2, 6):
+        series.append(*samples(appended, n))
+        appended += n
+        kept = min(appended, 10)
+        assert len(series) == kept and series.n_appended == appended
+        assert np.array_equal(series.timestamps, np.arange(appended - kept, appended))
+        assert np.array_equal(series.values[:, 1], np.arange(appended - kept, appended) + 1)
+
+
+def test_ring_append_larger_than_capacity():
+    series = DataSeries(n_channels=3, max_samples=10)
+    series.append(*samples(0, 5))
+    series.append(*samples(5, 25))
+    assert np.array_equal(series.timestamps, np.arange(20, 30))
+    assert series.n_appended == 30
+
+
+def test_window_and_last():
+    series = DataSeries(n_channels=3, max_samples=50)
+    series.append(*samples(0, 80))
+    timestamps, values = series.window(40, 45)
+    assert timestamps.tolist() == [40, 41, 42, 43, 44] and values[0, 0] == 40
+    assert series.last(3)[0].tolist() == [76, 77, 78, 79]
+    assert len(series.window(0, 30)[0]) == 0  # Already dropped from the ring
+
+
+def test_snapshot_unchanged_by_later_appends():
+    for max_samples in (None, 10):
+        series = DataSeries(n_channels=3, capacity=8, max_samples=max_samples)
+        series.append(*samples(0, 8))
+        timestamps, values = series.snapshot()
+        expected = (timestamps.copy(), values.copy())
+        series.append(*samples(8, 20))
+        series.clear()
+        series.append(*samples(100, 8))
+        assert np.array_equal(timestamps, expected[0]) and np.array_equal(values, expected[1])
@@ -0,0 +1,40 @@
+import os
+
+from device_manager import DeviceManager
+from test_control_loop import wait_for
+
+
+def test_restart_closes_recorder_and_keeps_earlier_recording(tmp_path):
+    devices = DeviceManager(lod=False)
+    try:
+        board = devices.add_board('Emulator')
+        first = devices.start(str(tmp_path))
+        recorder = board.recorder
+        # Started again within the same second: a new file, and the first recorder is finished
+        second = devices.start(str(tmp_path))
+        assert first['board0'] != second['board0']
+        assert not recorder.thread.is_alive()
+        assert board.recorder is not recorder
+        assert wait_for(lambda: board.samples_received > 100)
+        devices.stop()
+        assert not board.acquiring and board.recorder is None
+        assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(f) for f in (first['board0'], second['board0']))
+    finally:
+        devices.close()
+
+
+def test_restart_replaces_trigger_engines(tmp_path):
+    never = {'name': 'never', 'condition': {'type': 'level', 'channel': 0, 'threshold': 1e9}}
+    devices = DeviceManager(lod=False, triggers=[never])
+    try:
+        board = devices.add_board('Emulator')
+        devices.start(capture_dir=str(tmp_path))
+        first = devices.trigger_engines['board0']
+        devices.start(capture_dir=str(tmp_path))
+        second = devices.trigger_engines['board0']
+        assert second is not first and not first.thread.is_alive()
+        assert board.listeners == [second.process]
+        devices.stop()
+        assert board.listeners == [] and not second.thread.is_alive()
+    finally:
+        devices.close()
@@ -0,0 +1,54 @@
+import numpy as np
+
+import dsp
+from data_series import SampleBlock
+from device_emulator import DeviceEmulator
+from receiver import FrameReceiver
+
+
+class Clock:
+    def __init__(self, period=None):
+        self.period = period
+
+
+def block(n, rate_hz, t0=0.0):
+    timestamps = t0 + np.arange(n) / rate_hz
+    return SampleBlock(timestamps, np.ones((n, 8), np.float32), np.zeros((n, 8), bool))
+
+
+def lowpass():
+    return dsp.Pipeline.from_config([{'type': 'lowpass', 'name': 'lp', 'source': 0, 'cutoff_hz': 5},
+                                     {'type': 'lowpass', 'name': 'lp2', 'source': 'lp', 'cutoff_hz': 5}])
+
+
+def test_filters_output_nan_until_clock_converges():
+    pipeline = lowpass()
+    out = pipeline.process(block(100, 1000.0), Clock())
+    assert pipeline.rate_hz is None
+    assert np.isnan(out.pressures[:, 8:]).all()
+    out = pipeline.process(block(100, 1000.0, 0.1), Clock(1e-3))
+    assert pipeline.rate_hz == 1000.0
+    assert np.allclose(out.pressures[:, 8:], 1.0)
+
+
+def test_stages_redesigned_when_rate_moves():
+    pipeline = lowpass()
+    pipeline.process(block(100, 1000.0), Clock(1e-3))
+    b = pipeline.stages[0].b
+    pipeline.process(block(100, 1000.0), Clock(1 / 1005.0))  # Within tolerance
+    assert pipeline.rate_hz == 1000.0
+    pipeline.process(block(100, 1000.0), Clock(1 / 1100.0))
+    assert pipeline.rate_hz == 1100.0
+    assert not np.array_equal(pipeline.stages[0].b, b)
+
+
+def test_rate_follows_receiver_clock():
+    pipeline = lowpass()
+    receiver = FrameReceiver(lambda block: None, processor=pipeline)
+    emulator = DeviceEmulator(rate_hz=10000, seed=0)
+    # Bursts of 100 samples every 10 ms, with some arrival jitter
+    rng = np.random.default_rng(0)
+    for k in range(300):
+        receiver.feed(emulator.make_frames(100), rx_timestamp=1000 + k * 0.01 + rng.random() * 0.002)
+        receiver.flush()
+    assert abs(pipeline.rate_hz / 10000 - 1) < dsp.RATE_TOLERANCE
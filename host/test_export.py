@@ -0,0 +1,26 @@
+import numpy as np
+
+import export
+
+
+def test_csv_round_trips_float32(tmp_path):
+    rng = np.random.default_rng(0)
+    timestamps = 1.7e9 + np.arange(1000) / 1000.0
+    values = (rng.normal(size=(1000, 8)) * 10.0 ** rng.integers(-3, 4, (1000, 8))).astype(np.float32)
+    filename = str(tmp_path / 'data.csv')
+    assert export.write_csv(filename, export.array_chunks(timestamps, values, chunk_rows=300)) == 1000
+    rows = np.loadtxt(filename, delimiter=',')
+    assert np.array_equal(rows[:, 1:].astype(np.float32), values)
+    assert np.allclose(rows[:, 0], timestamps, rtol=0, atol=1e-6)
+
+
+def test_without_valves_matches_series_columns(tmp_path):
+    records = np.zeros(10, dtype=[('timestamp', '<f8'), ('pressures', '<f4', (8,)), ('valves', 'u1')])
+    records['timestamp'] = np.arange(10)
+    records['valves'] = 5
+    chunk, = export.without_valves(export.record_chunks(records))
+    assert chunk.dtype == export.series_dtype(8)
+    filename = str(tmp_path / 'data.npy')
+    export.write_npy(filename, export.without_valves(export.record_chunks(records, 4)), 10)
+    assert np.array_equal(np.load(filename)['timestamp'], records['timestamp'])
+    assert export.format_csv(chunk).splitlines()[0].count(',') == 8
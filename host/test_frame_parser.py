@@ -0,0 +1,79 @@
+import numpy as np
+
+from device_emulator import DeviceEmulator
+from frame_parser import FrameParser
+from protocol import MAGIC, MAGIC_ACK, RX_PACKET_SIZE
+from receiver import FrameReceiver
+
+ACK = MAGIC_ACK
+SIZES = {MAGIC: RX_PACKET_SIZE, MAGIC_ACK: len(MAGIC_ACK)}
+
+
+def data_frames(n, **kwargs):
+    """ n PRZL frames, with the frame number in channel 7. """
+    return DeviceEmulator(noise_kpa=0, sequence_channel=7, seed=0, **kwargs).make_frames(n)
+
+
+def parse(parser):
+    return [(magic, bytes(frame)) for magic, frame in parser.frames()]
+
+
+def test_frame_split_across_feeds():
+    frames = data_frames(3)
+    parser = FrameParser(SIZES)
+    parsed = []
+    for i in range(0, len(frames), 7):  # Splits every frame, and some magics, between feeds
+        parser.feed(frames[i:i + 7])
+        parsed += parse(parser)
+    assert parsed == [(MAGIC, frames[i:i + RX_PACKET_SIZE]) for i in range(0, len(frames), RX_PACKET_SIZE)]
+    assert parser.bytes_discarded == 0 and len(parser) == 0
+
+
+def test_resync_after_garbage():
+    frames = data_frames(2)
+    parser = FrameParser(SIZES)
+    # Garbage containing a partial magic, then frames; garbage between them too
+    parser.feed(b'\x00PRZ\xffxyz' + frames[:RX_PACKET_SIZE] + b'garbage!' + frames[RX_PACKET_SIZE:])
+    assert parse(parser) == [(MAGIC, frames[:RX_PACKET_SIZE]), (MAGIC, frames[RX_PACKET_SIZE:])]
+    assert parser.bytes_discarded == 8 + 8
+    assert parser.resyncs >= 2
+
+
+def test_partial_magic_at_end_is_kept():
+    frame = data_frames(1)
+    parser = FrameParser(SIZES)
+    parser.feed(b'junk' + frame[:2])
+    assert parse(parser) == []
+    parser.feed(frame[2:])
+    assert parse(parser) == [(MAGIC, frame)]
+    assert parser.bytes_discarded == 4
+
+
+def test_acks_between_data_frames():
+    frames = data_frames(4)
+    f = [frames[i:i + RX_PACKET_SIZE] for i in range(0, len(frames), RX_PACKET_SIZE)]
+    parser = FrameParser(SIZES)
+    parser.feed(f[0] + ACK + ACK + f[1] + f[2] + ACK + f[3])
+    assert [magic for magic, frame in parse(parser)] == [MAGIC, ACK, ACK, MAGIC, MAGIC, ACK, MAGIC]
+
+
+def test_runs_group_back_to_back_frames():
+    frames = data_frames(5)
+    parser = FrameParser(SIZES)
+    parser.feed(frames[:3 * RX_PACKET_SIZE] + ACK + ACK + frames[3 * RX_PACKET_SIZE:])
+    runs = [(magic, bytes(run), count) for magic, run, count in parser.runs()]
+    assert runs == [(MAGIC, frames[:3 * RX_PACKET_SIZE], 3), (ACK, ACK + ACK, 2),
+                    (MAGIC, frames[3 * RX_PACKET_SIZE:], 2)]
+
+
+def test_receiver_drops_bad_crc_and_keeps_the_rest():
+    blocks, acks = [], []
+    receiver = FrameReceiver(blocks.append, lambda: acks.append(1))
+    frames = bytearray(data_frames(6))
+    frames[2 * RX_PACKET_SIZE + 10] ^= 0xFF  # Corrupt frame 2's payload
+    receiver.feed(bytes(frames[:3 * RX_PACKET_SIZE]) + ACK + bytes(frames[3 * RX_PACKET_SIZE:]))
+    receiver.flush()
+    sequence = np.concatenate([block.pressures[:, 7] for block in blocks])
+    assert sequence.tolist() == [0, 1, 3, 4, 5]
+    assert receiver.packets_dropped == 1 and receiver.packets_received == 5
+    assert acks == [1]
@@ -0,0 +1,28 @@
+import metrics
+
+
+def test_percentiles_never_above_the_session_max():
+    m = metrics.Metrics()
+    histogram = m.histogram('render')
+    for seconds in (0.0011, 0.0012, 0.0013):
+        histogram.record(seconds)
+    summary = metrics.summarize(m.snapshot())
+    assert summary['render_count'] == 3
+    assert summary['render_p50_ms'] <= summary['render_p99_ms'] <= summary['render_session_max_ms'] == 1.3
+
+
+def test_interval_counts_and_rates():
+    m = metrics.Metrics()
+    frames = m.counter('frames')
+    histogram = m.histogram('render')
+    histogram.record(0.5)
+    frames.add(10)
+    before = m.snapshot()
+    histogram.record(0.001)
+    frames.add(5)
+    after = m.snapshot()
+    after['time'] = before['time'] + 2.0
+    summary = metrics.summarize(after, before)
+    assert summary['frames'] == 15 and summary['frames_per_sec'] == 2.5
+    assert summary['render_count'] == 1 and summary['render_p99_ms'] < 2
+    assert summary['render_session_max_ms'] == 500
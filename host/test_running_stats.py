@@ -0,0 +1,104 @@
+import numpy as np
+
+from running_stats import Moments, RunningStats
+
+
+def reference(timestamps, values):
+    """ (count, mean, std, min, max, slope) per column, from scratch, ignoring NaN. """
+    rows = []
+    for x in values.T.astype(np.float64):
+        keep = ~np.isnan(x)
+        t, x = timestamps[keep], x[keep]
+        rows.append((len(x), x.mean(), x.std(ddof=1), x.min(), x.max(), np.polyfit(t, x, 1)[0]))
+    return np.array(rows).T
+
+
+def check(moments, timestamps, values):
+    count, mean, std, low, high, slope = reference(timestamps, values)
+    assert np.array_equal(moments.count, count)
+    assert np.allclose(moments.mean, mean)
+    assert np.allclose(moments.std, std)
+    assert np.array_equal(moments.min, low) and np.array_equal(moments.max, high)
+    assert np.allclose(moments.slope, slope)
+
+
+def signal(n, seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = 100.0 + np.arange(n) / 100.0 + rng.random(n) * 1e-3
+    values = (np.cumsum(rng.normal(size=(n, 3)), axis=0) + [0, 50, -20]).astype(np.float32)
+    return timestamps, values
+
+
+def test_session_matches_reference():
+    timestamps, values = signal(5000)
+    stats = RunningStats(3)
+    for i in range(0, len(timestamps), 37):
+        stats.update(timestamps[i:i + 37], values[i:i + 37])
+    assert stats.session.n == 5000
+    check(stats.session, timestamps, values)
+
+
+def test_window_matches_brute_force():
+    timestamps, values = signal(6000, seed=1)
+    stats = RunningStats(3, window_sec=7.0)
+    blocks = list(range(0, len(timestamps), 50))
+    for k, i in enumerate(blocks):
+        stats.update(timestamps[i:i + 50], values[i:i + 50])
+        if k % 17 == 0 or k == len(blocks) - 1:
+            # Whole blocks whose newest sample is within the window of the newest sample overall
+            end = min(i + 50, len(timestamps))
+            first = next(j for j in blocks if timestamps[min(j + 50, end) - 1] >= timestamps[end - 1] - 7.0)
+            window = stats.window
+            assert window.n == end - first
+            check(window, timestamps[first:end], values[first:end])
+
+
+def test_nan_in_one_column_leaves_the_others_alone():
+    timestamps, values = signal(3000, seed=2)
+    values[:1000, 2] = np.nan  # A derived channel before its filter is designed
+    values[1500:1510, 2] = np.nan
+    stats = RunningStats(3)
+    for i in range(0, len(timestamps), 64):
+        stats.update(timestamps[i:i + 64], values[i:i + 64])
+    session = stats.session
+    assert session.n == 3000
+    assert session.count.tolist() == [3000, 3000, 1990]
+    check(session, timestamps, values)
+
+
+def test_all_nan_column_reports_nothing():
+    timestamps, values = signal(100)
+    values[:, 1] = np.nan
+    moments = Moments.of_block(timestamps, values)
+    assert moments.count[1] == 0 and moments.std[1] == 0 and moments.slope[1] == 0
+    assert not np.isfinite(moments.min[1]) and np.isfinite(moments.min[0])
+
+
+def test_window_shorter_than_a_block_keeps_the_newest_block():
+    timestamps, values = signal(1000, seed=3)
+    stats = RunningStats(3, window_sec=0.5)
+    for i in range(0, 1000, 200):  # 2 s blocks
+        stats.update(timestamps[i:i + 200], values[i:i + 200])
+    assert stats.window.n == 200
+    check(stats.window, timestamps[800:], values[800:])
+
+
+def test_update_from_matches_block_by_block():
+    timestamps, values = signal(5000, seed=4)
+    whole = RunningStats(3, window_sec=5.0)
+    whole.update_from(timestamps, values, chunk=333)
+    blocks = RunningStats(3, window_sec=5.0)
+    for i in range(0, 5000, 333):
+        blocks.update(timestamps[i:i + 333], values[i:i + 333])
+    for a, b in ((whole.session, blocks.session), (whole.window, blocks.window)):
+        assert a.n == b.n and np.allclose(a.mean, b.mean) and np.allclose(a.m2, b.m2)
+
+
+def test_reset_forgets_everything():
+    timestamps, values = signal(500)
+    stats = RunningStats(3)
+    stats.update(timestamps, values)
+    stats.reset()
+    assert stats.session.n == 0 and stats.window.n == 0
+    stats.update(timestamps[:100], values[:100])
+    check(stats.session, timestamps[:100], values[:100])
@@ -0,0 +1,86 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from shm_bus import SharedRingReader, SharedRingWriter, bus_name
+
+CAPACITY = 64
+_names = itertools.count()
+
+
+def samples(start, n):
+    """ n samples numbered from start: the number in the timestamp, channel 0 and the valve bits. """
+    seq = np.arange(start, start + n)
+    pressures = np.zeros((n, 8), dtype=np.float32)
+    pressures[:, 0] = seq
+    return seq.astype(np.float64), pressures, (seq % 256).astype(np.uint8)
+
+
+@pytest.fixture
+def writer():
+    writer = SharedRingWriter(bus_name(f'test{next(_names)}'), capacity=CAPACITY, metadata={'board': 'test'})
+    yield writer
+    writer.close()
+
+
+def seqs(block):
+    assert np.array_equal(block.pressures[:, 0], block.timestamps)
+    return block.timestamps.astype(int).tolist()
+
+
+def test_reader_tails_across_the_wrap(writer):
+    reader = SharedRingReader(writer.name)
+    assert reader.metadata['board'] == 'test' and reader.n_channels == 8
+    seen = []
+    for start in range(0, 300, 25):
+        writer.write(*samples(start, 25))
+        seen += seqs(reader.read())
+    assert seen == list(range(300)) and reader.samples_lost == 0
+    reader.close()
+
+
+def test_valve_bits_unpacked(writer):
+    reader = SharedRingReader(writer.name)
+    writer.write(*samples(5, 1))
+    assert reader.read().valves[0].tolist() == [True, False, True] + [False] * 5
+    reader.close()
+
+
+def test_lapped_reader_counts_lost_samples(writer):
+    reader = SharedRingReader(writer.name)
+    writer.write(*samples(0, 10))
+    assert seqs(reader.read()) == list(range(10))
+    writer.write(*samples(10, 190))  # The writer gets more than a ring ahead
+    assert seqs(reader.read()) == list(range(200 - CAPACITY, 200))
+    assert reader.samples_lost == 190 - CAPACITY
+    reader.close()
+
+
+def test_write_larger_than_ring(writer):
+    reader = SharedRingReader(writer.name)
+    writer.write(*samples(0, 3 * CAPACITY + 5))
+    assert seqs(reader.read()) == list(range(2 * CAPACITY + 5, 3 * CAPACITY + 5))
+    assert reader.samples_lost == 2 * CAPACITY + 5
+    reader.close()
+
+
+def test_from_start_and_max_samples(writer):
+    writer.write(*samples(0, 100))
+    late = SharedRingReader(writer.name)
+    assert late.available() == 0
+    reader = SharedRingReader(writer.name, from_start=True)
+    assert seqs(reader.read(max_samples=10)) == list(range(100 - CAPACITY, 110 - CAPACITY))
+    assert seqs(reader.read()) == list(range(110 - CAPACITY, 100))
+    assert len(reader.read()) == 0 and not reader.closed
+    late.close()
+    reader.close()
+
+
+def test_reader_sees_writer_close():
+    writer = SharedRingWriter(bus_name(f'test{next(_names)}'), capacity=CAPACITY)
+    reader = SharedRingReader(writer.name)
+    writer.header['closed'] = 1  # As close() does, without unmapping under the reader
+    assert reader.closed
+    reader.close()
+    writer.close()
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from stm32_crc import crc32_stm, crc32_stm_batch
+
+crcmod = pytest.importorskip('crcmod')
+
+
+def crcmod_crc(data):
+    crc = crcmod.Crc(0x104c11db7, initCrc=0xffffffff, rev=False)
+    crc.update(bytes(data))
+    return crc.crcValue
+
+
+@pytest.mark.parametrize('length', [0, 1, 3, 4, 7, 40, 41, 256])
+def test_crc32_stm_matches_crcmod(length):
+    data = np.random.default_rng(length).integers(0, 256, length, dtype=np.uint8).tobytes()
+    assert crc32_stm(data) == crcmod_crc(data)
+
+
+def test_batch_matches_crcmod():
+    frames = np.random.default_rng(0).integers(0, 256, (100, 40), dtype=np.uint8)
+    assert crc32_stm_batch(frames).tolist() == [crcmod_crc(frame) for frame in frames]
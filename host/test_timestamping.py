@@ -0,0 +1,65 @@
+import numpy as np
+
+from timestamping import SampleClock
+
+RATE_HZ = 1000.3
+BURST = 20
+T0 = 1.7e9
+MIN_LATENCY = 0.002
+
+
+def arrivals(n_bursts, first_sample=0, seed=0):
+    """ Arrival times of bursts of BURST samples: the last sample's true time, plus a latency of at
+    least MIN_LATENCY with exponential jitter. """
+    rng = np.random.default_rng(seed)
+    last = first_sample + BURST * np.arange(1, n_bursts + 1) - 1
+    return T0 + last / RATE_HZ + MIN_LATENCY + rng.exponential(0.002, n_bursts)
+
+
+def test_fit_converges_to_the_device_rate_and_lower_envelope():
+    clock = SampleClock()
+    stamped = [clock.stamp(BURST, arrival)[0] for arrival in arrivals(400)]
+    assert abs(1 / clock.period - RATE_HZ) < 0.05
+    timestamps = np.concatenate(stamped[-100:])
+    true = T0 + np.arange(300 * BURST, 400 * BURST) / RATE_HZ
+    # The envelope sits at the fastest arrivals, so the model is the true time plus about the minimum latency
+    assert np.all(np.abs(timestamps - true - MIN_LATENCY) < 0.5e-3)
+    # Evenly spaced (to float64 resolution at 1.7e9 s), with small steps where the model is refitted
+    steps = np.abs(np.diff(timestamps) - 1 / RATE_HZ)
+    assert np.mean(steps < 1e-6) > 0.99 and steps.max() < 0.5e-3
+    stats = clock.stats()
+    assert stats['burst_mean'] == BURST and stats['clock_resets'] == 0
+    assert 0 < stats['latency_ms'] < 5
+
+
+def test_timestamps_never_after_arrival_or_backwards():
+    clock = SampleClock()
+    previous = -np.inf
+    for arrival in arrivals(200, seed=1):
+        timestamps, raw = clock.stamp(BURST, arrival)
+        assert np.all(timestamps <= arrival) and np.all(raw == arrival)
+        assert np.all(np.diff(timestamps) >= 0) and timestamps[0] >= previous
+        previous = timestamps[-1]
+
+
+def test_reported_gap_keeps_the_fit():
+    clock = SampleClock()
+    for arrival in arrivals(200):
+        clock.stamp(BURST, arrival)
+    clock.skip(5 * BURST)  # Lost to CRC errors, but counted
+    for arrival in arrivals(50, first_sample=205 * BURST):
+        clock.stamp(BURST, arrival)
+    assert clock.resets == 0 and clock.samples_skipped == 5 * BURST
+
+
+def test_unreported_gap_resets_the_fit():
+    clock = SampleClock()
+    for arrival in arrivals(200):
+        clock.stamp(BURST, arrival)
+    # A second's worth of samples lost without the counter knowing
+    later = arrivals(200, first_sample=200 * BURST + int(RATE_HZ))
+    clock.stamp(BURST, later[0])
+    assert clock.resets == 1 and clock.period is None
+    for arrival in later[1:]:
+        clock.stamp(BURST, arrival)
+    assert abs(1 / clock.period - RATE_HZ) < 0.1
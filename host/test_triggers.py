@@ -0,0 +1,68 @@
+import numpy as np
+
+from data_series import SampleBlock
+from recording import RecordingReader, default_channels
+from triggers import Level, Trigger, TriggerEngine
+
+
+def blocks(values, size):
+    """ values (one per sample, on channel 0) as SampleBlocks of size samples; t = sample number. """
+    n = len(values)
+    pressures = np.zeros((n, 8), dtype=np.float32)
+    pressures[:, 0] = values
+    timestamps = np.arange(n, dtype=np.float64)
+    return [SampleBlock(timestamps[i:i + size], pressures[i:i + size], np.zeros((min(size, n - i), 8), bool))
+            for i in range(0, n, size)]
+
+
+def run(trigger, values, size):
+    events = []
+    trigger.bind(default_channels())
+    for block in blocks(values, size):
+        trigger.process(block, lambda t, samples, t0, number, index: events.append((samples, t0, number, index)))
+    return events
+
+
+def test_capture_window_across_block_boundaries():
+    values = np.arange(2000) % 1000  # Crosses 500 upwards at samples 501 and 1501
+    for size in (1, 37, 100, 2000):
+        events = run(Trigger('level', Level(0, 500), pre_samples=100, post_samples=50), values, size)
+        assert [(t0, number, index) for samples, t0, number, index in events] == [(501, 1, 100), (1501, 2, 100)]
+        for samples, t0, number, index in events:
+            assert samples.timestamps.tolist() == list(range(int(t0) - 100, int(t0) + 50))
+            assert samples.pressures[index, 0] == values[int(t0)]
+
+
+def test_short_history_at_start():
+    values = np.arange(200)
+    samples, t0, number, index = run(Trigger('level', Level(0, 30), pre_samples=100, post_samples=10),
+                                     values, 16)[0]
+    # Already true at the first sample doesn't count as a crossing; 31 is the first sample above
+    assert (t0, index) == (31, 31)
+    assert samples.timestamps.tolist() == list(range(0, 41))
+
+
+def test_holdoff_suppresses_retriggering():
+    values = np.tile([0, 10], 50)  # Crosses every other sample
+    events = run(Trigger('level', Level(0, 5), pre_samples=0, post_samples=1, holdoff_sec=20), values, 7)
+    assert [t0 for samples, t0, number, index in events] == [1, 21, 41, 61, 81]
+
+
+def test_engine_writes_captures(tmp_path):
+    engine = TriggerEngine(str(tmp_path), [Trigger('level', Level(0, 500), pre_samples=10, post_samples=5)],
+                           prefix='board0_', metadata={'board': 'board0'})
+    for block in blocks(np.arange(1200) % 1000, 64):
+        engine.process(None, block)
+    engine.close()
+    assert len(engine.filenames) == 1
+    reader = RecordingReader(engine.filenames[0])
+    assert reader.timestamps.tolist() == list(range(491, 506))
+    assert reader.header['trigger_index'] == 10 and reader.header['board'] == 'board0'
+
+
+def test_capture_in_progress_is_saved_on_close(tmp_path):
+    engine = TriggerEngine(str(tmp_path), [Trigger('level', Level(0, 500), pre_samples=10, post_samples=1000)])
+    for block in blocks(np.arange(600), 64):
+        engine.process(None, block)
+    engine.close()
+    assert len(RecordingReader(engine.filenames[0])) == 10 + 99
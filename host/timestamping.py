@@ -0,0 +1,146 @@
+""" Sample timestamps reconstructed from a per-device sample counter and a fitted clock model.
+
+The board samples at a fixed (but not exactly known) rate and sends no timestamps of its own, while
+USB CDC delivers its frames in bursts, so stamping each sample with its arrival time gives jitter of
+several ms and stacks of identical timestamps. Instead SampleClock numbers the samples from each
+board (counting frames lost to CRC errors or resyncs, so the numbering follows the device) and fits
+
+    t(index) = offset + period * index
+
+to the arrival time of the newest sample in each burst. The period (the device's real sample rate,
+drift included) is a least-squares fit over the last FIT_WINDOW_BURSTS bursts; the offset is the
+lower envelope of the arrivals, since a sample can arrive late but never before it was taken.
+Samples get evenly spaced timestamps from the model, the raw arrival times are kept alongside, and
+the residuals (arrival - model) give the transport's latency and jitter.
+
+All times come from now(): time.monotonic() shifted once to the wall clock, so they read like
+time.time() but don't jump when the system clock is changed.
+"""
+import time
+
+import numpy as np
+
+FIT_WINDOW_BURSTS = 512
+REFIT_INTERVAL_BURSTS = 16
+MIN_FIT_BURSTS = 8
+MIN_FIT_SPAN_SEC = 0.2
+# Arrivals further than this from the model mean the counter has lost track (unreported gap, device
+# reset, stalled port), so the fit starts over
+MAX_RESIDUAL_SEC = 0.25
+
+_WALL_CLOCK_OFFSET = time.time() - time.monotonic()
+
+
+def now():
+    """ Monotonic host time in seconds since the epoch. """
+    return time.monotonic() + _WALL_CLOCK_OFFSET
+
+
+class SampleClock:
+    """ Timestamps for one board's samples. stamp() is called once per received burst, in order. """
+
+    def __init__(self, window=FIT_WINDOW_BURSTS, refit_interval=REFIT_INTERVAL_BURSTS):
+        self.window = window
+        self.refit_interval = refit_interval
+
+        # Ring of (index of the burst's last sample, its arrival time) for the fit
+        self._burst_index = np.zeros(window, dtype=np.float64)
+        self._burst_arrival = np.zeros(window, dtype=np.float64)
+        self._burst_size = np.zeros(window, dtype=np.int64)
+        self.bursts = 0  # Bursts since the last reset
+        self._since_fit = 0
+
+        self.next_index = 0  # Device sample counter
+        self.period = None  # Fitted seconds per sample, None until enough bursts are seen
+        self.offset = None
+        self.last_arrival = None
+        self.last_timestamp = -np.inf
+        self.resets = 0
+        self.samples_skipped = 0
+
+    def skip(self, n):
+        """ n samples were sent by the device but lost (bad CRC, resync); they still used up indices. """
+        self.next_index += n
+        self.samples_skipped += n
+
+    def stamp(self, n, arrival):
+        """ Timestamps for the next n samples, which arrived together at host time arrival.
+        Returns (smoothed, raw): evenly spaced model timestamps and the arrival time of each sample. """
+        indices = np.arange(self.next_index, self.next_index + n, dtype=np.float64)
+        self.next_index += n
+
+        if self.period is not None and abs(arrival - self.model(indices[-1])) > MAX_RESIDUAL_SEC:
+            print(f'Sample clock lost track ({(arrival - self.model(indices[-1])) * 1e3:.0f} ms off), refitting')
+            self.reset()
+        self._add_burst(indices[-1], arrival, n)
+
+        if self.period is not None:
+            timestamps = self.model(indices)
+        elif self.last_arrival is not None and self.last_arrival < arrival:
+            # No model yet: spread the burst evenly since the previous one
+            timestamps = self.last_arrival + (arrival - self.last_arrival) * np.arange(1, n + 1) / n
+        else:
+            timestamps = np.full(n, arrival)
+        # Never later than the arrival, and never before a timestamp already handed out
+        timestamps = np.maximum.accumulate(np.maximum(np.minimum(timestamps, arrival), self.last_timestamp))
+
+        self.last_arrival = arrival
+        self.last_timestamp = timestamps[-1]
+        return timestamps, np.full(n, arrival)
+
+    def model(self, index):
+        return self.offset + self.period * index
+
+    def _add_burst(self, index, arrival, n):
+        slot = self.bursts % self.window
+        self._burst_index[slot] = index
+        self._burst_arrival[slot] = arrival
+        self._burst_size[slot] = n
+        self.bursts += 1
+        self._since_fit += 1
+        if self.period is None or self._since_fit >= self.refit_interval:
+            self._fit()
+        else:
+            # Between fits only the envelope can move, and only down
+            self.offset = min(self.offset, arrival - self.period * index)
+
+    def _fit(self):
+        count = min(self.bursts, self.window)
+        index, arrival = self._burst_index[:count], self._burst_arrival[:count]
+        if count < MIN_FIT_BURSTS or arrival.max() - arrival.min() < MIN_FIT_SPAN_SEC:
+            return
+        # Centred for numerical stability: arrival times are ~1e9 s
+        i0, t0 = index.mean(), arrival.mean()
+        di = index - i0
+        period = np.dot(di, arrival - t0) / np.dot(di, di)
+        if period <= 0:
+            return
+        self.period = period
+        self.offset = np.min(arrival - period * index)
+        self._since_fit = 0
+
+    def reset(self):
+        """ Forget the fit (the counter keeps running). """
+        self.bursts = 0
+        self._since_fit = 0
+        self.period = None
+        self.offset = None
+        self.resets += 1
+
+    def stats(self):
+        """ Inferred sample rate (Hz), transport latency above the fastest arrival and its jitter (ms,
+        mean/std/p99 over the fit window), and burst sizes (samples per arrival). """
+        count = min(self.bursts, self.window)
+        stats = {'rate_hz': None, 'latency_ms': None, 'jitter_ms': None, 'jitter_p99_ms': None,
+                 'burst_mean': None, 'burst_max': None, 'clock_resets': self.resets}
+        if count:
+            sizes = self._burst_size[:count]
+            stats['burst_mean'] = float(sizes.mean())
+            stats['burst_max'] = int(sizes.max())
+        if self.period is not None:
+            residuals = (self._burst_arrival[:count] - self.model(self._burst_index[:count])) * 1e3
+            stats['rate_hz'] = 1 / self.period
+            stats['latency_ms'] = float(residuals.mean())
+            stats['jitter_ms'] = float(residuals.std())
+            stats['jitter_p99_ms'] = float(np.percentile(np.abs(residuals - residuals.mean()), 99))
+        return stats
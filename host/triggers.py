@@ -0,0 +1,359 @@
+""" Oscilloscope-style triggered capture: keep only the interesting moments of a long session.
+
+A Trigger watches one board's sample stream (a Board listener, so derived channels from dsp work
+too) for a condition and, each time it fires, saves pre_samples of history before the trigger
+point and post_samples after it as a small recording file of its own. Conditions are evaluated
+on whole blocks with numpy, carrying what they need (the previous sample) across blocks:
+
+    Level(channel, threshold, above=True)       channel above (or below) a threshold
+    Edge(channel, threshold, rising=True)       channel crosses a threshold (rising=None: either way)
+    Slope(channel, rate, above=True)            dP/dt above (or below) rate per second
+    ValveChange(valve, opened=None)             a valve opens, closes (or either, with None)
+    All(...), Any(...), Not(...)                boolean combinations
+
+A trigger fires where its condition becomes true, then stays quiet until its capture is complete
+and holdoff_sec has passed. History lives in a fixed ring of pre_samples rows per trigger, and
+files are written on a background thread, so the board's thread never waits on the disk.
+
+Triggers can be described in JSON, e.g.
+
+    [{"name": "burst", "pre_samples": 2000, "post_samples": 5000,
+      "condition": {"type": "any", "conditions": [
+          {"type": "slope", "channel": 0, "rate": 50},
+          {"type": "valve_change", "valve": 3}]}}]
+
+where channels are column numbers or channel names ('P[0]', or a dsp stage's name).
+"""
+import abc
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from data_series import SampleBlock
+from protocol import N_CHANNELS
+from recording import RECORDING_EXTENSION, block_to_records, default_channels, make_header, unique_filename
+
+DEFAULT_PRE_SAMPLES = 1000
+DEFAULT_POST_SAMPLES = 1000
+MAX_QUEUED_EVENTS = 64
+
+_STOP = object()
+
+
+def _column(channels, channel):
+    """ Column index for a channel given by number or by name. """
+    if isinstance(channel, str):
+        names = [c['name'] for c in channels]
+        if channel not in names:
+            raise ValueError(f'No channel named {channel!r}')
+        return names.index(channel)
+    if not 0 <= channel < len(channels):
+        raise ValueError(f'No channel {channel}')
+    return channel
+
+
+class Condition(abc.ABC):
+    """ evaluate(block) returns a bool per sample. bind() resolves channel names before first use. """
+
+    def bind(self, channels):
+        pass
+
+    @abc.abstractmethod
+    def evaluate(self, block):
+        pass
+
+    def reset(self):
+        pass
+
+
+class Level(Condition):
+    def __init__(self, channel, threshold, above=True):
+        self.channel = channel
+        self.threshold = threshold
+        self.above = above
+
+    def bind(self, channels):
+        self.column = _column(channels, self.channel)
+
+    def evaluate(self, block):
+        x = block.pressures[:, self.column]
+        return x > self.threshold if self.above else x < self.threshold
+
+
+class Edge(Condition):
+    def __init__(self, channel, threshold, rising=True):
+        self.channel = channel
+        self.threshold = threshold
+        self.rising = rising
+        self.previous = None
+
+    def bind(self, channels):
+        self.column = _column(channels, self.channel)
+
+    def evaluate(self, block):
+        above = block.pressures[:, self.column] > self.threshold
+        before = np.concatenate(([above[0] if self.previous is None else self.previous], above[:-1]))
+        self.previous = above[-1]
+        if self.rising is None:
+            return above != before
+        return above & ~before if self.rising else ~above & before
+
+    def reset(self):
+        self.previous = None
+
+
+class Slope(Condition):
+    def __init__(self, channel, rate, above=True):
+        self.channel = channel
+        self.rate = rate
+        self.above = above
+        self.previous = None  # (timestamp, value)
+
+    def bind(self, channels):
+        self.column = _column(channels, self.channel)
+
+    def evaluate(self, block):
+        x = block.pressures[:, self.column].astype(np.float64)
+        t_prev, x_prev = (block.timestamps[0], x[0]) if self.previous is None else self.previous
+        dt = np.diff(block.timestamps, prepend=t_prev)
+        dx = np.diff(x, prepend=x_prev)
+        self.previous = (block.timestamps[-1], x[-1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = np.where(dt > 0, dx / dt, 0.0)
+        return slope > self.rate if self.above else slope < self.rate
+
+    def reset(self):
+        self.previous = None
+
+
+class ValveChange(Condition):
+    def __init__(self, valve, opened=None):
+        self.valve = valve
+        self.opened = opened
+        self.previous = None
+
+    def evaluate(self, block):
+        state = block.valves[:, self.valve]
+        before = np.concatenate(([state[0] if self.previous is None else self.previous], state[:-1]))
+        self.previous = state[-1]
+        if self.opened is None:
+            return state != before
+        return state & ~before if self.opened else ~state & before
+
+    def reset(self):
+        self.previous = None
+
+
+class All(Condition):
+    def __init__(self, *conditions):
+        self.conditions = conditions
+
+    def bind(self, channels):
+        for condition in self.conditions:
+            condition.bind(channels)
+
+    def evaluate(self, block):
+        # Every condition sees every block, so stateful ones stay in step
+        return np.logical_and.reduce([condition.evaluate(block) for condition in self.conditions])
+
+    def reset(self):
+        for condition in self.conditions:
+            condition.reset()
+
+
+class Any(All):
+    def evaluate(self, block):
+        return np.logical_or.reduce([condition.evaluate(block) for condition in self.conditions])
+
+
+class Not(All):
+    def __init__(self, condition):
+        super().__init__(condition)
+
+    def evaluate(self, block):
+        return ~self.conditions[0].evaluate(block)
+
+
+CONDITION_TYPES = {
+    'level': Level,
+    'edge': Edge,
+    'slope': Slope,
+    'valve_change': ValveChange,
+}
+
+
+def condition_from_config(spec):
+    spec = dict(spec)
+    kind = spec.pop('type')
+    if kind in ('all', 'any'):
+        return (All if kind == 'all' else Any)(*[condition_from_config(c) for c in spec['conditions']])
+    if kind == 'not':
+        return Not(condition_from_config(spec['condition']))
+    if kind not in CONDITION_TYPES:
+        raise ValueError(f'Unknown condition type {kind!r}')
+    return CONDITION_TYPES[kind](**spec)
+
+
+class Trigger:
+    """ A named condition with its capture window and its own pre-trigger ring. """
+
+    def __init__(self, name, condition, pre_samples=DEFAULT_PRE_SAMPLES, post_samples=DEFAULT_POST_SAMPLES,
+                 holdoff_sec=0.0):
+        self.name = name
+        self.condition = condition
+        self.pre_samples = pre_samples
+        self.post_samples = max(post_samples, 1)
+        self.holdoff_sec = holdoff_sec
+        self.events = 0
+
+    @classmethod
+    def from_config(cls, spec):
+        spec = dict(spec)
+        return cls(condition=condition_from_config(spec.pop('condition')), **spec)
+
+    def bind(self, channels):
+        self.condition.bind(channels)
+        n_channels = len(channels)
+        self.ring_t = np.zeros(self.pre_samples)
+        self.ring_p = np.zeros((self.pre_samples, n_channels), dtype=np.float32)
+        self.ring_v = np.zeros((self.pre_samples, N_CHANNELS), dtype=bool)
+        self.ring_fill = 0
+        self.ring_end = 0  # Row after the newest sample
+        self.was_true = None
+        self.capture = None  # (parts, trigger time, event number, pre-trigger samples) being captured
+        self.capture_remaining = 0
+        self.quiet_until = -np.inf
+
+    def _history(self):
+        """ The ring's contents, oldest first. """
+        order = np.roll(np.arange(self.pre_samples), -self.ring_end)[self.pre_samples - self.ring_fill:]
+        return SampleBlock(self.ring_t[order], self.ring_p[order], self.ring_v[order])
+
+    def _remember(self, block):
+        n = min(len(block), self.pre_samples)
+        if n == 0:
+            return
+        rows = (self.ring_end + np.arange(n)) % self.pre_samples
+        self.ring_t[rows] = block.timestamps[-n:]
+        self.ring_p[rows] = block.pressures[-n:]
+        self.ring_v[rows] = block.valves[-n:]
+        self.ring_end = (self.ring_end + n) % self.pre_samples
+        self.ring_fill = min(self.ring_fill + n, self.pre_samples)
+
+    def process(self, block, on_event):
+        """ Evaluate one block; calls on_event(trigger, samples, trigger_time, number, trigger_index)
+        for every capture completed. """
+        n = len(block)
+        if n == 0:
+            return
+        mask = self.condition.evaluate(block)
+        before = np.concatenate(([mask[0] if self.was_true is None else self.was_true], mask[:-1]))
+        self.was_true = mask[-1]
+        fired = np.flatnonzero(mask & ~before)
+
+        i = 0
+        while i < n:
+            if self.capture is not None:
+                take = min(self.capture_remaining, n - i)
+                self.capture[0].append(SampleBlock(block.timestamps[i:i + take], block.pressures[i:i + take],
+                                                   block.valves[i:i + take]))
+                self.capture_remaining -= take
+                i += take
+                if self.capture_remaining == 0:
+                    self._finish(on_event)
+                continue
+            candidates = fired[fired >= i]
+            candidates = candidates[block.timestamps[candidates] >= self.quiet_until]
+            if not len(candidates):
+                break
+            start = candidates[0]
+            # History: the ring (samples before this block) then this block up to the trigger point
+            pre = SampleBlock.concatenate([self._history(), SampleBlock(block.timestamps[:start],
+                                                                         block.pressures[:start],
+                                                                         block.valves[:start])])
+            keep = slice(max(len(pre) - self.pre_samples, 0), None) if self.pre_samples else slice(len(pre), None)
+            history = SampleBlock(pre.timestamps[keep], pre.pressures[keep], pre.valves[keep])
+            self.events += 1
+            self.capture = ([history], float(block.timestamps[start]), self.events, len(history))
+            self.capture_remaining = self.post_samples
+            i = start
+        self._remember(block)
+
+    def _finish(self, on_event):
+        parts, trigger_time, number, trigger_index = self.capture
+        self.capture = None
+        self.quiet_until = trigger_time + self.holdoff_sec
+        on_event(self, SampleBlock.concatenate(parts), trigger_time, number, trigger_index)
+
+    def flush(self, on_event):
+        """ Save a capture still waiting for post-trigger samples, as far as it got. """
+        if self.capture is not None:
+            self._finish(on_event)
+
+
+class TriggerEngine:
+    """ A board's triggers and the thread that writes their captures to directory. Use process() as
+    a Board listener. """
+
+    def __init__(self, directory, triggers=(), channels=None, metadata=None, prefix=''):
+        self.directory = directory
+        self.prefix = prefix  # Added to file names, e.g. the board name when boards share a directory
+        self.channels = channels or default_channels()
+        self.metadata = metadata or {}
+        self.triggers = []
+        for trigger in triggers:
+            self.add(trigger)
+
+        self.filenames = []
+        self.events_dropped = 0
+        self.queue = queue.Queue(maxsize=MAX_QUEUED_EVENTS)
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name='trigger-writer', daemon=True)
+        self.thread.start()
+
+    def add(self, trigger):
+        trigger.bind(self.channels)
+        self.triggers = self.triggers + [trigger]
+
+    def process(self, board, block):
+        for trigger in self.triggers:
+            trigger.process(block, self._on_event)
+
+    def _on_event(self, trigger, samples, trigger_time, number, trigger_index):
+        try:
+            self.queue.put_nowait((trigger.name, samples, trigger_time, number, trigger_index))
+        except queue.Full:
+            self.events_dropped += 1
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            name, samples, trigger_time, number, trigger_index = item
+            stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(trigger_time))
+            filename = unique_filename(
+                os.path.join(self.directory, f'trigger_{stamp}_{self.prefix}{name}_{number}{RECORDING_EXTENSION}'))
+            metadata = dict(self.metadata, trigger=name, trigger_time=trigger_time, trigger_index=trigger_index)
+            with open(filename, 'wb') as f:
+                f.write(make_header(metadata, self.channels))
+                f.write(block_to_records(samples).tobytes())
+            self.filenames.append(filename)
+            print(f'{name}: captured {len(samples)} samples to {filename}')
+
+    def close(self):
+        """ Save captures in progress and wait for every file to be written. """
+        for trigger in self.triggers:
+            trigger.flush(self._on_event)
+        self.queue.put(_STOP)
+        self.thread.join()
+
+
+def load_config(filename):
+    """ Trigger descriptions from a JSON file; build with Trigger.from_config. """
+    with open(filename) as f:
+        return json.load(f)